@@ -16,12 +16,15 @@
 
 import datacube
 from datacube.index.hl import Doc2Dataset
+from datacube.utils import changes
 from eodatasets3 import serialise
 
+import dask
 import numpy as np
 import rioxarray as rxr
 import xarray as xr
 
+import json
 import time
 from dask.distributed import LocalCluster, Client
 import tempfile
@@ -30,6 +33,8 @@ from pathlib import Path
 from utils.metadata import prepare_eo3_metadata_NAS, reorder_measurements
 from utils.utils import mkdir, setup_logger
 from utils.utils import nas_patch
+from utils.cog_writer import write_cogs
+from utils.running_stats import BLOCK_ROWS, iter_composite_blocks, load_composites_lazily, SumAccumulator, moments, mean_std, robust_statistics, as_dataarray
 
 # Ignore warnings
 import warnings
@@ -39,163 +44,278 @@ warnings.filterwarnings('ignore')
 logging.getLogger("distributed.worker.memory").setLevel(logging.ERROR)
 
 
-def baseline_metrics(baseline_start: str, baseline_end: str, tile_id: str):
+SPECTRAL_INDICES = ["NDVI", "EVI", "PSRI2"]
+ROBUST_PERCENTILES = (10, 90)
+
+
+def _block_mean_std(block, nodata):
+    """`mean_std` of the int64 `moments` of a dask block, over its last (time) axis."""
+    return mean_std(*moments(block, nodata, axis=-1))
+
+
+def baseline_in_memory(dc, tile_id, baseline_start, baseline_end, spectral_index):
+    """
+    Mean and standard deviation (float32) of one index over the baseline period, from its whole int16 time series,
+    reduced block by block on the Dask cluster with exact int64 sums (`moments`).
+    """
+    logging.info(f'Lazy loading time series')
+    ds = dc.load(
+        product='composites',
+        region_code=tile_id.replace('_',''),
+        time=(baseline_start, baseline_end),
+        measurements=[spectral_index],
+        dask_chunks=dict(x=512, y=512),
+        patch_url=nas_patch
+    )
+    da = ds[spectral_index].chunk(time=-1)
+    
+    logging.info(f'Computing Mean (M) and Standard Deviation (SD) from int64 sums')
+    base_vi_mean, base_vi_std = xr.apply_ufunc(
+        _block_mean_std, da,
+        input_core_dims=[['time']],
+        output_core_dims=[[], []],
+        dask='parallelized',
+        output_dtypes=['float32', 'float32'],
+        kwargs=dict(nodata=da.attrs.get('nodata', -9999)),
+    )
+    base_vi_mean, base_vi_std = dask.compute(base_vi_mean, base_vi_std)
+    return base_vi_mean, base_vi_std
+
+
+def baseline_streaming(dc, tile_id, baseline_start, baseline_end, spectral_indices=SPECTRAL_INDICES):
+    """
+    Mean and standard deviation (float32) of each index over the baseline period, from per-pixel exact int64
+    count, sum and sum of squares (`SumAccumulator`), updated one composite month and one block of rows at a time:
+    memory is O(pixels), whatever the length of the period. Returns {index: (mean, std)}.
+    """
+    blocks = iter_composite_blocks(dc, tile_id, (baseline_start, baseline_end), spectral_indices)
+    _, _, first = next(blocks)
+    geobox = first.odc.geobox
+    nodata = {si: first[si].attrs.get('nodata', -9999) for si in spectral_indices}
+    stats = {si: SumAccumulator((geobox.height, geobox.width)) for si in spectral_indices}
+    logging.info(f'Running statistics of {len(spectral_indices)} indices: {round(sum(a.nbytes() for a in stats.values())/1024**2)} MiB')
+
+    for _, rows, values in blocks:
+        for si in spectral_indices:
+            stats[si].update(values[si], rows, nodata[si])
+
+    return {
+        si: (as_dataarray(acc.mean(), geobox, f'{si}_mean'), as_dataarray(acc.std(), geobox, f'{si}_std'))
+        for si, acc in stats.items()
+    }
+
+
+def baseline_dataset(layers, baseline_start, baseline_end, tile_id):
+    """
+    The `baseline` dataset of a tile: the {index: (mean, std)} layers (or {index: {statistic: layer}}, e.g. of
+    `baseline_robust_streaming`) scaled to int16 with nodata -32768, and the time range and tile ID in its metadata.
+    """
+    ds_vi_list = []
+    for spectral_index, statistics in layers.items():
+        if isinstance(statistics, tuple):
+            statistics = dict(zip(('mean', 'std'), statistics))
+        logging.info(f'Assigning names to xr.DataArrays')
+        for stat, base_vi in statistics.items():
+            base_vi.name = f'{spectral_index}_{stat}'
+        
+        logging.info(f'Merge into xr.Dataset')
+        base_vi_ds = xr.merge([base_vi.to_dataset() for base_vi in statistics.values()])
+        
+        logging.info(f'Scale and nodata -32768')
+        logging.info(f'Configure metadata of baseline dataset')
+        for var in [f'{spectral_index}_{stat}' for stat in statistics]:
+            scale = 1
+            dtype = 'int16'
+            nodata = np.iinfo(np.int16).min #-32768
+            base_vi_ds[var] = (base_vi_ds[var]*scale).round()
+            base_vi_ds[var] = base_vi_ds[var].fillna(nodata).astype(dtype)
+            base_vi_ds[var] = base_vi_ds[var].rio.write_nodata(nodata, inplace=True)
+            base_vi_ds[var].encoding.update({"dtype": dtype})
+
+        logging.info(f'Append baseline dataset of {spectral_index} in list')
+        for stat in statistics:
+            ds_vi_list.append(base_vi_ds[f'{spectral_index}_{stat}'])
+    
+    logging.info('Done with computing baseline of all spectral indices')
+    logging.info('Now creating the overall baseline dataset')
+    base_ds = xr.merge(ds_vi_list)
+    logging.info('Overall baseline dataset constructed')
+    
+    logging.info('Assign time range and tile ID in metadata')
+    base_ds.attrs['dtr:start_datetime']=baseline_start
+    base_ds.attrs['dtr:end_datetime']=baseline_end
+    base_ds.attrs['odc:region_code']=tile_id
+    return base_ds
+
+
+def find_baselines(dc, tile_id, baseline_start=None, baseline_end=None, product_name='baseline'):
+    """
+    The `baseline` (or `baseline_robust`) datasets of a tile, of the window `baseline_start` to `baseline_end`
+    ('YYYY-MM-DD', the dataset time range) if given: a tile has one dataset per window built.
+    """
+    datasets = dc.find_datasets(product=product_name, region_code=tile_id.replace('_',''))
+    if baseline_start is not None:
+        datasets = [d for d in datasets if d.time.begin.strftime('%Y-%m-%d') == baseline_start]
+    if baseline_end is not None:
+        datasets = [d for d in datasets if d.time.end.strftime('%Y-%m-%d') == baseline_end]
+    return datasets
+
+
+def write_baseline(dc, base_ds, tile_id, baseline_start, baseline_end, product_name='baseline', dataset_id=None):
+    """
+    Write a `baseline` (or `baseline_robust`) dataset to the NAS as COGs with its EO3/STAC metadata, and index it.
+    With the `dataset_id` of the indexed dataset of the same window, it is updated in place instead of added
+    again. Returns the dataset id.
+    """
+    logging.info('Create directories and naming conversions')   
+    NASROOT='//nas-rs.topo.auth.gr/Latomeia/DROUGHT'
+    PRODUCT_NAME = product_name
+    FOLDER=f'{PRODUCT_NAME}/{tile_id.split('_')[0]}/{tile_id.split('_')[1]}/{baseline_start.replace('-','')}_{baseline_end.replace('-','')}'
+    DATASET= f'S2L2A_{PRODUCT_NAME}_{tile_id.replace('_','')}_{baseline_start.replace('-','')}_{baseline_end.replace('-','')}'
+    
+    dataset_path = f"{NASROOT}/{FOLDER}"
+    mkdir(dataset_path)
+    eo3_path = f'{dataset_path}/{DATASET}.odc-metadata.yaml'
+    stac_path = f'{dataset_path}/{DATASET}.stac-metadata.json'
+    logging.info(f'Dataset location: {dataset_path}')
+    
+    logging.info(f'Writing GTiff (COG) to disk')
+    gc.collect()
+    name_measurements = list(write_cogs(base_ds, lambda var: f'{dataset_path}/{DATASET}_{var}.tif').values())
+    relative_name_measurements = [p.split("/")[-1] for p in name_measurements]
+        
+    logging.info(f'Assert relative paths and product measurements are matched')
+    relative_name_measurements = reorder_measurements(
+        product=PRODUCT_NAME, 
+        relative_name_measurements=relative_name_measurements,
+        dc=dc)
+    
+    
+    logging.info('Prepare metadata YAML document')
+    yyyy = int(baseline_start[0:4])
+    mm = int(baseline_start[5:7])
+    dd = int(baseline_start[8:10])
+    datetime_list = [yyyy, mm, dd]    
+    eo3_doc, stac_doc = prepare_eo3_metadata_NAS(
+        dc=dc,
+        xr_cube=base_ds, 
+        collection_path=Path(NASROOT),
+        dataset_name=DATASET,
+        product_name=PRODUCT_NAME,
+        product_family='ard',
+        name_measurements=relative_name_measurements,
+        datetime_list=datetime_list,
+        set_range=True,
+        lineage_path=None,
+        version=1,
+        dataset_id=dataset_id,
+        )
+    
+    logging.info('Write metadata YAML document to disk')
+    serialise.to_path(Path(eo3_path), eo3_doc)
+    with open(stac_path, 'w') as json_file:
+        json.dump(stac_doc, json_file, indent=4, default=False)
+    
+    logging.info('Create datacube.model.Dataset from eo3 metadata')
+    WORKING_ON_CLOUD=False
+    uri = eo3_path if WORKING_ON_CLOUD else f"file:///{eo3_path}"
+
+    resolver = Doc2Dataset(dc.index)
+    dataset_tobe_indexed, err  = resolver(doc_in=serialise.to_doc(eo3_doc), uri=uri)
+    
+    if err:
+        msg=f'✖✖✖ FAILED loading for : Tile {tile_id} | with Exception: {err}' # ✗
+        logging.error(msg)
+        logging.info('#######################################################################')
+        raise RuntimeError(msg)
+        
+    if dataset_id is not None:
+        logging.info(f'Update dataset {dataset_id} in datacube')
+        dc.index.datasets.update(dataset_tobe_indexed, updates_allowed={('properties',): changes.allow_any})
+    else:
+        logging.info('Index to datacube')
+        dc.index.datasets.add(dataset=dataset_tobe_indexed, with_lineage=False)
+    return dataset_tobe_indexed.id
+
+
+def baseline_robust_streaming(dc, tile_id, baseline_start, baseline_end, percentiles=ROBUST_PERCENTILES, spectral_indices=SPECTRAL_INDICES, block_rows=BLOCK_ROWS):
+    """
+    Exact median, MAD and `percentiles` of each index over the baseline period, from radix histograms of one block
+    of rows of one index at a time (`robust_statistics`): memory is bounded by the block, whatever the length of
+    the period. The composites are opened lazily once; each block is read 4 times (2 passes for the median and
+    percentiles, 2 for the MAD). Returns {index: {'median', 'mad', 'p10', ...: float32 layer}}.
+    """
+    lazy = [ds for _, ds in load_composites_lazily(dc, tile_id, (baseline_start, baseline_end), spectral_indices, block_rows=block_rows)]
+    logging.info(f'Robust baseline of {tile_id} from {len(lazy)} composites')
+    geobox = lazy[0].odc.geobox
+    nodata = {si: lazy[0][si].attrs.get('nodata', -9999) for si in spectral_indices}
+    stats = ['median', 'mad'] + [f'p{p}' for p in percentiles]
+    layers = {si: {stat: np.full(geobox.shape, np.nan, 'float32') for stat in stats} for si in spectral_indices}
+
+    for y0 in range(0, geobox.height, block_rows):
+        t0 = time.time()
+        rows = slice(y0, min(y0 + block_rows, geobox.height))
+        for si in spectral_indices:
+            read = lambda: (ds[si].isel(y=rows).values for ds in lazy)
+            for stat, values in robust_statistics(read, nodata[si], percentiles).items():
+                layers[si][stat][rows] = values
+        logging.info(f'        rows {rows.start}-{rows.stop} of {geobox.height} in {round(time.time() - t0, 1)} s')
+
+    return {si: {stat: as_dataarray(values, geobox, f'{si}_{stat}') for stat, values in by_stat.items()} for si, by_stat in layers.items()}
+
+
+def baseline_metrics(baseline_start: str, baseline_end: str, tile_id: str, streaming=False, robust=False):
+    """
+    Baseline mean and standard deviation of NDVI, EVI and PSRI2 of a tile, written and indexed as a `baseline` dataset.
+
+    `streaming` computes them from running statistics, one composite month at a time (`baseline_streaming`), in
+    memory independent of the length of the period and without a Dask cluster, instead of loading the whole time
+    series of each index (`baseline_in_memory`).
+    `robust` computes the median, MAD, p10 and p90 instead (`baseline_robust_streaming`), written and indexed as
+    a `baseline_robust` dataset.
+    A failure is logged and re-raised, so the tile is not recorded as completed.
+    """
     
     logging.info('#######################################################################')
     
     client = None
     cluster = None
     
-    cluster = LocalCluster(
-        n_workers=8, 
-        threads_per_worker=1, 
-        processes=True,
-        memory_limit='auto', 
-        local_directory=tempfile.mkdtemp(),
-        dashboard_address=":8787",
-        # silence_logs=logging.WARN,
-        )
-    client = Client(cluster)
-    logging.info(f'Dask dashboard is available at: {client.dashboard_link}')
+    if not (streaming or robust):
+        cluster = LocalCluster(
+            n_workers=8, 
+            threads_per_worker=1, 
+            processes=True,
+            memory_limit='auto', 
+            local_directory=tempfile.mkdtemp(),
+            dashboard_address=":8787",
+            # silence_logs=logging.WARN,
+            )
+        client = Client(cluster)
+        logging.info(f'Dask dashboard is available at: {client.dashboard_link}')
     
     dc = datacube.Datacube(app='basecomp', env='drought')
     
     try:
         start_time = time.time()            
-        logging.info('Create directories and naming conversions')   
-        NASROOT='//nas-rs.topo.auth.gr/Latomeia/DROUGHT'
-        PRODUCT_NAME = 'baseline'
-        FOLDER=f'{PRODUCT_NAME}/{tile_id.split('_')[0]}/{tile_id.split('_')[1]}/{baseline_start.replace('-','')}_{baseline_end.replace('-','')}'
-        DATASET= f'S2L2A_baseline_{tile_id.replace('_','')}_{baseline_start.replace('-','')}_{baseline_end.replace('-','')}'
         
-        collection_path = f"{NASROOT}/{PRODUCT_NAME}"
-        dataset_path = f"{NASROOT}/{FOLDER}"
-        mkdir(dataset_path)
-        eo3_path = f'{dataset_path}/{DATASET}.odc-metadata.yaml'
-        stac_path = f'{dataset_path}/{DATASET}.stac-metadata.json'
-        log.info(f'Dataset location: {dataset_path}')
+        if robust:
+            logging.info(f'Computing robust baseline of {", ".join(SPECTRAL_INDICES)} from radix histograms')
+            layers = baseline_robust_streaming(dc, tile_id, baseline_start, baseline_end)
+        elif streaming:
+            logging.info(f'Computing baseline M and SD of {", ".join(SPECTRAL_INDICES)} from running statistics')
+            layers = baseline_streaming(dc, tile_id, baseline_start, baseline_end)
+        else:
+            layers = {}
+            for spectral_index in SPECTRAL_INDICES:
+                logging.info(f'Computing baseline M and SD for {spectral_index}')
+                layers[spectral_index] = baseline_in_memory(dc, tile_id, baseline_start, baseline_end, spectral_index)
         
-        ds_vi_list = []
-        for spectral_index in ["NDVI", "EVI", "PSRI2"]:
-            logging.info(f'Computing baseline M and SD for {spectral_index}')
-
-            logging.info(f'Lazy loading time series')
-            ds = dc.load(
-                product='composites',
-                region_code=tile_id.replace('_',''),
-                time=(baseline_start, baseline_end),
-                measurements=[spectral_index],
-                dask_chunks=dict(x=512, y=512),
-                patch_url=nas_patch
-            ).compute()
-            
-            logging.info(f'Lazy applying nodata mask')
-            ds[spectral_index] = (
-                ds[spectral_index]
-                .where(ds[spectral_index] != ds[spectral_index].attrs.get('nodata', -9999))
-                .astype('float16')
-            )
-            
-            logging.info(f'Computing Mean (M)')
-            base_vi_mean = ds[spectral_index].mean(dim="time", skipna=True).astype('float16')
-            logging.info(f'Computing Standard Deviation (SD)')
-            base_vi_std = ds[spectral_index].std(dim="time", skipna=True).astype('float16')
-            
-            logging.info(f'Assigning names to xr.DataArrays')
-            base_vi_mean.name = f'{spectral_index}_mean'
-            base_vi_std.name = f'{spectral_index}_std'
-            
-            logging.info(f'Merge into xr.Dataset')
-            base_vi_ds = xr.merge([base_vi_mean.to_dataset(), base_vi_std.to_dataset()])
-            
-            logging.info(f'Scale and nodata -32768')
-            logging.info(f'Configure metadata of baseline dataset')
-            for var in [f'{spectral_index}_mean', f'{spectral_index}_std']:
-                scale = 1
-                dtype = 'int16'
-                nodata = np.iinfo(np.int16).min #-32768
-                base_vi_ds[var] = (base_vi_ds[var]*scale).round()
-                base_vi_ds[var] = base_vi_ds[var].fillna(nodata).astype(dtype)
-                base_vi_ds[var] = base_vi_ds[var].rio.write_nodata(nodata, inplace=True)
-                base_vi_ds[var].encoding.update({"dtype": dtype})
-    
-            logging.info(f'Append baseline dataset of {spectral_index} in list')
-            ds_vi_list.append(base_vi_ds[f'{spectral_index}_mean'])
-            ds_vi_list.append(base_vi_ds[f'{spectral_index}_std'])
-        
-        logging.info('Done with computing baseline of all spectral indices')
-        logging.info('Now creating the overall baseline dataset')
-        base_ds = xr.merge(ds_vi_list)
-        logging.info('Overall baseline dataset constructed')
-        
-        logging.info('Assign time range and tile ID in metadata')
-        base_ds.attrs['dtr:start_datetime']=baseline_start
-        base_ds.attrs['dtr:end_datetime']=baseline_end
-        base_ds.attrs['odc:region_code']=tile_id
-        
-        logging.info(f'Writing GTiff (COG) to disk')
-        gc.collect()
-        name_measurements = []
-        relative_name_measurements = []
-        for var in list(base_ds.data_vars):
-            file_path = f'{dataset_path}/{DATASET}_{var}.tif'
-            
-            base_ds[var].rio.to_raster(
-                raster_path=file_path, 
-                driver='COG',
-                dtype=str(base_ds[var].dtype),
-                windowed=True
-                )
-            name_measurements.append(file_path)
-            relative_name_measurements.append(f'{DATASET}_{var}.tif')
-            
-            logging.info(f'Write {var.upper()} -> {file_path}')
-            
-        logging.info(f'Assert relative paths and product measurements are matched')
-        relative_name_measurements = reorder_measurements(
-            product=PRODUCT_NAME, 
-            relative_name_measurements=relative_name_measurements)
-        
-        
-        logging.info('Prepare metadata YAML document')
-        yyyy = int(baseline_start[0:4])
-        mm = int(baseline_start[5:7])
-        dd = int(baseline_start[8:10])
-        datetime_list = [yyyy, mm, dd]    
-        eo3_doc, stac_doc = prepare_eo3_metadata_NAS(
-            dc=dc,
-            xr_cube=base_ds, 
-            collection_path=Path(NASROOT),
-            dataset_name=DATASET,
-            product_name=PRODUCT_NAME,
-            product_family='ard',
-            name_measurements=relative_name_measurements,
-            datetime_list=datetime_list,
-            set_range=True,
-            lineage_path=None,
-            version=1,
-            )
-        
-        logging.info('Write metadata YAML document to disk')
-        serialise.to_path(Path(eo3_path), eo3_doc)
-        with open(stac_path, 'w') as json_file:
-            json.dump(stac_doc, json_file, indent=4, default=False)
-        
-        logging.info('Create datacube.model.Dataset from eo3 metadata')
-        WORKING_ON_CLOUD=False
-        uri = eo3_path if WORKING_ON_CLOUD else f"file:///{eo3_path}"
-
-        resolver = Doc2Dataset(dc.index)
-        dataset_tobe_indexed, err  = resolver(doc_in=serialise.to_doc(eo3_doc), uri=uri)
-        
-        if err:
-            msg=f'✖✖✖ FAILED loading for : Tile {tile_id} | with Exception: {err}' # ✗
-            logging.error(msg)
-            logging.info('#######################################################################')
-            raise RuntimeError(msg)
-            
-        logging.info('Index to datacube')
-        dc.index.datasets.add(dataset=dataset_tobe_indexed, with_lineage=False)
+        base_ds = baseline_dataset(layers, baseline_start, baseline_end, tile_id)
+        product_name = 'baseline_robust' if robust else 'baseline'
+        existing = find_baselines(dc, tile_id, baseline_start, baseline_end, product_name)
+        write_baseline(dc, base_ds, tile_id, baseline_start, baseline_end, product_name=product_name,
+                       dataset_id=existing[0].id if existing else None)
         
         logging.info(f'')
         logging.info(f'✔✔✔ COMPLETED: Tile {tile_id} | In {round((time.time() - start_time)/60, 2)} minutes')
@@ -204,6 +324,7 @@ def baseline_metrics(baseline_start: str, baseline_end: str, tile_id: str):
     except Exception as VI_error:
         logging.error(f'✖✖✖ FAILED for : Tile {tile_id} | with Exception: {VI_error}') # ✗
         logging.info('#######################################################################')
+        raise   # the driver records the tile as done only on exit code 0
     finally:
         try:
             if client is not None:
@@ -217,12 +338,13 @@ def baseline_metrics(baseline_start: str, baseline_end: str, tile_id: str):
 
 
 if __name__ == "__main__":
-    import argparse, json, sys, os, datetime, pytz
-    from utils.utils import setup_logger
+    import argparse, sys, os, datetime, pytz
     import logging
 
     p = argparse.ArgumentParser(description="Run ONE composite from a single .geojson and exit.")
     p.add_argument("--tile", required=True, help="Tile ID")
+    p.add_argument("--streaming", action="store_true", help="Compute the baseline one composite month at a time (memory independent of the period)")
+    p.add_argument("--robust", action="store_true", help="Compute the robust baseline (median, MAD, p10, p90) from radix histograms")
     args = p.parse_args()
 
     try:
@@ -240,9 +362,11 @@ if __name__ == "__main__":
         baseline_metrics(
             baseline_start=baseline_start,
             baseline_end=baseline_end,
-            tile_id=tile_id
+            tile_id=tile_id,
+            streaming=args.streaming,
+            robust=args.robust,
             )
         sys.exit(0)         # success (including "skipped" is still success)
     except Exception:
-        logging.exception("Fatal error in composites.py")
+        logging.exception("Fatal error in baseline.py")
         sys.exit(1)        # fail
\ No newline at end of file
@@ -0,0 +1,229 @@
+'''
+######################################################################
+## ARISTOTLE UNIVERSITY OF THESSALONIKI
+## PERSLAB
+## REMOTE SENSING AND EARTH OBSERVATION TEAM
+##
+## DATE:             Oct-2026
+## SCRIPT:           baseline_stats.py
+## AUTHOR:           Vangelis Fotakidis (fotakidis@topo.auth.gr)
+##
+## DESCRIPTION:      Script to keep the `baseline_stats` companion product of a tile up to date: per month, the
+##                      cumulative per-pixel count, sum and sum of squares of the NDVI, EVI and PSRI2 composites
+##                      since the start of the archive, from which `baseline_window.py` builds the baseline of any
+##                      window without reading the composites
+##
+#######################################################################
+'''
+
+import datacube
+from eodatasets3 import serialise
+
+import numpy as np
+import xarray as xr
+
+import calendar
+import datetime
+import json
+import time
+from pathlib import Path
+from dateutil.relativedelta import relativedelta
+
+from baseline import SPECTRAL_INDICES
+from utils.indexing import BulkIndexer, dataset_key, existing_dataset_keys
+from utils.metadata import prepare_eo3_metadata_NAS, reorder_measurements
+from utils.utils import mkdir, setup_logger
+from utils.utils import nas_patch
+from utils.cog_writer import write_cogs
+from utils.running_stats import iter_composite_blocks, SumAccumulator, as_dataarray
+
+import warnings
+import logging
+warnings.filterwarnings('ignore')
+
+
+NASROOT = '//nas-rs.topo.auth.gr/Latomeia/DROUGHT'
+PRODUCT_NAME = 'baseline_stats'
+ARCHIVE_START = '2015-01-01'     # before the first Sentinel-2 L2A composite
+
+# Stored dtype and nodata of each statistic. The cumulative values of every month fit exactly: count < 65535,
+# |sum| < 32767 * 65535 < 2^31, sumsq < 32767^2 * 65535 < 2^53.
+STATISTICS = {
+    'count': ('uint16', np.iinfo(np.uint16).max),
+    'sum': ('int32', np.iinfo(np.int32).min),
+    'sumsq': ('float64', -1),
+}
+
+
+def month_bounds(year_month):
+    """First and last day ('YYYY-MM-DD') of a 'YYYY-MM' month."""
+    dt = datetime.datetime.strptime(year_month, "%Y-%m")
+    last_day = calendar.monthrange(dt.year, dt.month)[1]
+    return dt.strftime("%Y-%m-01"), dt.replace(day=last_day).strftime("%Y-%m-%d")
+
+
+def previous_month(year_month):
+    return (datetime.datetime.strptime(year_month, "%Y-%m") - relativedelta(months=1)).strftime("%Y-%m")
+
+
+def load_statistics(dc, tile_id, year_month, spectral_indices=SPECTRAL_INDICES, like=None):
+    """
+    Cumulative statistics of a tile up to `year_month` (included): the latest `baseline_stats` dataset at or
+    before that month (months without composite have no dataset of their own).
+
+    Returns
+    -------
+    (str, dict, GeoBox) or (None, None, None)
+        Month of the dataset, {index: SumAccumulator} and its GeoBox; None if the tile has no statistics yet.
+    """
+    datasets = dc.find_datasets(
+        product=PRODUCT_NAME,
+        region_code=tile_id.replace('_', ''),
+        time=(ARCHIVE_START, month_bounds(year_month)[1]),
+    )
+    if not datasets:
+        return None, None, None
+    dataset = max(datasets, key=lambda d: d.center_time)
+    ds = dc.load(
+        datasets=[dataset],
+        measurements=[f'{si}_{stat}' for si in spectral_indices for stat in STATISTICS],
+        patch_url=nas_patch,
+        **({'like': like} if like is not None else {}),
+    ).isel(time=0)
+    stats = {
+        si: SumAccumulator(count=ds[f'{si}_count'].values, total=ds[f'{si}_sum'].values, sumsq=ds[f'{si}_sumsq'].values)
+        for si in spectral_indices
+    }
+    return dataset.center_time.strftime('%Y-%m'), stats, ds.odc.geobox
+
+
+def statistics_dataset(stats, geobox, tile_id):
+    """The `baseline_stats` dataset of {index: SumAccumulator}, with the stored dtypes and nodata."""
+    layers = []
+    for si, acc in stats.items():
+        for stat, values in zip(STATISTICS, (acc.count, acc.sum, acc.sumsq)):
+            dtype, nodata = STATISTICS[stat]
+            da = as_dataarray(values.astype(dtype), geobox, f'{si}_{stat}')
+            da = da.rio.write_nodata(nodata, inplace=True)
+            da.encoding.update({"dtype": dtype})
+            layers.append(da)
+    stats_ds = xr.merge(layers)
+    stats_ds.attrs = {'odc:region_code': tile_id}
+    return stats_ds
+
+
+def write_statistics(dc, stats_ds, tile_id, year_month, indexer, dataset_id=None):
+    """
+    Write the statistics of a tile up to `year_month` as COGs with their EO3/STAC metadata, and queue them in
+    the bulk `indexer` (in place of the indexed dataset `dataset_id` of that month, if any). Returns the Future.
+    """
+    FOLDER = f'{PRODUCT_NAME}/{tile_id.split('_')[0]}/{tile_id.split('_')[1]}/{year_month.replace('-','')}'
+    DATASET = f'S2L2A_bstats_{tile_id.replace('_','')}_{year_month.replace('-','')}'
+    dataset_path = f"{NASROOT}/{FOLDER}"
+    mkdir(dataset_path)
+    eo3_path = f'{dataset_path}/{DATASET}.odc-metadata.yaml'
+    stac_path = f'{dataset_path}/{DATASET}.stac-metadata.json'
+
+    name_measurements = list(write_cogs(stats_ds, lambda var: f'{dataset_path}/{DATASET}_{var}.tif').values())
+    relative_name_measurements = reorder_measurements(
+        product=PRODUCT_NAME,
+        relative_name_measurements=[p.split("/")[-1] for p in name_measurements],
+        dc=dc)
+
+    eo3_doc, stac_doc = prepare_eo3_metadata_NAS(
+        dc=dc,
+        xr_cube=stats_ds,
+        collection_path=Path(NASROOT),
+        dataset_name=DATASET,
+        product_name=PRODUCT_NAME,
+        product_family='ard',
+        name_measurements=relative_name_measurements,
+        datetime_list=[int(year_month[:4]), int(year_month[5:7]), 1],
+        set_range=False,
+        lineage_path=None,
+        version=1,
+        dataset_id=dataset_id,
+        )
+    serialise.to_path(Path(eo3_path), eo3_doc)
+    with open(stac_path, 'w') as json_file:
+        json.dump(stac_doc, json_file, indent=4, default=False)
+
+    return indexer.submit(eo3_doc, f"file:///{eo3_path}", label=DATASET, update=dataset_id is not None)
+
+
+def update_statistics(dc, tile_id, start_month, end_month, indexer, existing=None, spectral_indices=SPECTRAL_INDICES):
+    """
+    Write the cumulative statistics of a tile for every composite month from `start_month` to `end_month`, in
+    ONE streaming pass over these composites only: the statistics up to the month before `start_month` are read
+    back from the product and the new months added to them.
+
+    A month already indexed is rewritten in place (same dataset id), e.g. after its composite was updated; the
+    months after it must then be rewritten too, so `end_month` should be the last month of the archive.
+    """
+    t0 = time.time()
+    existing = existing if existing is not None else existing_dataset_keys(dc, [PRODUCT_NAME])
+    _, stats, _ = load_statistics(dc, tile_id, previous_month(start_month), spectral_indices)
+
+    blocks = iter_composite_blocks(
+        dc, tile_id, (month_bounds(start_month)[0], month_bounds(end_month)[1]), spectral_indices)
+    _, _, first = next(blocks)
+    geobox = first.odc.geobox
+    nodata = {si: first[si].attrs.get('nodata', -9999) for si in spectral_indices}
+    if stats is None:
+        logging.info(f'No statistics of {tile_id} before {start_month}, starting from zero')
+        stats = {si: SumAccumulator((geobox.height, geobox.width)) for si in spectral_indices}
+    logging.info(f'Cumulative statistics of {len(spectral_indices)} indices: {round(sum(a.nbytes() for a in stats.values())/1024**2)} MiB')
+
+    futures = []
+
+    def write_month(month):
+        dataset_id = existing.get(dataset_key(PRODUCT_NAME, tile_id, month))
+        stats_ds = statistics_dataset(stats, geobox, tile_id)
+        futures.append(write_statistics(dc, stats_ds, tile_id, month, indexer, dataset_id))
+        logging.info(f'        {PRODUCT_NAME} of {tile_id} | {month} written')
+
+    month = None
+    for t, rows, values in blocks:
+        t_month = str(t)[:7]
+        if month is not None and t_month != month:
+            write_month(month)
+        month = t_month
+        for si in spectral_indices:
+            stats[si].update(values[si], rows, nodata[si])
+    write_month(month)
+
+    logging.info(f'✔ {len(futures)} months of {PRODUCT_NAME} of {tile_id} in {round(time.time() - t0, 1)} s')
+    return futures
+
+
+if __name__ == "__main__":
+    import argparse, sys, pytz
+    import geopandas as gpd
+
+    p = argparse.ArgumentParser(description="Add the composite months from --start to --end to the cumulative baseline statistics of tiles.")
+    p.add_argument("--tile", nargs='*', help="Tile IDs (default: every tile of the grid)")
+    p.add_argument("--start", required=True, help="First month to add, YYYY-MM")
+    p.add_argument("--end", required=True, help="Last month to add, YYYY-MM (the last month of the archive when rewriting months)")
+    p.add_argument("--grid", default="../anciliary/grid_20_v2.geojson", help="Tile grid, for the default tiles")
+    args = p.parse_args()
+
+    log = setup_logger(
+        logger_name='bstats_',
+        logger_path=f'../logs/baseline/bstats_{datetime.datetime.now(pytz.timezone("Europe/Athens")).strftime("%Y%m%dT%H%M%S")}.log',
+        logger_format='%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s',
+    )
+
+    tile_ids = args.tile or list(gpd.read_file(args.grid)['tile_ids'])
+    dc = datacube.Datacube(app='bstats', env='drought')
+    indexer = BulkIndexer(dc)
+    existing = existing_dataset_keys(dc, [PRODUCT_NAME])
+    failed = []
+    for tile_id in tile_ids:
+        try:
+            update_statistics(dc, tile_id, args.start, args.end, indexer, existing)
+        except Exception as error:
+            logging.error(f'✖✖✖ FAILED for : Tile {tile_id} | with Exception: {error}')
+            failed.append(tile_id)
+    indexer.close()
+    logging.info(f'Baseline statistics of {len(tile_ids) - len(failed)}/{len(tile_ids)} tiles updated')
+    sys.exit(1 if failed or indexer.failed else 0)
@@ -0,0 +1,99 @@
+'''
+######################################################################
+## ARISTOTLE UNIVERSITY OF THESSALONIKI
+## PERSLAB
+## REMOTE SENSING AND EARTH OBSERVATION TEAM
+##
+## DATE:             Oct-2026
+## SCRIPT:           baseline_window.py
+## AUTHOR:           Vangelis Fotakidis (fotakidis@topo.auth.gr)
+##
+## DESCRIPTION:      Script to build the `baseline` dataset of a tile for any window of months from the cumulative
+##                      statistics of `baseline_stats.py`: two datasets are read and subtracted, no composite is read
+##
+#######################################################################
+'''
+
+import datacube
+
+import time
+
+from baseline import SPECTRAL_INDICES, baseline_dataset, find_baselines, write_baseline
+from baseline_stats import PRODUCT_NAME, load_statistics, month_bounds, previous_month
+from utils.indexing import existing_dataset_keys
+from utils.utils import setup_logger
+from utils.running_stats import as_dataarray
+
+import warnings
+import logging
+warnings.filterwarnings('ignore')
+
+
+def baseline_window(dc, tile_id, start_month, end_month, spectral_indices=SPECTRAL_INDICES):
+    """
+    Mean and standard deviation of each index of a tile over the months `start_month` to `end_month` (included),
+    as the statistics up to `end_month` minus those up to the month before `start_month`. Returns
+    {index: (mean, std)}, float64, NaN where no composite month is valid.
+    """
+    month, upper, geobox = load_statistics(dc, tile_id, end_month, spectral_indices)
+    if upper is None:
+        raise ValueError(f'No {PRODUCT_NAME} of tile {tile_id} up to {end_month}')
+    logging.info(f'Statistics up to {end_month} from the dataset of {month}')
+    month, lower, _ = load_statistics(dc, tile_id, previous_month(start_month), spectral_indices, like=geobox)
+    if lower is not None:
+        logging.info(f'Statistics before {start_month} from the dataset of {month}, subtracted')
+
+    layers = {}
+    for si in spectral_indices:
+        window = upper[si] - lower[si] if lower is not None else upper[si]
+        layers[si] = (as_dataarray(window.mean(), geobox, f'{si}_mean'), as_dataarray(window.std(), geobox, f'{si}_std'))
+    return layers
+
+
+def rebuild_baseline(dc, tile_id, start_month, end_month):
+    """
+    Build, write and index the `baseline` dataset of a tile for the window `start_month` to `end_month`; a dataset
+    already indexed for that window is updated in place (same id).
+    """
+    start_time = time.time()
+    baseline_start, baseline_end = month_bounds(start_month)[0], month_bounds(end_month)[1]
+    layers = baseline_window(dc, tile_id, start_month, end_month)
+    base_ds = baseline_dataset(layers, baseline_start, baseline_end, tile_id)
+    existing = find_baselines(dc, tile_id, baseline_start, baseline_end)
+    if existing:
+        logging.info(f'Baseline {baseline_start} to {baseline_end} already indexed as {existing[0].id}: updated in place')
+    write_baseline(dc, base_ds, tile_id, baseline_start, baseline_end, dataset_id=existing[0].id if existing else None)
+    logging.info(f'✔✔✔ COMPLETED: Tile {tile_id} | {baseline_start} to {baseline_end} | In {round(time.time() - start_time, 1)} s')
+
+
+if __name__ == "__main__":
+    import argparse, sys, datetime, pytz
+
+    p = argparse.ArgumentParser(description="Build the baseline datasets of a window of months from the stored baseline statistics.")
+    p.add_argument("--start", required=True, help="First month of the window, YYYY-MM")
+    p.add_argument("--end", required=True, help="Last month of the window, YYYY-MM")
+    p.add_argument("--tile", nargs='*', help="Tile IDs (default: every tile with baseline statistics)")
+    args = p.parse_args()
+
+    log = setup_logger(
+        logger_name='bwindow_',
+        logger_path=f'../logs/baseline/bwindow_{args.start}_{args.end}_{datetime.datetime.now(pytz.timezone("Europe/Athens")).strftime("%Y%m%dT%H%M%S")}.log',
+        logger_format='%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s',
+    )
+
+    dc = datacube.Datacube(app='bwindow', env='drought')
+    if args.tile:
+        tile_ids = args.tile
+    else:
+        region_codes = sorted({region_code for _, region_code, _ in existing_dataset_keys(dc, [PRODUCT_NAME])})
+        tile_ids = [f'{rc[:3]}_{rc[3:]}' for rc in region_codes]
+
+    failed = []
+    for tile_id in tile_ids:
+        try:
+            rebuild_baseline(dc, tile_id, args.start, args.end)
+        except Exception as error:
+            logging.error(f'✖✖✖ FAILED for : Tile {tile_id} | with Exception: {error}')
+            failed.append(tile_id)
+    logging.info(f'Baseline {args.start} to {args.end} of {len(tile_ids) - len(failed)}/{len(tile_ids)} tiles written')
+    sys.exit(1 if failed else 0)
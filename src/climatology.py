@@ -0,0 +1,213 @@
+'''
+######################################################################
+## ARISTOTLE UNIVERSITY OF THESSALONIKI
+## PERSLAB
+## REMOTE SENSING AND EARTH OBSERVATION TEAM
+##
+## DATE:             Oct-2026
+## SCRIPT:           climatology.py
+## AUTHOR:           Vangelis Fotakidis (fotakidis@topo.auth.gr)
+##
+## DESCRIPTION:      Script to compute the month-of-year climatology of the Baseline period: the Mean and Standard
+##                      deviation of NDVI, EVI and PSRI2 for each calendar month (or seasonal window around it),
+##                      in one streaming pass over the composites, indexed into ODC as the `climatology` product
+##
+#######################################################################
+'''
+
+import datacube
+from eodatasets3 import serialise
+
+import numpy as np
+
+import json
+import time
+from pathlib import Path
+
+from baseline import SPECTRAL_INDICES, baseline_dataset
+from utils.indexing import BulkIndexer
+from utils.metadata import prepare_eo3_metadata_NAS, reorder_measurements
+from utils.utils import mkdir, setup_logger
+from utils.cog_writer import write_cogs
+from utils.running_stats import BLOCK_ROWS, load_composites_lazily, SumAccumulator, as_dataarray
+
+import warnings
+import logging
+warnings.filterwarnings('ignore')
+
+
+NASROOT = '//nas-rs.topo.auth.gr/Latomeia/DROUGHT'
+PRODUCT_NAME = 'climatology'
+MONTHS = range(1, 13)
+
+
+def seasonal_months(month, window=0):
+    """Calendar months pooled for `month`: itself and `window` months on each side, across the year end."""
+    return [(month - 1 + k) % 12 + 1 for k in range(-window, window + 1)]
+
+
+def climatology_block(blocks, window=0, nodata=None):
+    """
+    Mean and standard deviation (float64) of one block of rows for each calendar month.
+
+    Parameters
+    ----------
+    blocks : iterable of (int, numpy.ndarray)
+        (calendar month, block of one composite) of every composite month of the period.
+    window : int
+        Months pooled on each side of a calendar month (0: the month alone, 1: three-month seasons, ...). The
+        per-month sums are exact (`SumAccumulator`), so pooling them costs no extra read.
+
+    Returns
+    -------
+    dict
+        calendar month -> (mean, std), NaN where no composite value was valid.
+    """
+    sums = {}
+    for month, values in blocks:
+        if month not in sums:
+            sums[month] = SumAccumulator(values.shape)
+        sums[month].update(values, nodata=nodata)
+    shape = next(iter(sums.values())).count.shape
+    layers = {}
+    for month in MONTHS:
+        pooled = SumAccumulator(shape)
+        for m in seasonal_months(month, window):
+            if m in sums:
+                pooled = pooled + sums[m]
+        layers[month] = (pooled.mean(), pooled.std())
+    return layers
+
+
+def climatology_streaming(dc, tile_id, baseline_start, baseline_end, window=0, spectral_indices=SPECTRAL_INDICES, block_rows=BLOCK_ROWS):
+    """
+    Month-of-year mean and standard deviation of each index over the baseline period, in ONE pass over the composites.
+
+    The composites are opened lazily once, and read one block of rows (one COG tile row) of one index at a time:
+    every block of every composite is read once, as for the all-months baseline, while only the 12 per-month
+    accumulators of one block are held. Returns {calendar month: {index: (mean, std)}} of float32 arrays.
+    """
+    lazy = [
+        (dataset.center_time.month, ds)
+        for dataset, ds in load_composites_lazily(dc, tile_id, (baseline_start, baseline_end), spectral_indices, block_rows=block_rows)
+    ]
+    logging.info(f'Climatology of {tile_id} from {len(lazy)} composites (window ±{window} months)')
+    geobox = lazy[0][1].odc.geobox
+    nodata = {si: lazy[0][1][si].attrs.get('nodata', -9999) for si in spectral_indices}
+
+    layers = {
+        month: {si: (np.full(geobox.shape, np.nan, 'float32'), np.full(geobox.shape, np.nan, 'float32')) for si in spectral_indices}
+        for month in MONTHS
+    }
+    for y0 in range(0, geobox.height, block_rows):
+        t0 = time.time()
+        rows = slice(y0, min(y0 + block_rows, geobox.height))
+        for si in spectral_indices:
+            blocks = ((month, ds[si].isel(y=rows).values) for month, ds in lazy)
+            for month, (mean, std) in climatology_block(blocks, window, nodata[si]).items():
+                layers[month][si][0][rows] = mean
+                layers[month][si][1][rows] = std
+        logging.info(f'        rows {rows.start}-{rows.stop} of {geobox.height} in {round(time.time() - t0, 1)} s')
+
+    return {
+        month: {si: (as_dataarray(mean, geobox, f'{si}_mean'), as_dataarray(std, geobox, f'{si}_std')) for si, (mean, std) in by_index.items()}
+        for month, by_index in layers.items()
+    }
+
+
+def write_climatology(dc, clim_ds, tile_id, month, window, indexer):
+    """Write the climatology of one calendar month of a tile as COGs with their EO3/STAC metadata, and queue it in the bulk `indexer`."""
+    baseline_start, baseline_end = clim_ds.attrs['dtr:start_datetime'], clim_ds.attrs['dtr:end_datetime']
+    PERIOD = f"{baseline_start.replace('-','')}_{baseline_end.replace('-','')}"
+    FOLDER = f'{PRODUCT_NAME}/{tile_id.split('_')[0]}/{tile_id.split('_')[1]}/{PERIOD}/w{window}/{month:02d}'
+    DATASET = f'S2L2A_clim_{tile_id.replace('_','')}_{PERIOD}_w{window}m{month:02d}'
+    dataset_path = f"{NASROOT}/{FOLDER}"
+    mkdir(dataset_path)
+    eo3_path = f'{dataset_path}/{DATASET}.odc-metadata.yaml'
+    stac_path = f'{dataset_path}/{DATASET}.stac-metadata.json'
+
+    name_measurements = list(write_cogs(clim_ds, lambda var: f'{dataset_path}/{DATASET}_{var}.tif').values())
+    relative_name_measurements = reorder_measurements(
+        product=PRODUCT_NAME,
+        relative_name_measurements=[p.split("/")[-1] for p in name_measurements],
+        dc=dc)
+
+    eo3_doc, stac_doc = prepare_eo3_metadata_NAS(
+        dc=dc,
+        xr_cube=clim_ds,
+        collection_path=Path(NASROOT),
+        dataset_name=DATASET,
+        product_name=PRODUCT_NAME,
+        product_family='ard',
+        name_measurements=relative_name_measurements,
+        datetime_list=[int(baseline_start[:4]), int(baseline_start[5:7]), int(baseline_start[8:10])],
+        set_range=True,
+        lineage_path=None,
+        version=1,
+        properties={'clim:month': month, 'clim:window': window},
+        )
+    serialise.to_path(Path(eo3_path), eo3_doc)
+    with open(stac_path, 'w') as json_file:
+        json.dump(stac_doc, json_file, indent=4, default=False)
+
+    return indexer.submit(eo3_doc, f"file:///{eo3_path}", label=DATASET)
+
+
+def climatology_metrics(dc, tile_id, baseline_start, baseline_end, window, indexer):
+    """Compute, write and index the 12 `climatology` datasets of a tile."""
+    start_time = time.time()
+    layers = climatology_streaming(dc, tile_id, baseline_start, baseline_end, window)
+    futures = []
+    for month in MONTHS:
+        clim_ds = baseline_dataset(layers.pop(month), baseline_start, baseline_end, tile_id)
+        futures.append(write_climatology(dc, clim_ds, tile_id, month, window, indexer))
+    logging.info(f'✔✔✔ COMPLETED: Tile {tile_id} | climatology ±{window} months | In {round((time.time() - start_time)/60, 2)} minutes')
+    return futures
+
+
+def find_climatology(dc, tile_id, month, window=None):
+    """
+    The `climatology` dataset of a tile for a calendar month (the `clim:month` property), of `window` if given.
+    The latest processed one if several match.
+    """
+    datasets = [
+        d for d in dc.find_datasets(product=PRODUCT_NAME, region_code=tile_id.replace('_', ''))
+        if d.metadata_doc['properties'].get('clim:month') == month
+        and (window is None or d.metadata_doc['properties'].get('clim:window') == window)
+    ]
+    if not datasets:
+        raise ValueError(f'No {PRODUCT_NAME} dataset of tile {tile_id} for month {month}' + (f' (window {window})' if window is not None else ''))
+    return max(datasets, key=lambda d: d.metadata_doc['properties'].get('odc:processing_datetime', ''))
+
+
+if __name__ == "__main__":
+    import argparse, sys, datetime, pytz
+    import geopandas as gpd
+
+    p = argparse.ArgumentParser(description="Compute the month-of-year climatology of the baseline period of tiles.")
+    p.add_argument("--tile", nargs='*', help="Tile IDs (default: every tile of the grid)")
+    p.add_argument("--start", default="2020-01-01", help="Start of the baseline period")
+    p.add_argument("--end", default="2023-03-31", help="End of the baseline period")
+    p.add_argument("--window", type=int, default=0, help="Months pooled on each side of a calendar month (1: three-month seasons)")
+    p.add_argument("--grid", default="../anciliary/grid_20_v2.geojson", help="Tile grid, for the default tiles")
+    args = p.parse_args()
+
+    log = setup_logger(
+        logger_name='clim_',
+        logger_path=f'../logs/baseline/clim_{datetime.datetime.now(pytz.timezone("Europe/Athens")).strftime("%Y%m%dT%H%M%S")}.log',
+        logger_format='%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s',
+    )
+
+    tile_ids = args.tile or list(gpd.read_file(args.grid)['tile_ids'])
+    dc = datacube.Datacube(app='clim', env='drought')
+    indexer = BulkIndexer(dc)
+    failed = []
+    for tile_id in tile_ids:
+        try:
+            climatology_metrics(dc, tile_id, args.start, args.end, args.window, indexer)
+        except Exception as error:
+            logging.error(f'✖✖✖ FAILED for : Tile {tile_id} | with Exception: {error}')
+            failed.append(tile_id)
+    indexer.close()
+    logging.info(f'Climatology of {len(tile_ids) - len(failed)}/{len(tile_ids)} tiles computed')
+    sys.exit(1 if failed or indexer.failed else 0)
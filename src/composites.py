@@ -18,32 +18,24 @@ os.environ.setdefault("MPLBACKEND", "Agg")  # must be set before matplotlib is i
 
 import datacube
 from datacube.index.hl import Doc2Dataset
+from datacube.utils import changes
 from eodatasets3 import serialise
 
-import pandas as pd
+import dask
 import numpy as np
 
-import xarray as xr
 import rioxarray as rxr
 import odc.geo.xr
 
-import geopandas as gpd
-from odc.geo.geom import BoundingBox
-from shapely.geometry import shape as shapely_shape
+from odc.geo.geom import BoundingBox, Geometry
+from shapely.geometry import shape as shapely_shape, box as shapely_box
 from rasterio.enums import Resampling
 
-import pystac_client
 import odc.stac
 import pystac
 from odc.stac import configure_rio
 # from datacube.utils.aws import configure_s3_access
 import planetary_computer
-from pystac_client.stac_api_io import StacApiIO
-from urllib3 import Retry
-
-import dask.distributed
-from dask.distributed import LocalCluster, Client
-import tempfile
 
 import gc 
 import json
@@ -51,11 +43,20 @@ import datetime, pytz
 from pathlib import Path
 import time, logging
 
-from utils.sentinel2 import check_gri_refinement, plot_mgrs_tiles_with_aoi
-from utils import spectral_indices
-from utils.timeseries_processing import merge_nodata0, save_dataset_preview, process_epsg
+from utils.sentinel2 import check_gri_refinement, apply_s2_pixel_kernel, BASELINE400_CUTOVER
+from utils.timeseries_processing import merge_nodata0, process_epsg, nanmedian_time
+from utils.timeseries_processing import read_scene_stack, write_scene_stack, crop_shared_stack
+from utils.timeseries_processing import tile_clear_masks, greedy_clear_coverage, coverage_summary
+from utils.timeseries_processing import connect_to_STAC_catalog, reset_stac_roundtrips, log_stac_roundtrips
 from utils.metadata import prepare_eo3_metadata_NAS
-from utils.utils import mkdir, setup_logger
+from utils.utils import setup_logger
+from utils.cluster import start_local_cluster, close_local_cluster
+from utils.cog_cache import start_cog_cache, reset_cog_cache_stats, log_cog_cache_stats
+from utils.quicklooks import QuicklookRenderer
+from utils.cog_writer import write_cogs
+from utils.staging import StagedDataset
+from utils.indexing import dataset_key
+from utils.planner import tile_grid, read_plan_job
 
 # Ignore warnings
 import warnings
@@ -69,7 +70,262 @@ os.environ.setdefault("GDAL_CACHEMAX", "512")             # MB; limit GDAL's cac
 os.environ["CPL_VSIL_CURL_CACHE_SIZE"] = str(16 * 1024)     # 16 KiB    # avoid big HTTP cache if you hit cloud blobs
 
 
-def generate_composite(year_month: str, tile_id: str, tile_geom: dict):
+def start_worker_pool(n_workers=8):
+    """
+    Start the Dask worker pool used for compositing and configure rasterio on the workers
+    for Planetary Computer reads. The pool can be reused by many `generate_composite` calls.
+    """
+    cluster, client = start_local_cluster(n_workers=n_workers)
+    configure_rio(cloud_defaults=True, client=client) # For Planetary Computer
+    return cluster, client
+
+
+def search_s2l2a_items(aoi_bbox, year_month):
+    """Sentinel-2 L2A items of Planetary Computer over `aoi_bbox` in `year_month`, with the cloud and nodata cover limits of the composites."""
+    logging.info('Connect to Planetary Computer STAC Catalog')
+    catalog = connect_to_STAC_catalog(catalog_endpoint="planetary_computer")
+
+    logging.info('Search the STAC Catalog')
+    cloud_cover = 70
+    search = catalog.search(
+        collections=["sentinel-2-l2a"], #hls2-s30
+        bbox=aoi_bbox,
+        datetime=year_month,
+        limit=100,
+        query={
+            "eo:cloud_cover": {"lt":cloud_cover},
+            "s2:nodata_pixel_percentage": {"lt":33},
+        },
+    )
+    logging.info('        Query parameters:')
+    logging.info(f'            url:          {search.url}')
+    logging.info(f'            client:       {search.client.id}')
+    logging.info(f'            collection:   {search._parameters['collections'][0]}')
+    logging.info(f'            bbox:         {search._parameters['bbox']}')
+    logging.info(f'            time range:   {search._parameters['datetime']}')
+    logging.info(f'            cloud cover:  0% - {search._parameters['query']['eo:cloud_cover']['lt']}%')
+    logging.info(f'            nodata cover: 0% - {search._parameters['query']['s2:nodata_pixel_percentage']['lt']}%')
+
+    logging.info('                          ')
+    logging.info('Searching...')
+    items = search.item_collection()
+
+    logging.info(f'Query found {len(items)} items')
+    return items
+
+
+def select_tile_scenes(refined_items, tile_geobox, geom_ll, select_by_scl=False, N=10):
+    """
+    Scenes of a tile composite: the `N` cleanest (eo:cloud_cover) of each MGRS tile or, with `select_by_scl`,
+    the smallest set giving most tile pixels a few clear observations in a coarse SCL overview.
+    Returns the selected items and their MGRS tiles and EPSG codes.
+    """
+    logging.info(f'Looking for up to {N} cleanest images within spatiotemporal range of each MGRS tile')
+    filtered_items = []
+    mgrs_tiles = np.unique([i.properties['s2:mgrs_tile'] for i in refined_items])
+    epsgs = np.unique([i.properties['proj:epsg'] for i in refined_items])
+
+    for mgrstile in mgrs_tiles:
+        item_mgrs_sorted = sorted([
+            i for i in refined_items if i.properties['s2:mgrs_tile'] == str(mgrstile)
+            ], key=lambda item: item.properties['eo:cloud_cover'])
+
+        if len(item_mgrs_sorted) > N:
+            filtered_items.extend(item_mgrs_sorted[:N])
+        else:
+            filtered_items.extend(item_mgrs_sorted)
+    logging.info(f"Filtered cleanest scenes: Kept {len(filtered_items)} out of {len(refined_items)} items. ")
+
+    if select_by_scl:
+        CLEAR_OBS, CLEAR_FRACTION, SCL_RESOLUTION = 3, 0.95, 320
+        logging.info('                                 ')
+        logging.info(f'Selecting scenes by clear pixels inside the tile (SCL overview at {SCL_RESOLUTION} m)')
+        logging.info(f'        Target: {CLEAR_OBS} clear observations on {round(100*CLEAR_FRACTION)}% of the tile pixels')
+        candidates = list(refined_items)
+        clear, inside = tile_clear_masks(candidates, tile_geobox, Geometry(geom_ll, crs='EPSG:4326'), resolution=SCL_RESOLUTION)
+        picked = greedy_clear_coverage(clear, inside, target_obs=CLEAR_OBS, target_fraction=CLEAR_FRACTION, max_scenes=N*len(mgrs_tiles))
+
+        by_cloud_cover = [candidates.index(i) for i in filtered_items]
+        for label, subset in (('eo:cloud_cover', by_cloud_cover), ('tile SCL', picked)):
+            reached, mean_obs = coverage_summary(clear, inside, subset, CLEAR_OBS)
+            logging.info(f'        By {label:<14}: {len(subset):3d} scenes | {round(100*reached, 1)}% of tile pixels with >= {CLEAR_OBS} clear obs. | {round(mean_obs, 1)} clear obs. per pixel')
+        for i in picked:
+            logging.info(f'        {candidates[i].id}: {round(100*clear[i].sum()/max(inside.sum(), 1), 1)}% clear over the tile (eo:cloud_cover {round(candidates[i].properties["eo:cloud_cover"], 1)}%)')
+
+        filtered_items = [candidates[i] for i in picked]
+        mgrs_tiles = np.unique([i.properties['s2:mgrs_tile'] for i in filtered_items])
+        epsgs = np.unique([i.properties['proj:epsg'] for i in filtered_items])
+    logging.info(f"        Included MGRS Tiles: {mgrs_tiles}")
+    logging.info(f"        Included EPSG codes: {epsgs}")
+    return filtered_items, mgrs_tiles, epsgs
+
+
+class SharedMonthLoad:
+    """
+    Scenes of one month searched, GRI-checked and loaded ONCE for a group of tiles (scene-major compositing),
+    on a GeoBox covering all of them that is pixel-aligned with every tile GeoBox.
+
+    `generate_composite(..., shared_load=...)` takes its scenes from `items_for`, their selection from
+    `selections` (tile_id -> the result of `select_tile_scenes`, so the SCL overviews of `select_by_scl` are
+    read once) and its time series from `load`, a crop of the shared stack, instead of searching and reading
+    Planetary Computer per tile.
+    """
+
+    def __init__(self, items, refined_items, df_refinement_status, ds_timeseries, selections=None):
+        self.items = list(items)
+        self.refined_items = list(refined_items)
+        self.df_refinement_status = df_refinement_status
+        self.ds_timeseries = ds_timeseries
+        self.selections = {} if selections is None else selections
+
+    def items_for(self, aoi_bbox):
+        """Items, refined items and refinement status of the scenes that intersect a tile AOI, as a per-tile search would return them."""
+        aoi = shapely_box(*aoi_bbox)
+        items = [i for i in self.items if shapely_shape(i.geometry).intersects(aoi)]
+        ids = {i.id for i in items}
+        refined_items = [i for i in self.refined_items if i.id in ids]
+        df = self.df_refinement_status
+        if len(df):
+            df = df[df['item_id'].isin(ids)]
+        return items, refined_items, df
+
+    def load(self, filtered_items, tile_geobox):
+        """Masked time series of `filtered_items` on `tile_geobox`, cropped from the shared stack."""
+        return crop_shared_stack(self.ds_timeseries, filtered_items, tile_geobox)
+
+
+def generate_composites_scene_major(year_month: str, tiles, client, lazy_load=True, incremental=False, select_by_scl=False, cog_cache=None, cog_cache_gb=50.0,
+                                    quicklooks=True, cog_compression='deflate', scratch=None, publisher=None, footprint='bounds',
+                                    indexer=None, existing=None):
+    """
+    Composites of a month for a group of (adjacent) tiles, reading each Sentinel-2 scene once for all tiles it covers
+    instead of once per tile:
+      1. one STAC search and GRI check over the union of the tile AOIs
+      2. per-tile scene selection, exactly as `generate_composite` does it, kept for the tile's `generate_composite`
+      3. the union of the selected scenes is loaded once, onto a GeoBox covering all tiles (EPSG:3035, 20 m, on the
+         same pixel grid as the tiles), and kept in the memory of the worker pool
+      4. every tile crops its pixels and its scenes out of it and is reduced, written and indexed as
+         `S2L2A_medcomp_<tile>_<yyyymm>` by `generate_composite`
+
+    The shared stack is mosaicked per date over the union of the selected scenes, so a tile may also receive pixels of
+    a granule of the same date selected by a neighbouring tile, where its own granules have none.
+    The stack of the group must fit in the memory of the pool: group tiles accordingly (see `run_composites.py --mode scene-major`).
+
+    Parameters
+    ----------
+    year_month : str
+        Year–month string in the format "YYYY-MM".
+    tiles : list of (str, dict or shapely geometry)
+        `(tile_id, tile_geom)` of each tile of the group.
+    client : dask.distributed.Client
+        Client of a running worker pool (see `start_worker_pool`).
+    lazy_load, incremental, select_by_scl, cog_cache, cog_cache_gb, quicklooks, cog_compression, scratch, publisher, footprint, indexer, existing :
+        As in `generate_composite`. The load is always made straight onto the tile grid.
+
+    Returns
+    -------
+    dict
+        tile_id -> True if the composite was computed, updated or already existed, False if it failed, or the
+        Future of its background publish-and-index (with `publisher`) or of its indexing (with `indexer`).
+    """
+    from distributed import wait
+
+    start_time = time.time()
+    logging.info('#######################################################################')
+    logging.info(f'Scene-major compositing of {len(tiles)} tiles | Time: {year_month}')
+
+    dc = datacube.Datacube(app='Composite generation', env='drought') if existing is None else None
+    results, todo = {}, []
+    for tile_id, tile_geom in tiles:
+        if existing is not None:
+            exists = dataset_key('composites', tile_id, year_month) in existing
+        else:
+            exists = bool(dc.find_datasets(product='composites', time=year_month, region_code=tile_id, ensure_location=True))
+        if not incremental and exists:
+            logging.info(f'        {tile_id}: composite already exists, skipped')
+            results[tile_id] = True
+        else:
+            todo.append((tile_id, tile_geom))
+    if not todo:
+        return results
+
+    if cog_cache:
+        start_cog_cache(cog_cache, max_gb=cog_cache_gb)
+        reset_cog_cache_stats()
+    reset_stac_roundtrips()
+
+    grids = {tile_id: tile_grid(tile_geom) for tile_id, tile_geom in todo}
+    union_aoi = BoundingBox(
+        min(g[1].left for g in grids.values()), min(g[1].bottom for g in grids.values()),
+        max(g[1].right for g in grids.values()), max(g[1].top for g in grids.values()),
+    )
+    union_bbox = BoundingBox(
+        min(g[2].left for g in grids.values()), min(g[2].bottom for g in grids.values()),
+        max(g[2].right for g in grids.values()), max(g[2].top for g in grids.values()),
+        crs='EPSG:3035',
+    )
+    union_geobox = odc.geo.geobox.GeoBox.from_bbox(union_bbox, resolution=odc.geo.Resolution(x=20,y=-20))
+    logging.info(f'Shared GeoBox of the tiles: {union_geobox.shape} pixels')
+
+    logging.info('                          ')
+    items = search_s2l2a_items(union_aoi, year_month)
+    logging.info('Searching for GRI REFINED scenes:')
+    refined_items, df_refinement_status = check_gri_refinement(items, sign_href=planetary_computer.sign)
+    shared_load = SharedMonthLoad(items, refined_items, df_refinement_status, ds_timeseries=None)
+
+    logging.info('                          ')
+    logging.info('Select the scenes of each tile')
+    selected = {}
+    for tile_id, _ in todo:
+        geom_ll, aoi_bbox, _, tile_geobox = grids[tile_id]
+        tile_items, tile_refined, _ = shared_load.items_for(aoi_bbox)
+        shared_load.selections[tile_id] = select_tile_scenes(tile_refined or tile_items, tile_geobox, geom_ll, select_by_scl=select_by_scl)
+        filtered_items = shared_load.selections[tile_id][0]
+        selected.update({i.id: i for i in filtered_items})
+        logging.info(f'        {tile_id}: {len(filtered_items)} scenes')
+    union_items = list(selected.values())
+    epsgs = np.unique([i.properties['proj:epsg'] for i in union_items])
+    n_tile_scenes = sum(len(shared_load.items_for(g[1])[0]) for g in grids.values())
+    logging.info(f'Union of the selected scenes: {len(union_items)} scenes in EPSG codes {epsgs} ({n_tile_scenes} tile-scene pairs of the search)')
+
+    if union_items:
+        logging.info('                          ')
+        logging.info('Load the union of the selected scenes once, onto the shared GeoBox')
+        load_start = time.time()
+        processed_epsgs = [process_epsg(union_items, union_aoi, EPSG, lazy=lazy_load, geobox=union_geobox) for EPSG in epsgs]
+        if len(processed_epsgs) > 1:
+            ds_timeseries = merge_nodata0(processed_epsgs, vars_mode="intersection", method="mean", chunks=None)
+        else:
+            ds_timeseries = processed_epsgs[0]
+        ds_timeseries = client.persist(ds_timeseries)
+        wait(ds_timeseries)
+        logging.info(f'    Loaded {ds_timeseries.sizes["time"]} dates, {round(ds_timeseries.nbytes/1024**3, 2)} GiB in {round(time.time() - load_start, 1)} s')
+        log_stac_roundtrips()
+        log_cog_cache_stats()
+        shared_load.ds_timeseries = ds_timeseries
+        del processed_epsgs, ds_timeseries
+
+    for tile_id, tile_geom in todo:
+        try:
+            published = generate_composite(year_month=year_month, tile_id=tile_id, tile_geom=tile_geom, client=client, incremental=incremental,
+                                           select_by_scl=select_by_scl, shared_load=shared_load, quicklooks=quicklooks,
+                                           cog_compression=cog_compression, scratch=scratch, publisher=publisher, footprint=footprint,
+                                           indexer=indexer, existing=existing)
+            results[tile_id] = published or True
+        except Exception:
+            logging.exception(f'Scene-major composite of tile {tile_id} failed')
+            results[tile_id] = False
+
+    del shared_load
+    client.run(lambda: __import__("gc").collect()); gc.collect()
+    logging.info(f'             ✔✔✔ Scene-major month {year_month}: {sum(1 for r in results.values() if r is not False)}/{len(results)} tiles in {round((time.time() - start_time)/60, 2)} minutes')
+    logging.info('#######################################################################')
+    return results
+
+
+def generate_composite(year_month: str, tile_id: str, tile_geom: dict, client=None, n_workers=8, lazy_load=False, load_on_tile_grid=False, incremental=False, select_by_scl=False,
+                       cog_cache=None, cog_cache_gb=50.0, shared_load=None, quicklooks=True,
+                       cog_compression='deflate', scratch=None, publisher=None, footprint='bounds', indexer=None, existing=None):
     """
     Parameters
     ----------
@@ -92,12 +348,70 @@ def generate_composite(year_month: str, tile_id: str, tile_geom: dict):
             }
           )
           - A shapely geometry object (Polygon, MultiPolygon, etc.).
+    client : dask.distributed.Client or None
+        Client of an already running worker pool (see `start_worker_pool`). If None, a
+        LocalCluster is started for this composite and closed when it is done.
+    n_workers : int
+        Number of worker processes of the LocalCluster started when no client is given.
+    lazy_load : bool
+        Load each UTM zone as one lazy dask graph of all bands on the 20 m grid (see `process_epsg`),
+        instead of two eagerly computed resolution passes.
+    load_on_tile_grid : bool
+        Load each UTM zone straight onto the EPSG:3035 tile GeoBox, reading only the source blocks that
+        intersect the tile, instead of loading the buffered AOI in UTM and reprojecting it.
+    incremental : bool
+        Keep the masked scene stack of the composite in a compressed sidecar (`_SceneStack.nc`) and, if the
+        composite already exists, load only the scenes published since, merge them into the stack, and
+        update the composite and its datacube dataset in place (same dataset id) instead of skipping it.
+        The sidecar is written as `_SceneStack.nc.pending` and renamed into place only once the composite is
+        published and indexed, so a failed run never leaves a sidecar listing scenes the composite lacks.
+    select_by_scl : bool
+        Select scenes by their clear pixels inside the tile, read from a coarse SCL overview, picking the
+        smallest set that gives most tile pixels a few clear observations, instead of the N scenes with the
+        lowest scene-wide eo:cloud_cover per MGRS tile.
+    cog_cache : str or None
+        Folder of a persistent disk cache of the COG byte ranges read from Planetary Computer (see
+        `utils.cog_cache`), shared by all jobs that use it. Adjacent tiles read largely the same blocks.
+    cog_cache_gb : float
+        Size cap of the COG block cache; least recently used blocks are evicted beyond it.
+    shared_load : SharedMonthLoad or None
+        Scenes of the month already searched and loaded for a group of tiles (see `generate_composites_scene_major`).
+        The tile takes its scenes, their selection and its time series from it instead of Planetary Computer.
+    quicklooks : bool
+        Render the footprint and input scenes preview JPEGs (from decimated data, in a background thread,
+        see `utils.quicklooks`). False skips them.
+    cog_compression : str
+        Compression of the band COGs: 'deflate' or 'zstd' (with predictor) or 'lerc' (lossless), see `utils.cog_writer`.
+    scratch : str or None
+        Local scratch folder to stage the files of the dataset in (mirroring the NAS collection tree), verify them,
+        and publish the dataset directory to the NAS with an atomic rename before indexing it (see `utils.staging`).
+        None writes straight to the NAS.
+    publisher : utils.staging.Publisher or None
+        With `scratch`, publish and index in the background (the transfer overlaps the next job) instead of before
+        returning.
+    footprint : str
+        Geometry of the indexed dataset: 'bounds' (the tile bounding box) or 'mask' (the valid-data polygon of the
+        composite, from a downsampled mask, see `utils.metadata.valid_data_footprint`).
+    indexer : utils.indexing.BulkIndexer or None
+        Queue the EO3 document for a batched indexing transaction of the run (the job returns the Future of its
+        indexing) instead of indexing it with its own resolver and transaction.
+    existing : dict or None
+        Datasets indexed at the start of the run (`utils.indexing.existing_dataset_keys`), checked instead of
+        querying the index for this tile-month.
+
+    Returns
+    -------
+    concurrent.futures.Future or None
+        The background publish-and-index of the dataset, if it was queued on `publisher` (its result is then the
+        Future of the indexing with an `indexer`), or the indexing of the dataset, if it was queued on `indexer`.
     """
     
+    owns_cluster = client is None
+    cluster = None
+    renderer = None
+    staged = None
     try:
         start_time = time.time()
-        client = None
-        cluster = None
         
         logging.info('#######################################################################')
         
@@ -106,23 +420,39 @@ def generate_composite(year_month: str, tile_id: str, tile_geom: dict):
         logging.info(f'        Time: {year_month}')
         
         
-        logging.info('                          ')
-        logging.info('Establishing connection to datacube')
-        dc = datacube.Datacube(app='Composite generation', env='drought')
-        
-        logging.info('                          ')
-        logging.info('Sanity test: Check if dataset already exists in the datacube')
-        find_ds_in_sc = dc.find_datasets(
-            **dict(
-                product='composites',
-                time=year_month,
-                region_code=tile_id
-            ),
-            ensure_location=True
-        )
+        dc = None
+        if existing is None:
+            logging.info('                          ')
+            logging.info('Establishing connection to datacube')
+            dc = datacube.Datacube(app='Composite generation', env='drought')
             
-        if find_ds_in_sc:
-            logging.warning(f"This composite already exists in {find_ds_in_sc[0].uri}")
+            logging.info('                          ')
+            logging.info('Sanity test: Check if dataset already exists in the datacube')
+            find_ds_in_sc = dc.find_datasets(
+                **dict(
+                    product='composites',
+                    time=year_month,
+                    region_code=tile_id
+                ),
+                ensure_location=True
+            )
+            existing_dataset = find_ds_in_sc[0] if find_ds_in_sc else None
+            existing_location = existing_dataset.uri if existing_dataset is not None else None
+        else:
+            logging.info('                          ')
+            logging.info('Sanity test: Check if dataset already exists in the datasets indexed at the start of the run')
+            existing_id = existing.get(dataset_key('composites', tile_id, year_month))
+            existing_dataset = None
+            existing_location = f'dataset {existing_id}' if existing_id is not None else None
+            if existing_id is not None and incremental:
+                dc = datacube.Datacube(app='Composite generation', env='drought')
+                existing_dataset = dc.index.datasets.get(existing_id)
+        
+        if existing_location is not None and incremental:
+            logging.info(f"This composite already exists in {existing_location}")
+            logging.info("Incremental mode: it will be updated with the scenes published since it was computed")
+        elif existing_location is not None:
+            logging.warning(f"This composite already exists in {existing_location}")
             logging.warning("The composite is skipped. Exit function. Continuing to next.")
             logging.info(f'')
             logging.info(f'             !!! SKIPPED: Tile {tile_id} | Time: {year_month} | In {round((time.time() - start_time)/60, 2)} minutes')
@@ -134,31 +464,11 @@ def generate_composite(year_month: str, tile_id: str, tile_geom: dict):
         
         
         logging.info('                                 ')
-        logging.info('Initializing Dask cluster for parallelization')
-        
-        dask.config.set({
-            'array.chunk-size': "256 MiB",
-            'array.slicing.split_large_chunks': True, 
-            'distributed.comm.timeouts.connect': '120s',
-            'distributed.comm.timeouts.tcp': '120s',
-            'distributed.comm.retry.count': 10,
-            'distributed.scheduler.allowed-failures': 20,
-            "distributed.scheduler.worker-saturation": 1.1, # helps with memory pile up
-            })
-        
-        cluster = LocalCluster(
-            n_workers=8, 
-            threads_per_worker=1, 
-            processes=True,
-            memory_limit='auto', 
-            local_directory=tempfile.mkdtemp(),
-            dashboard_address=":8787",
-            # silence_logs=logging.WARN,
-            )
-        client = Client(cluster)
-        
-        configure_rio(cloud_defaults=True, client=client) # For Planetary Computer
-        logging.info(f'Dask dashboard is available at: {client.dashboard_link}')
+        if owns_cluster:
+            logging.info('Initializing Dask cluster for parallelization')
+            cluster, client = start_worker_pool(n_workers=n_workers)
+        else:
+            logging.info(f'Using shared Dask worker pool: {client.dashboard_link}')
         
         
         logging.info('Create directories and naming conversions')   
@@ -170,82 +480,36 @@ def generate_composite(year_month: str, tile_id: str, tile_geom: dict):
         DATASET= f'S2L2A_medcomp_{tile_id.replace('_','')}_{yyyy}{mm1}'
         
         collection_path = f"{NASROOT}/{PRODUCT_NAME}"
-        dataset_path = f"{NASROOT}/{FOLDER}"
-        mkdir(dataset_path)
+        staged = StagedDataset(NASROOT, FOLDER, scratch_root=scratch)
+        dataset_path = staged.local_path
         eo3_path = f'{dataset_path}/{DATASET}.odc-metadata.yaml'
         stac_path = f'{dataset_path}/{DATASET}.stac-metadata.json'
-        log.info(f'Dataset location: {dataset_path}')
-        
-        
-        logging.info('                          ')
-        logging.info('Retrieve tile geometry')
-        # # Ensure shapely geometry
-        if isinstance(tile_geom, dict): 
-            geom_ll = shapely_shape(tile_geom)   
-        else:
-            geom_ll = tile_geom   
-        geom_3035 = gpd.GeoSeries([geom_ll], crs="EPSG:4326").to_crs(epsg=3035)
-        
-        minl, minf, maxl, maxf = geom_ll.bounds
-        minx, miny, maxx, maxy = geom_3035.total_bounds
-
-        logging.info('Create the Bounding Box (φ,λ)')
-        aoi_bbox = BoundingBox.from_xy(
-            (minl, maxl),
-            (minf, maxf)
-        ).buffered(xbuff=0.025, ybuff=0.025)
-
-        logging.info('Create the Bounding Box (x,y)')
-        tile_bbox = BoundingBox.from_xy(
-            (minx, maxx),
-            (miny, maxy),
-            crs='EPSG:3035'
-        )
+        stack_path = f'{dataset_path}/{DATASET}_SceneStack.nc'
+        previous_stack_path = f'{staged.final_path}/{DATASET}_SceneStack.nc'
+        logging.info(f'Dataset location: {staged.final_path}')
+        if staged.staged:
+            logging.info(f'Staged in: {dataset_path}')
         
-        tile_geobox = odc.geo.geobox.GeoBox.from_bbox(
-            tile_bbox, 
-            resolution=odc.geo.Resolution(x=20,y=-20)
-        )
-
         
         logging.info('                          ')
-        logging.info('Connect to Planetary Computer STAC Catalog')
-        stac_api_io = StacApiIO(max_retries=Retry(total=5, backoff_factor=5))
-        catalog = pystac_client.Client.open(
-            "https://planetarycomputer.microsoft.com/api/stac/v1",
-            modifier=planetary_computer.sign_inplace,
-            stac_io=stac_api_io
-        )
+        geom_ll, aoi_bbox, tile_bbox, tile_geobox = tile_grid(tile_geom)
         
-        logging.info('Search the STAC Catalog')
-        cloud_cover = 70
-        search = catalog.search(
-            collections=["sentinel-2-l2a"], #hls2-s30
-            bbox=aoi_bbox,
-            datetime=year_month,
-            limit=100,
-            query={
-                "eo:cloud_cover": {"lt":cloud_cover},
-                "s2:nodata_pixel_percentage": {"lt":33},
-            },
-        )
-        logging.info('        Query parameters:')
-        logging.info(f'            url:          {search.url}')
-        logging.info(f'            client:       {search.client.id}')
-        logging.info(f'            collection:   {search._parameters['collections'][0]}')
-        logging.info(f'            bbox:         {search._parameters['bbox']}')
-        logging.info(f'            time range:   {search._parameters['datetime']}')
-        logging.info(f'            cloud cover:  0% - {search._parameters['query']['eo:cloud_cover']['lt']}%')
-        logging.info(f'            nodata cover: 0% - {search._parameters['query']['s2:nodata_pixel_percentage']['lt']}%')
         
         logging.info('                          ')
-        logging.info('Searching...')
-        items = search.item_collection()
-        
-        logging.info(f'Query found {len(items)} items')
-        
-        logging.info('Searching for GRI REFINED scenes:')
-        refined_items, df_refinement_status = check_gri_refinement(items)
+        if cog_cache:
+            start_cog_cache(cog_cache, max_gb=cog_cache_gb)
+            reset_cog_cache_stats()
+        
+        reset_stac_roundtrips()
+        if shared_load is not None:
+            logging.info('Scenes of the tile from the shared scene-major search')
+            items, refined_items, df_refinement_status = shared_load.items_for(aoi_bbox)
+            logging.info(f'Query found {len(items)} items')
+        else:
+            items = search_s2l2a_items(aoi_bbox, year_month)
+            
+            logging.info('Searching for GRI REFINED scenes:')
+            refined_items, df_refinement_status = check_gri_refinement(items, sign_href=planetary_computer.sign)
         
         logging.info('                                 ')
         logging.info(f'{len(refined_items)}/{len(df_refinement_status)} were refined by GRI.')
@@ -259,36 +523,46 @@ def generate_composite(year_month: str, tile_id: str, tile_geom: dict):
         else:
             REFINEMENT_FLAG = 'REFINED'
 
-        N = 10
-        logging.info(f'Looking for up to {N} cleanest images within spatiotemporal range of each MGRS tile')
-        filtered_items = []
-        mgrs_tiles = np.unique([i.properties['s2:mgrs_tile'] for i in refined_items])
-        epsgs = np.unique([i.properties['proj:epsg'] for i in refined_items])
-        
-        for mgrstile in mgrs_tiles:
-            item_mgrs_sorted = sorted([
-                i for i in refined_items if i.properties['s2:mgrs_tile'] == str(mgrstile)
-                ], key=lambda item: item.properties['eo:cloud_cover'])
-            
-            if len(item_mgrs_sorted) > N:
-                filtered_items.extend(item_mgrs_sorted[:N])
-            else:
-                filtered_items.extend(item_mgrs_sorted)
-        logging.info(f"Filtered cleanest scenes: Kept {len(filtered_items)} out of {len(refined_items)} items. ")
-        logging.info(f"        Included MGRS Tiles: {mgrs_tiles}")
-        logging.info(f"        Included EPSG codes: {epsgs}")
+        if shared_load is not None and tile_id in shared_load.selections:
+            logging.info('Scenes of the tile as selected by the scene-major pass')
+            filtered_items, mgrs_tiles, epsgs = shared_load.selections[tile_id]
+        else:
+            filtered_items, mgrs_tiles, epsgs = select_tile_scenes(refined_items, tile_geobox, geom_ll, select_by_scl=select_by_scl)
 
         logging.info('Selected scenes:')
         for stacitem in filtered_items:
             logging.info(f'        {stacitem.id}')
             
         s2l2a_ids = [stacitem.id for stacitem in filtered_items]
+        
+        previous_stack = None
+        if existing_dataset is not None and incremental:
+            logging.info('                                 ')
+            if os.path.exists(previous_stack_path):
+                previous_stack, previous_ids = read_scene_stack(previous_stack_path, tile_geobox)
+                new_items = [i for i in filtered_items if i.id not in set(previous_ids)]
+                logging.info(f'{len(new_items)} of the {len(filtered_items)} selected scenes are not in the composite yet')
+                if not new_items:
+                    logging.info("The composite is up to date. Exit function. Continuing to next.")
+                    logging.info(f'')
+                    logging.info(f'             !!! UP TO DATE: Tile {tile_id} | Time: {year_month} | In {round((time.time() - start_time)/60, 2)} minutes')
+                    logging.info(f'')
+                    staged.discard()
+                    return
+                for stacitem in new_items:
+                    logging.info(f'        + {stacitem.id}')
+                filtered_items = new_items
+                epsgs = np.unique([i.properties['proj:epsg'] for i in filtered_items])
+                s2l2a_ids = previous_ids + [stacitem.id for stacitem in new_items]
+            else:
+                logging.warning(f'No scene stack sidecar in {previous_stack_path}: the composite is recomputed from all selected scenes')
             
         with open(f"{dataset_path}/{DATASET}_IncludedScenes.txt", "w") as f:
-            for stacitem in filtered_items:
-                f.write(stacitem.id + "\n")
+            for s2l2a_id in s2l2a_ids:
+                f.write(s2l2a_id + "\n")
 
-        plot_mgrs_tiles_with_aoi( # It has logging in it
+        renderer = QuicklookRenderer(enabled=quicklooks)
+        renderer.footprint( # It has logging in it
             filtered_items, 
             aoi_bbox, 
             save_path=f'{dataset_path}/{DATASET}_InDataFootprint.jpeg'
@@ -297,80 +571,72 @@ def generate_composite(year_month: str, tile_id: str, tile_geom: dict):
         logging.info(f'                                 ')
         logging.info(f'Downstream STAC items from Planetary Computer')
 
-        # Loading for each EPSG and Native RESOLUTION separatelly, then merging into a single xr.Dataset
-        # to to a correct downsampling
-        processed_epsgs = []
-        for EPSG in epsgs:
-            processed_epsgs.append(process_epsg(filtered_items, aoi_bbox, EPSG))
-               
-        RESAMPLING_ALGO = "bilinear"
-        logging.info(f'Reproject from UTM Zone to Tile geometry -> CRS(EPSG:{EPSG}), Resampling.{RESAMPLING_ALGO.lower()}')
-        processed_epsgs_to_tile = [ds.odc.reproject(how=tile_geobox, resampling=Resampling[RESAMPLING_ALGO]) for ds in processed_epsgs]
-        
-        logging.info(f'    New shape of datasets: {processed_epsgs_to_tile[0].odc.geobox.shape}')
-        del processed_epsgs
-        gc.collect()
-        
-        if len(processed_epsgs_to_tile)>1:
-            logging.info(f'                          ')
-            logging.info(f'Mosaic datasets to a single dataset')
-            ds_timeseries = merge_nodata0(processed_epsgs_to_tile, vars_mode="intersection", method="mean", chunks=None)
+        if shared_load is not None:
+            logging.info('Crop the tile from the scenes loaded once for all tiles of the month (scene-major)')
+            ds_timeseries = shared_load.load(filtered_items, tile_geobox)
         else:
-            ds_timeseries = processed_epsgs_to_tile[0]
+            if load_on_tile_grid:
+                # Loading each EPSG straight onto the tile GeoBox (EPSG:3035, 20 m), in a single resampling step
+                processed_epsgs_to_tile = []
+                for EPSG in epsgs:
+                    processed_epsgs_to_tile.append(process_epsg(filtered_items, aoi_bbox, EPSG, lazy=lazy_load, geobox=tile_geobox))
+                logging.info(f'    Shape of datasets: {processed_epsgs_to_tile[0].odc.geobox.shape}')
+            else:
+                # Loading for each EPSG and Native RESOLUTION separatelly, then merging into a single xr.Dataset
+                # to to a correct downsampling
+                processed_epsgs = []
+                for EPSG in epsgs:
+                    processed_epsgs.append(process_epsg(filtered_items, aoi_bbox, EPSG, lazy=lazy_load))
+                   
+                RESAMPLING_ALGO = "bilinear"
+                logging.info(f'Reproject from UTM Zone to Tile geometry -> CRS(EPSG:{EPSG}), Resampling.{RESAMPLING_ALGO.lower()}')
+                processed_epsgs_to_tile = [ds.odc.reproject(how=tile_geobox, resampling=Resampling[RESAMPLING_ALGO]) for ds in processed_epsgs]
             
-        del processed_epsgs_to_tile
+                logging.info(f'    New shape of datasets: {processed_epsgs_to_tile[0].odc.geobox.shape}')
+                del processed_epsgs
+                gc.collect()
+        
+            if len(processed_epsgs_to_tile)>1:
+                logging.info(f'                          ')
+                logging.info(f'Mosaic datasets to a single dataset')
+                ds_timeseries = merge_nodata0(processed_epsgs_to_tile, vars_mode="intersection", method="mean", chunks=None)
+            else:
+                ds_timeseries = processed_epsgs_to_tile[0]
+            
+            del processed_epsgs_to_tile
         client.run(lambda: __import__("gc").collect()); gc.collect()
         gc.collect()
         
-        # https://planetarycomputer.microsoft.com/dataset/sentinel-2-l2a#Baseline-Change
         BANDS = ['B02', 'B03', 'B04', 'B05', 'B07', 'B8A']
-        baseline400_mask = ds_timeseries.time > pd.Timestamp('2022-01-25')
-        if baseline400_mask.any():
-            logging.info('Scale SR to Sen2Cor Baseline 4.00 - Subtract 1000 in dates post 2022-01-25')
-            boa = ds_timeseries[BANDS].astype('i4')                       # avoid uint16 underflow
-            adj = xr.where(baseline400_mask, boa - 1000, boa)                    # subtract only post-cutover
-            adj = adj.clip(min=0).astype('u2') 
-            
-            ds_timeseries = ds_timeseries.assign({b: adj[b] for b in BANDS})
-            
-            for b in BANDS:
-                ds_timeseries[b].attrs['nodata'] = np.iinfo(np.uint16).min #0
-        else:
-            del baseline400_mask
-        
+        SIS = ['EVI', 'NDVI', 'PSRI2']
         
-        logging.info('Creating preview plot of input scenes')
-        save_dataset_preview(ds_timeseries, "B04", f'{dataset_path}/{DATASET}_InDataPreview.jpeg', dpi=300)
+        if previous_stack is not None:
+            logging.info(f'Merge the new scenes into the scene stack of the composite')
+            ds_timeseries = merge_nodata0([previous_stack[BANDS], ds_timeseries[BANDS]], vars_mode="intersection", method="mean")
+            del previous_stack
         
-        # reset bands list
-        ds_timeseries = ds_timeseries[['B02', 'B03', 'B04', 'B05', 'B07', 'B8A']]
+        if incremental:
+            ds_timeseries = ds_timeseries[BANDS].compute()
+            write_scene_stack(ds_timeseries, f'{stack_path}.pending', s2l2a_ids)
         
-        logging.info('Clip value range')
-        ds_timeseries = ds_timeseries.where(ds_timeseries > 0, np.nan)
-        ds_timeseries = ds_timeseries.where(ds_timeseries<=12000)
+        # One fused pass (block-wise on dask inputs) instead of a full pass per step:
+        # Sen2Cor Baseline 4.00 offset (-1000 post 2022-01-25), value range 0 < DN <= 12000,
+        # spectral indices and their typical value range
+        logging.info('Scale SR to Sen2Cor Baseline 4.00, clip value range, and compute spectral indices (fused kernel)')
+        logging.info(f'    {int((ds_timeseries.time > BASELINE400_CUTOVER).sum())} of {ds_timeseries.sizes["time"]} scenes after Baseline 4.00 cut-over')
+        ds_timeseries = apply_s2_pixel_kernel(ds_timeseries[BANDS])
         
-                        
-        logging.info(f'                          ')
-        logging.info('Computing spectral indices:')
-        SIS = ['EVI', 'NDVI', 'PSRI2']
-
-        logging.info('    EVI...')
-        ds_timeseries['EVI'] = spectral_indices.evi(ds=ds_timeseries)
-        logging.info('    NDVI...')
-        ds_timeseries['NDVI'] = spectral_indices.ndvi(ds_timeseries)
-        logging.info('    PSRI2...')
-        ds_timeseries['PSRI2'] = spectral_indices.psri2(ds_timeseries)
-
-        logging.info('Clip to typical value range')
-        for si in SIS:
-            if si in ['NDVI', 'EVI']:
-                ds_timeseries[si] = ds_timeseries[si].where((ds_timeseries[si]>=-1)&(ds_timeseries[si]<=1))
-            else:
-                ds_timeseries[si] = ds_timeseries[si].where((ds_timeseries[si]>=-1)&(ds_timeseries[si]<=4))
+        preview = renderer.decimated(ds_timeseries, "B04")
         
         logging.info('Reducing to median value temporal composite')
         ds_timeseries = ds_timeseries.sortby('time')
-        composite = ds_timeseries.median(dim='time').astype('float32').compute()
+        composite = nanmedian_time(ds_timeseries, dim='time', integral_vars=BANDS).astype('float32')
+        # the decimated preview is computed with the composite, so that a lazy scene stack is read once for both
+        composite, preview = dask.compute(composite, preview)
+        
+        logging.info('Queue the preview plot of input scenes (rendered in the background)')
+        renderer.preview(preview, "B04", f'{dataset_path}/{DATASET}_InDataPreview.jpeg')
+        del preview
         
         # keep time metadata
         yyyy = ds_timeseries.isel(time=0).time.dt.year.item()
@@ -417,19 +683,7 @@ def generate_composite(year_month: str, tile_id: str, tile_geom: dict):
         
         
         logging.info('Write bands to raster COG files')
-        name_measurements = []
-        for var in list(composite.data_vars):
-            file_path = f'{dataset_path}/{DATASET}_{var}.tif'
-            
-            composite[var].rio.to_raster(
-                raster_path=file_path, 
-                driver='COG',
-                dtype=str(composite[var].dtype),
-                windowed=True
-                )
-            name_measurements.append(file_path)
-            
-            logging.info(f'Write {var.upper()} -> {file_path}')
+        name_measurements = list(write_cogs(composite, lambda var: f'{dataset_path}/{DATASET}_{var}.tif', compression=cog_compression).values())
         
 
 
@@ -448,6 +702,8 @@ def generate_composite(year_month: str, tile_id: str, tile_geom: dict):
             set_range=False,
             lineage_path=None,
             version=1,
+            dataset_id=existing_dataset.id if existing_dataset is not None else None,
+            footprint=footprint,
             )
         
         del composite
@@ -460,55 +716,107 @@ def generate_composite(year_month: str, tile_id: str, tile_geom: dict):
         with open(stac_path, 'w') as json_file:
             json.dump(stac_doc, json_file, indent=4, default=False)
         
-        logging.info('Create datacube.model.Dataset from eo3 metadata')
-        WORKING_ON_CLOUD=False
-        uri = eo3_path if WORKING_ON_CLOUD else f"file:///{eo3_path}"
-
-        resolver = Doc2Dataset(dc.index)
-        dataset_tobe_indexed, err  = resolver(doc_in=serialise.to_doc(eo3_doc), uri=uri)
+        renderer.close()
+        staged.verify()
         
-        if err:
-            msg=f'             ✖✖✖ FAILED loading for : Tile {tile_id} | Time: {year_month} | with Exception: {err}' # ✗
-            logging.error(msg)
-            logging.info('#######################################################################')
-            raise RuntimeError(msg)
+        def commit_scene_stack():
+            # the new scene IDs become visible to the next incremental run only now that the composite is indexed
+            pending_stack_path = f'{previous_stack_path}.pending'
+            if incremental and os.path.exists(pending_stack_path):
+                os.replace(pending_stack_path, previous_stack_path)
+                logging.info(f'Scene stack sidecar of {DATASET} committed')
+        
+        def publish_and_index():
+            # the dataset is indexed only once its files are complete on the NAS
+            staged.publish()
+            
+            logging.info('Create datacube.model.Dataset from eo3 metadata')
+            WORKING_ON_CLOUD=False
+            final_eo3_path = f'{staged.final_path}/{DATASET}.odc-metadata.yaml'
+            uri = final_eo3_path if WORKING_ON_CLOUD else f"file:///{final_eo3_path}"
+            
+            if indexer is not None:
+                indexed = indexer.submit(eo3_doc, uri, label=DATASET, update=existing_dataset is not None)
+                indexed.add_done_callback(lambda f: commit_scene_stack() if f.exception() is None else None)
+                return indexed
+            
+            index_dc = dc if dc is not None else datacube.Datacube(app='Composite generation', env='drought')
+            resolver = Doc2Dataset(index_dc.index)
+            dataset_tobe_indexed, err  = resolver(doc_in=serialise.to_doc(eo3_doc), uri=uri)
             
-        logging.info('Index to datacube')
-        dc.index.datasets.add(dataset=dataset_tobe_indexed, with_lineage=False)
+            if err:
+                msg=f'             ✖✖✖ FAILED loading for : Tile {tile_id} | Time: {year_month} | with Exception: {err}' # ✗
+                logging.error(msg)
+                logging.info('#######################################################################')
+                raise RuntimeError(msg)
+                
+            if existing_dataset is not None:
+                logging.info(f'Update dataset {existing_dataset.id} in datacube')
+                index_dc.index.datasets.update(dataset_tobe_indexed, updates_allowed={('properties',): changes.allow_any})
+            else:
+                logging.info('Index to datacube')
+                index_dc.index.datasets.add(dataset=dataset_tobe_indexed, with_lineage=False)
+            commit_scene_stack()
+        
+        if publisher is not None and staged.staged:
+            published = publisher.submit(publish_and_index, label=DATASET)
+        else:
+            published = publish_and_index()         # the Future of its indexing with an `indexer`, else None
         
+        log_stac_roundtrips()
+        log_cog_cache_stats()
         logging.info(f'')
-        logging.info(f'             ✔✔✔ COMPLETED: Tile {tile_id} | Time: {year_month} | In {round((time.time() - start_time)/60, 2)} minutes')
+        logging.info(f'             ✔✔✔ COMPLETED: Tile {tile_id} | Time: {year_month} | In {round((time.time() - start_time)/60, 2)} minutes' + (' (publishing or indexing in the background)' if published else ''))
         logging.info(f'')
+        return published
     except Exception as exc:
         msg=f'             ✖✖✖ FAILED loading for : Tile {tile_id} | Time: {year_month} | with Exception: {exc}' # ✗
         logging.error(msg)
+        if staged is not None:
+            staged.discard()
         raise
     finally:
-        try:
-            if client is not None:
-                logging.info('Closing Dask client')
-                client.close()
-        finally:
-            if cluster is not None:
-                logging.info('Closing Dask cluster')
-                logging.info('#######################################################################')
-                cluster.close()
+        if renderer is not None:
+            renderer.close()
+        if owns_cluster and cluster is not None:
+            close_local_cluster(cluster, client)
+            logging.info('#######################################################################')
                 
                 
 if __name__ == "__main__":
     import argparse, json, sys, os, datetime, pytz
     from utils.utils import setup_logger
 
-    p = argparse.ArgumentParser(description="Run ONE composite from a single .geojson and exit.")
-    p.add_argument("--geojson", required=True, help="Path to a single GeoJSON file")
+    p = argparse.ArgumentParser(description="Run ONE composite from a single .geojson, or from a job of a plan, and exit.")
+    p.add_argument("--geojson", default=None, help="Path to a single GeoJSON file")
+    p.add_argument("--plan", default=None, help="Plan exported by run_composites.py (with --job)")
+    p.add_argument("--job", default=None, help="Key of the job in --plan")
+    p.add_argument("--workers", type=int, default=8, help="Dask worker processes of the LocalCluster")
+    p.add_argument("--lazy-load", action="store_true", help="Load all bands of a UTM zone as one lazy dask graph")
+    p.add_argument("--load-on-tile-grid", action="store_true", help="Load straight onto the EPSG:3035 tile GeoBox (no UTM intermediate)")
+    p.add_argument("--incremental", action="store_true", help="Keep a scene stack sidecar and update an existing composite with newly published scenes")
+    p.add_argument("--select-by-scl", action="store_true", help="Select scenes by clear pixels inside the tile from a coarse SCL overview")
+    p.add_argument("--cog-cache", default=None, metavar="DIR", help="Read COGs through a persistent block cache in DIR (e.g. ../cache/cogs)")
+    p.add_argument("--cog-cache-gb", type=float, default=50.0, help="Size cap of the COG block cache in GB (default: 50)")
+    p.add_argument("--no-quicklooks", action="store_true", help="Skip the footprint and input scenes preview JPEGs")
+    p.add_argument("--cog-compression", choices=["deflate", "zstd", "lerc"], default="deflate", help="Compression of the band COGs (default: deflate)")
+    p.add_argument("--scratch", default=None, metavar="DIR", help="Stage the dataset in local DIR, verify it, then publish it to the NAS atomically")
+    p.add_argument("--footprint", choices=["bounds", "mask"], default="bounds", help="Dataset geometry: tile bounds or valid-data polygon (default: bounds)")
     args = p.parse_args()
 
+    if (args.geojson is None) == (args.plan is None or args.job is None):
+        p.error("give either --geojson, or --plan and --job")
+
     try:
-        with open(args.geojson, "r", encoding="utf-8") as f:
-            d = json.load(f)
-        year_month = d["properties"]["year_month"]
-        tile_id    = d["properties"]["tile_id"]
-        tile_geom  = d["geometry"]
+        if args.plan:
+            job = read_plan_job(args.plan, args.job)
+            year_month, tile_id, tile_geom = job.year_month, job.tile_id, job.tile
+        else:
+            with open(args.geojson, "r", encoding="utf-8") as f:
+                d = json.load(f)
+            year_month = d["properties"]["year_month"]
+            tile_id    = d["properties"]["tile_id"]
+            tile_geom  = d["geometry"]
         
         log = setup_logger(
             logger_name='compgen_',
@@ -516,7 +824,11 @@ if __name__ == "__main__":
             logger_format='%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s',
         )
 
-        generate_composite(year_month=year_month, tile_id=tile_id, tile_geom=tile_geom)
+        generate_composite(year_month=year_month, tile_id=tile_id, tile_geom=tile_geom, n_workers=args.workers,
+                           lazy_load=args.lazy_load, load_on_tile_grid=args.load_on_tile_grid, incremental=args.incremental,
+                           select_by_scl=args.select_by_scl, cog_cache=args.cog_cache, cog_cache_gb=args.cog_cache_gb,
+                           quicklooks=not args.no_quicklooks, cog_compression=args.cog_compression, scratch=args.scratch,
+                           footprint=args.footprint)
         sys.exit(0)         # success (including "skipped" is still success)
     except Exception:
         import logging
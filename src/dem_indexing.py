@@ -44,6 +44,7 @@ import time
 
 from utils.metadata import prepare_eo3_metadata_NAS
 from utils.utils import mkdir, setup_logger
+from utils.cog_writer import write_cogs
 
 import argparse, json, sys, os, datetime, pytz
 
@@ -108,21 +109,8 @@ def dem_writing_indexing(dem: xr.Dataset, tile: gpd.GeoDataFrame):
         
         log.info(f'Writing GTiff (COG) to disk')
         gc.collect()
-        name_measurements = []
-        relative_name_measurements = []
-        for var in list(dem_tile.data_vars):
-            file_path = f'{dataset_path}/{DATASET}_{var}.tif'
-            
-            dem_tile[var].rio.to_raster(
-                raster_path=file_path, 
-                driver='COG',
-                dtype=str(dem_tile[var].dtype),
-                windowed=True
-                )
-            name_measurements.append(file_path)
-            relative_name_measurements.append(f'{DATASET}_{var}.tif')
-            
-            log.info(f'Write {var.upper()} -> {file_path}')
+        name_measurements = list(write_cogs(dem_tile, lambda var: f'{dataset_path}/{DATASET}_{var}.tif').values())
+        relative_name_measurements = [p.split("/")[-1] for p in name_measurements]
         
         log.info('Prepare metadata YAML document')
         yyyy = 2021
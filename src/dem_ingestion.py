@@ -39,6 +39,7 @@ import time
 
 from utils.metadata import prepare_eo3_metadata_NAS
 from utils.utils import mkdir, setup_logger
+from utils.cog_cache import route_items_through_cache
 
 # Ignore warnings
 import warnings
@@ -107,7 +108,7 @@ def copdem_ingestion(tiles: gpd.GeoDataFrame):
         
         logging.info('Loading with odc.stac ...')
         dem = odc.stac.load(
-            items_dem,
+            route_items_through_cache(items_dem),
             bands=[dem_band],
             like=geobox_total,
             chunks=dict(time=1, y=2048, x=2048),
@@ -15,6 +15,7 @@
 
 from utils.utils import setup_logger, mkdir
 
+import argparse
 import datetime, pytz
 import gc, os, sys, time
 import json
@@ -26,6 +27,11 @@ from pathlib import Path
 import subprocess
 
 if __name__ == "__main__":   
+    p = argparse.ArgumentParser(description="Run the baseline of all tiles.")
+    p.add_argument("--streaming", action="store_true", help="Compute each baseline one composite month at a time (memory independent of the period)")
+    p.add_argument("--robust", action="store_true", help="Compute the robust baselines (median, MAD, p10, p90) instead")
+    args = p.parse_args()
+
     # Set up logger.
     mkdir("../logs/baseline")
     log = setup_logger(logger_name='admin_baseline_',
@@ -41,7 +47,7 @@ if __name__ == "__main__":
     # 2) collect tasks
     tiles = gpd.read_file(tile_geojson_filepath)
         
-    done_file = Path("../logs/baseline/admin_completed_geojsons.txt")
+    done_file = Path("../logs/baseline/admin_completed_robust.txt" if args.robust else "../logs/baseline/admin_completed_geojsons.txt")
     already_done = set()
     if done_file.exists():
         already_done = set(x for x in done_file.read_text().splitlines() if x)
@@ -58,7 +64,7 @@ if __name__ == "__main__":
         log.info(f"[>] Launching single-shot: {tile_id} [{i+1}/{len(tiles)}]")
         
         rc = subprocess.run(
-            [sys.executable, "baseline.py", "--tile", tile_id],
+            [sys.executable, "baseline.py", "--tile", tile_id] + (["--streaming"] if args.streaming else []) + (["--robust"] if args.robust else []),
             check=False,
         ).returncode
 
@@ -0,0 +1,1088 @@
+'''
+######################################################################
+## ARISTOTLE UNIVERSITY OF THESSALONIKI
+## PERSLAB
+## REMOTE SENSING AND EARTH OBSERVATION TEAM
+##
+## DATE:             Oct-2026
+## SCRIPT:           run_benchmarks.py
+## AUTHOR:           Vangelis Fotakidis (fotakidis@topo.auth.gr)
+##
+## DESCRIPTION:      Script to benchmark pipeline components on synthetic data  >>> (venv) python run_benchmarks.py <benchmark>
+##
+#######################################################################
+'''
+
+from utils.utils import setup_logger, mkdir
+
+import argparse
+import datetime, pytz
+import multiprocessing
+import os, sys, time
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
+
+
+def _in_fresh_process(fn, *args):
+    """Run `fn` in a fresh interpreter, so GDAL/odc caches of one variant do not serve the next."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(fn, *args).result()
+
+
+# ---------------- TILE GRID LOAD ----------------
+def _tile_grid_load_variant(variant, items, aoi_bbox, tile_geobox):
+    from rasterio.enums import Resampling
+    from utils.timeseries_processing import process_epsg, merge_nodata0
+
+    epsgs = sorted({i.properties['proj:epsg'] for i in items})
+
+    t0 = time.time()
+    if variant == 'utm':
+        processed = [process_epsg(items, aoi_bbox, epsg) for epsg in epsgs]
+        processed = [ds.odc.reproject(how=tile_geobox, resampling=Resampling.bilinear) for ds in processed]
+    else:
+        processed = [process_epsg(items, aoi_bbox, epsg, geobox=tile_geobox) for epsg in epsgs]
+    ds = merge_nodata0(processed, vars_mode="intersection", method="mean").load()
+    return time.time() - t0, dict(ds.sizes)
+
+
+def bench_tile_grid_load(log, workdir, tile_size_px=480, scene_size_m=20_000):
+    """
+    Synthetic two-zone case: one scene per UTM zone (EPSG:32634 / EPSG:32635) and date, around the
+    24°E zone boundary, composited onto an EPSG:3035 tile. Compares the current path (buffered AOI
+    loaded on each UTM grid, then reprojected to the tile) with loading straight onto the tile GeoBox.
+    """
+    from odc.geo.geom import point, BoundingBox
+    from odc.geo.geobox import GeoBox
+    from odc.geo import Resolution
+    from utils.benchmarking import ByteCountingHTTPServer, write_synthetic_s2_scene
+
+    server = ByteCountingHTTPServer(workdir).start()
+
+    centre = point(24.0, 38.5, 'EPSG:4326')
+    items = []
+    for epsg in (32634, 32635):
+        cx, cy = centre.to_crs(f'EPSG:{epsg}').coords[0]
+        x0 = (cx - scene_size_m/2) // 60 * 60
+        y0 = (cy + scene_size_m/2) // 60 * 60
+        for d, day in enumerate((5, 15)):
+            items.append(write_synthetic_s2_scene(
+                os.path.join(workdir, 'scenes'), server.url, f'S2_{epsg}_{day:02d}', epsg, x0, y0, scene_size_m,
+                datetime.datetime(2024, 7, day, tzinfo=datetime.timezone.utc), seed=epsg + d,
+            ))
+
+    cx, cy = centre.to_crs('EPSG:3035').coords[0]
+    half = tile_size_px * 20 / 2
+    tile_bbox = BoundingBox(cx - half, cy - half, cx + half, cy + half, 'EPSG:3035')
+    tile_geobox = GeoBox.from_bbox(tile_bbox, resolution=Resolution(x=20, y=-20))
+    aoi_bbox = tile_bbox.to_crs('EPSG:4326').buffered(0.025, 0.025)
+    log.info(f'Tile GeoBox: {tile_geobox.shape} | scenes: {[i.id for i in items]}')
+
+    for variant in ('utm', 'tile'):
+        server.reset()
+        wall, sizes = _in_fresh_process(_tile_grid_load_variant, variant, items, aoi_bbox, tile_geobox)
+        log.info(f'[{variant:>4}] wall time: {wall:6.2f} s | bytes read: {server.bytes_served/1024**2:8.2f} MiB '
+                 f'in {server.requests} requests | output {sizes}')
+    server.shutdown()
+
+
+# ---------------- PIXEL KERNEL ----------------
+def _legacy_pixel_chain(ds):
+    """The per-step passes `generate_composite` made before the fused kernel."""
+    import numpy as np
+    import pandas as pd
+    import xarray as xr
+    from utils import spectral_indices
+
+    BANDS = ['B02', 'B03', 'B04', 'B05', 'B07', 'B8A']
+    baseline400_mask = ds.time > pd.Timestamp('2022-01-25')
+    boa = ds[BANDS].astype('i4')
+    adj = xr.where(baseline400_mask, boa - 1000, boa)
+    adj = adj.clip(min=0).astype('u2')
+    ds = ds.assign({b: adj[b] for b in BANDS})[BANDS]
+
+    ds = ds.where(ds > 0, np.nan)
+    ds = ds.where(ds <= 12000)
+    ds['EVI'] = spectral_indices.evi(ds=ds)
+    ds['NDVI'] = spectral_indices.ndvi(ds)
+    ds['PSRI2'] = spectral_indices.psri2(ds)
+    for si in ['EVI', 'NDVI', 'PSRI2']:
+        hi = 4 if si == 'PSRI2' else 1
+        ds[si] = ds[si].where((ds[si] >= -1) & (ds[si] <= hi))
+    return ds
+
+
+def _synthetic_l2a_stack(tile_size_px, n_scenes, seed=0):
+    import numpy as np
+    import pandas as pd
+    import xarray as xr
+
+    rng = np.random.default_rng(seed)
+    times = pd.date_range('2021-12-20', periods=n_scenes, freq='5D')  # straddles the Baseline 4.00 cut-over
+    shape = (n_scenes, tile_size_px, tile_size_px)
+    bands = {}
+    for b in ['B02', 'B03', 'B04', 'B05', 'B07', 'B8A']:
+        data = rng.integers(0, 13500, shape, dtype='uint16')
+        data[rng.random(shape, dtype='float32') < 0.2] = 0
+        bands[b] = (('time', 'y', 'x'), data)
+    return xr.Dataset(bands, coords=dict(time=times, y=np.arange(tile_size_px)*-20., x=np.arange(tile_size_px)*20.))
+
+
+def _peak_traced_mib(fn, *args):
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1] / 1024**2
+    finally:
+        tracemalloc.stop()
+
+
+def bench_pixel_kernel(log, workdir, tile_size_px=2400, n_scenes=20):
+    """
+    Tile-sized synthetic stack (tile_size_px^2 x n_scenes, six uint16 bands), chunked as odc.stac
+    loads it. Compares the former chain of xarray passes with the fused kernel on:
+      - passes: dask graph layers between the input bands and the outputs,
+      - allocations: peak traced memory of one eager (numpy) block,
+      - time: computing all outputs block by block (reduced with a sum, so no output is kept).
+    The outputs of both variants are first compared on one block.
+    """
+    import dask
+    import numpy as np
+    from utils.sentinel2 import apply_s2_pixel_kernel
+
+    ds = _synthetic_l2a_stack(tile_size_px, n_scenes)
+    log.info(f'Synthetic stack: {dict(ds.sizes)} | {ds.nbytes/1024**2:.0f} MiB uint16')
+    block = ds.isel(y=slice(0, 512), x=slice(0, 1024))
+    lazy = ds.chunk(dict(time=-1, y=512, x=1024))
+    input_layers = len(lazy.__dask_graph__().layers)
+
+    # the fused kernel computes the indices in float32, the former chain in float64 (then cast to float32):
+    # the bands, NDVI and PSRI2 must be equal, EVI within float32 rounding
+    expected, actual = _legacy_pixel_chain(block), apply_s2_pixel_kernel(block)
+    for v in expected.data_vars:
+        x, y = expected[v].values, actual[v].values
+        if np.array_equal(x, y, equal_nan=True):
+            log.info(f'[{v:>6}] fused kernel equal to the former chain')
+            continue
+        diff = float(np.nanmax(np.abs(x - y)))
+        flipped = int((np.isnan(x) != np.isnan(y)).sum())
+        if v != 'EVI' or diff > 1e-3 or flipped > 1e-4*x.size:
+            raise AssertionError(f'Fused kernel differs from the former chain on {v}: max abs difference {diff:.2e}, {flipped} pixels NaN in one only')
+        log.info(f'[{v:>6}] fused kernel within float32 rounding of the former chain: max abs difference {diff:.2e}, '
+                 f'{flipped}/{x.size} pixels on the clip range edges NaN in one only')
+
+    for variant, fn in (('legacy', _legacy_pixel_chain), ('fused', apply_s2_pixel_kernel)):
+        out = fn(lazy)
+        passes = len(out.__dask_graph__().layers) - input_layers
+        peak = _peak_traced_mib(fn, block)
+
+        t0 = time.time()
+        dask.compute(*[out[v].sum() for v in out.data_vars])
+        wall = time.time() - t0
+        log.info(f'[{variant:>6}] passes (graph layers): {passes:3d} | peak memory of one {dict(block.sizes)} block: '
+                 f'{peak:7.1f} MiB ({peak/(block.nbytes/1024**2):4.1f}x its input) | wall time: {wall:6.2f} s')
+
+
+# ---------------- TEMPORAL MEDIAN ----------------
+def bench_temporal_median(log, workdir, tile_size_px=2400, n_scenes=20):
+    """
+    Median over time of a tile-sized float32 stack, with `xarray.median` and with `nanmedian_time`,
+    for a reflectance band (whole numbers, sorted as uint16) and a spectral index (float32), both
+    ~35% NaN as after cloud masking. Eager (numpy) and block-wise (dask, 512x1024 blocks as loaded).
+    """
+    import numpy as np
+    import xarray as xr
+    from utils.timeseries_processing import nanmedian_time
+
+    rng = np.random.default_rng(0)
+    shape = (n_scenes, tile_size_px, tile_size_px)
+    band = rng.integers(1, 12001, shape, dtype='uint16').astype('float32')
+    band[rng.random(shape, dtype='float32') < 0.35] = np.nan
+    index = rng.uniform(-1, 1, shape).astype('float32')
+    index[np.isnan(band)] = np.nan
+
+    for name, data, integral_vars in (('band', band, ['v']), ('index', index, [])):
+        ds = xr.Dataset({'v': (('time', 'y', 'x'), data)})
+        for mode, inp in (('numpy', ds), ('dask', ds.chunk(dict(time=-1, y=512, x=1024)))):
+            t0 = time.time()
+            reference = inp.median(dim='time').compute()
+            t_xarray = time.time() - t0
+
+            t0 = time.time()
+            fast = nanmedian_time(inp, dim='time', integral_vars=integral_vars).compute()
+            t_fast = time.time() - t0
+
+            identical = np.array_equal(reference.v.values, fast.v.values, equal_nan=True)
+            log.info(f'[{name:>5} | {mode:>5}] {dict(ds.sizes)} | xarray.median: {t_xarray:6.2f} s | '
+                     f'nanmedian_time: {t_fast:6.2f} s | x{t_xarray/t_fast:4.1f} | identical: {identical}')
+
+
+# ---------------- SCENE SELECTION ----------------
+def _load_selected(items, tile_geobox):
+    from utils.timeseries_processing import process_epsg
+    for epsg in sorted({i.properties['proj:epsg'] for i in items}):
+        process_epsg(items, None, epsg, geobox=tile_geobox)
+
+
+def bench_scene_selection(log, workdir, n_scenes=16, tile_size_px=480, scene_size_m=20_000, n_per_mgrs=10):
+    """
+    Synthetic month of `n_scenes` scenes over one tile, whose scene-wide eo:cloud_cover is unrelated
+    to the clouds over the tile. Compares the N-lowest eo:cloud_cover selection with the tile SCL
+    selection: clear observations per tile pixel, and bytes read for the SCL overviews and for the
+    full-resolution load of the selected scenes.
+    """
+    import numpy as np
+    from odc.geo.geom import point, BoundingBox
+    from odc.geo.geobox import GeoBox
+    from odc.geo import Resolution
+    from utils.benchmarking import ByteCountingHTTPServer, write_synthetic_s2_scene
+    from utils.timeseries_processing import tile_clear_masks, greedy_clear_coverage, coverage_summary
+
+    server = ByteCountingHTTPServer(workdir).start()
+    epsg = 32634
+    cx, cy = point(22.5, 38.5, 'EPSG:4326').to_crs(f'EPSG:{epsg}').coords[0]
+    x0, y0 = (cx - scene_size_m/2) // 60 * 60, (cy + scene_size_m/2) // 60 * 60
+    items = [
+        write_synthetic_s2_scene(os.path.join(workdir, 'scenes'), server.url, f'S2_{day:02d}', epsg, x0, y0, scene_size_m,
+                                 datetime.datetime(2024, 7, day, tzinfo=datetime.timezone.utc), seed=day,
+                                 cloud_patches=int(np.random.default_rng(day).integers(0, 40)))
+        for day in range(1, n_scenes + 1)
+    ]
+
+    cx, cy = point(22.5, 38.5, 'EPSG:4326').to_crs('EPSG:3035').coords[0]
+    half = tile_size_px * 20 / 2
+    tile_bbox = BoundingBox(cx - half, cy - half, cx + half, cy + half, 'EPSG:3035')
+    tile_geobox = GeoBox.from_bbox(tile_bbox, resolution=Resolution(x=20, y=-20))
+
+    server.reset()
+    clear, inside = tile_clear_masks(items, tile_geobox, tile_bbox.polygon, resolution=160)
+    scl_bytes, scl_requests = server.bytes_served, server.requests
+    log.info(f'SCL overviews of {len(items)} candidates: {scl_bytes/1024**2:.2f} MiB in {scl_requests} requests')
+
+    by_cloud_cover = sorted(range(len(items)), key=lambda i: items[i].properties['eo:cloud_cover'])[:n_per_mgrs]
+    by_scl = greedy_clear_coverage(clear, inside, target_obs=3, target_fraction=0.95, max_scenes=n_per_mgrs)
+    for label, subset, overhead in (('eo:cloud_cover', by_cloud_cover, 0), ('tile SCL', by_scl, scl_bytes)):
+        reached, mean_obs = coverage_summary(clear, inside, subset, 3)
+        server.reset()
+        _load_selected([items[i] for i in subset], tile_geobox)
+        log.info(f'[{label:>14}] {len(subset):2d} scenes | {100*reached:5.1f}% of tile pixels with >= 3 clear obs. | '
+                 f'{mean_obs:4.1f} clear obs. per pixel | full-res load: {server.bytes_served/1024**2:7.2f} MiB '
+                 f'(+ {overhead/1024**2:.2f} MiB SCL overviews)')
+    server.shutdown()
+
+
+# ---------------- COG BLOCK CACHE ----------------
+def bench_cog_cache(log, workdir, tile_size_px=480, scene_size_m=30_000, n_scenes=3):
+    """
+    Two adjacent tiles composited from the same synthetic scenes, read through the COG block cache
+    (proxy in front of the byte-counting server): tile A cold, tile B next to it, then tile A again.
+    Reports the cache counters and the bytes that actually reached the server for each load.
+    """
+    from odc.geo.geom import point, BoundingBox
+    from odc.geo.geobox import GeoBox
+    from odc.geo import Resolution
+    from utils.benchmarking import ByteCountingHTTPServer, write_synthetic_s2_scene
+    from utils import cog_cache
+    from utils.timeseries_processing import process_epsg
+
+    server = ByteCountingHTTPServer(workdir).start()
+    epsg = 32634
+    cx, cy = point(22.5, 38.5, 'EPSG:4326').to_crs(f'EPSG:{epsg}').coords[0]
+    x0, y0 = (cx - scene_size_m/2) // 60 * 60, (cy + scene_size_m/2) // 60 * 60
+    items = [
+        write_synthetic_s2_scene(os.path.join(workdir, 'scenes'), server.url, f'S2_{day:02d}', epsg, x0, y0, scene_size_m,
+                                 datetime.datetime(2024, 7, day, tzinfo=datetime.timezone.utc), seed=day)
+        for day in range(1, n_scenes + 1)
+    ]
+
+    proxy = cog_cache.start_cog_cache(os.path.join(workdir, 'cog_cache'), max_gb=1)
+    cx, cy = point(22.5, 38.5, 'EPSG:4326').to_crs('EPSG:3035').coords[0]
+    side = tile_size_px * 20
+    for name, x_min in (('A (cold)', cx - side), ('B (adjacent)', cx), ('A (again)', cx - side)):
+        tile_geobox = GeoBox.from_bbox(BoundingBox(x_min, cy - side/2, x_min + side, cy + side/2, 'EPSG:3035'),
+                                       resolution=Resolution(x=20, y=-20))
+        server.reset()
+        cog_cache.reset_cog_cache_stats()
+        t0 = time.time()
+        process_epsg(items, None, epsg, geobox=tile_geobox)
+        s = proxy.stats
+        log.info(f'[tile {name:<12}] {time.time() - t0:5.2f} s | blocks hit {s.hits:4d} / missed {s.misses:4d} | '
+                 f'saved {s.bytes_saved/1024**2:7.2f} MiB | upstream {server.bytes_served/1024**2:7.2f} MiB in {server.requests} requests')
+    server.shutdown()
+
+
+# ---------------- SCENE-MAJOR ----------------
+SCENE_MAJOR_BANDS = ['B02', 'B03', 'B04', 'B05', 'B07', 'B8A']
+
+
+def _block_geoboxes(tile_size_px, block):
+    from odc.geo.geom import point, BoundingBox
+    from odc.geo.geobox import GeoBox
+    from odc.geo import Resolution
+
+    cx, cy = point(22.5, 38.5, 'EPSG:4326').to_crs('EPSG:3035').coords[0]
+    x0, y0 = cx // 20 * 20, cy // 20 * 20
+    side = tile_size_px * 20
+    tiles = {
+        f'x{i:02d}_y{j:02d}': GeoBox.from_bbox(BoundingBox(x0 + i*side, y0 - (j + 1)*side, x0 + (i + 1)*side, y0 - j*side, 'EPSG:3035'),
+                                               resolution=Resolution(x=20, y=-20))
+        for i in range(block) for j in range(block)
+    }
+    union = GeoBox.from_bbox(BoundingBox(x0, y0 - block*side, x0 + block*side, y0, 'EPSG:3035'), resolution=Resolution(x=20, y=-20))
+    return tiles, union
+
+
+def _tile_major_composite(items, tile_geobox):
+    from utils.sentinel2 import apply_s2_pixel_kernel
+    from utils.timeseries_processing import process_epsg, nanmedian_time
+
+    t0 = time.time()
+    ds = process_epsg(items, None, items[0].properties['proj:epsg'], geobox=tile_geobox)
+    ds = apply_s2_pixel_kernel(ds[SCENE_MAJOR_BANDS])
+    composite = nanmedian_time(ds, integral_vars=SCENE_MAJOR_BANDS).compute()
+    return time.time() - t0, composite
+
+
+def _scene_major_composites(items, tile_geoboxes, union_geobox):
+    from utils.sentinel2 import apply_s2_pixel_kernel
+    from utils.timeseries_processing import process_epsg, nanmedian_time, crop_shared_stack
+
+    t0 = time.time()
+    ds = process_epsg(items, None, items[0].properties['proj:epsg'], geobox=union_geobox)[SCENE_MAJOR_BANDS].persist()
+    composites = {}
+    for tile_id, tile_geobox in tile_geoboxes.items():
+        tile_ds = apply_s2_pixel_kernel(crop_shared_stack(ds, items, tile_geobox))
+        composites[tile_id] = nanmedian_time(tile_ds, integral_vars=SCENE_MAJOR_BANDS).compute()
+    return time.time() - t0, composites
+
+
+def bench_scene_major(log, workdir, tile_size_px=300, block=2, n_scenes=6, scene_size_m=30_000):
+    """
+    One month of a `block` x `block` group of adjacent tiles, all covered by the same synthetic scenes.
+    Tile-major: each tile is loaded (in a fresh process, as each job is) and reduced on its own.
+    Scene-major: the scenes are loaded once on the GeoBox of the group and each tile is cropped from it.
+    Reports the bytes served and the wall time of the month in both cases, and how far the composites are from the tile-major ones.
+    """
+    import numpy as np
+    from odc.geo.geom import point
+    from utils.benchmarking import ByteCountingHTTPServer, write_synthetic_s2_scene
+
+    server = ByteCountingHTTPServer(workdir).start()
+    epsg = 32634
+    cx, cy = point(22.5, 38.5, 'EPSG:4326').to_crs(f'EPSG:{epsg}').coords[0]
+    x0, y0 = (cx - scene_size_m/4) // 60 * 60, (cy + scene_size_m/4) // 60 * 60
+    items = [
+        write_synthetic_s2_scene(os.path.join(workdir, 'scenes'), server.url, f'S2_{day:02d}', epsg, x0, y0, scene_size_m,
+                                 datetime.datetime(2024, 7, 5*day, 10, 20, 31, 24000, tzinfo=datetime.timezone.utc), seed=day)
+        for day in range(1, n_scenes + 1)
+    ]
+    tile_geoboxes, union_geobox = _block_geoboxes(tile_size_px, block)
+    log.info(f'{len(tile_geoboxes)} tiles of {tile_size_px}x{tile_size_px} px, {n_scenes} scenes | shared GeoBox {union_geobox.shape}')
+
+    server.reset()
+    tile_major, wall = {}, 0.0
+    for tile_id, tile_geobox in tile_geoboxes.items():
+        seconds, tile_major[tile_id] = _in_fresh_process(_tile_major_composite, items, tile_geobox)
+        wall += seconds
+    log.info(f'[tile-major ] month wall time {wall:6.2f} s | {server.bytes_served/1024**2:8.2f} MiB downloaded in {server.requests} requests')
+
+    server.reset()
+    wall, scene_major = _in_fresh_process(_scene_major_composites, items, tile_geoboxes, union_geobox)
+    log.info(f'[scene-major] month wall time {wall:6.2f} s | {server.bytes_served/1024**2:8.2f} MiB downloaded in {server.requests} requests')
+
+    # both warp UTM -> EPSG:3035 with GDAL's approximate transformer, per output chunk: chunks of different
+    # extents give sub-pixel differences, visible mostly where the nearest-resampled SCL mask edges move
+    for v in SCENE_MAJOR_BANDS:
+        a = np.concatenate([tile_major[t][v].values.ravel() for t in tile_geoboxes])
+        b = np.concatenate([scene_major[t][v].values.ravel() for t in tile_geoboxes])
+        both = np.isfinite(a) & np.isfinite(b)
+        log.info(f'{v}: {round(100*np.mean((a == b) | ~(np.isfinite(a) | np.isfinite(b))), 2)}% pixels identical to tile-major | '
+                 f'median abs. difference {np.median(np.abs(a[both] - b[both])):.1f} DN | {round(100*np.mean(np.isfinite(a) != np.isfinite(b)), 2)}% differ in NoData')
+    server.shutdown()
+
+
+# ---------------- COG WRITER ----------------
+def _synthetic_product_dataset(tile_size_px, seed=0):
+    """Bands of the shape, dtypes and nodata of the products: uint16 SR (composites), int16 x1000 indices, float32 z-scores."""
+    import numpy as np
+    import xarray as xr
+    import rioxarray as rxr  # noqa: F401  (registers the .rio accessor)
+    from odc.geo.geobox import GeoBox
+    from odc.geo.xr import xr_zeros
+
+    rng = np.random.default_rng(seed)
+    geobox = GeoBox.from_bbox((5_400_000, 1_800_000, 5_400_000 + 20*tile_size_px, 1_800_000 + 20*tile_size_px), 'EPSG:3035', resolution=20)
+    yy, xx = np.mgrid[0:tile_size_px, 0:tile_size_px] / tile_size_px
+    field = np.sin(12*xx) * np.cos(9*yy)
+    nodata_mask = (xx - 0.8)**2 + (yy - 0.2)**2 < 0.02          # a hole of missing data
+
+    ds = xr.Dataset()
+    template = xr_zeros(geobox, dtype='float32')
+    for i, band in enumerate(['B02', 'B03', 'B04', 'B05', 'B07', 'B8A']):
+        data = (1500 + 800*field + rng.normal(0, 60*(i + 1), field.shape)).clip(1, 12000).astype('uint16')
+        data[nodata_mask] = 0
+        ds[band] = template.copy(data=data).rio.write_nodata(0)
+    for i, si in enumerate(['EVI', 'NDVI', 'PSRI2']):
+        data = (1000*(0.3 + 0.3*field + rng.normal(0, 0.05, field.shape))).round().astype('int16')
+        data[nodata_mask] = -32768
+        ds[si] = template.copy(data=data).rio.write_nodata(-32768)
+    for si in ['NDVI_Z', 'EVI_Z']:
+        data = (field + rng.normal(0, 0.5, field.shape)).astype('float32')
+        data[nodata_mask] = np.nan
+        ds[si] = template.copy(data=data).rio.write_nodata(np.nan)
+    return ds
+
+
+def _ows_style_reads(paths, n_windows=20, seed=0):
+    """Seconds to serve, per file, `n_windows` random full-resolution 256 px tiles and one zoomed-out 256 px view (overviews)."""
+    import numpy as np
+    import rasterio
+    from rasterio.windows import Window
+
+    rng = np.random.default_rng(seed)
+    t0 = time.time()
+    for path in paths:
+        with rasterio.open(path) as src:
+            for _ in range(n_windows):
+                r, c = rng.integers(0, src.height - 256), rng.integers(0, src.width - 256)
+                src.read(1, window=Window(c, r, 256, 256))
+            src.read(1, out_shape=(256, 256))
+    return time.time() - t0
+
+
+def bench_cog_writer(log, workdir, tile_size_px=2500):
+    """
+    Writes the bands of a synthetic product dataset (tile size of the products) with the legacy sequential
+    `rio.to_raster(driver='COG')` and with `utils.cog_writer.write_cogs` for each compression, in parallel and as
+    one multi-band COG of the uint16 bands. Reports write time, file size and OWS-style read time per dtype.
+    """
+    import shutil
+    from utils.cog_writer import write_cogs
+
+    ds = _synthetic_product_dataset(tile_size_px)
+    groups = {'uint16': ['B02', 'B03', 'B04', 'B05', 'B07', 'B8A'], 'int16': ['EVI', 'NDVI', 'PSRI2'], 'float32': ['NDVI_Z', 'EVI_Z']}
+    log.info(f'{len(ds.data_vars)} bands of {tile_size_px}x{tile_size_px} px, {round(ds.nbytes/1024**2)} MiB in memory')
+
+    def legacy(folder):
+        for var in ds.data_vars:
+            ds[var].rio.to_raster(raster_path=f'{folder}/{var}.tif', driver='COG', dtype=str(ds[var].dtype), windowed=True)
+        return {var: f'{folder}/{var}.tif' for var in ds.data_vars}
+
+    variants = {
+        'legacy (sequential, GDAL defaults)': legacy,
+        'deflate+predictor, sequential': lambda folder: write_cogs(ds, lambda v: f'{folder}/{v}.tif', max_workers=1, compression='deflate'),
+        'deflate+predictor, parallel': lambda folder: write_cogs(ds, lambda v: f'{folder}/{v}.tif', compression='deflate'),
+        'zstd+predictor, parallel': lambda folder: write_cogs(ds, lambda v: f'{folder}/{v}.tif', compression='zstd'),
+        'lerc (lossless), parallel': lambda folder: write_cogs(ds, lambda v: f'{folder}/{v}.tif', compression='lerc'),
+    }
+    for name, write in variants.items():
+        folder = os.path.join(workdir, name.split(' ')[0].replace('+', '_') + ('_seq' if 'sequential' in name else ''))
+        os.makedirs(folder, exist_ok=True)
+        t0 = time.time()
+        paths = write(folder)
+        seconds = time.time() - t0
+        sizes = {dtype: sum(os.path.getsize(paths[v]) for v in vars_)/1024**2 for dtype, vars_ in groups.items()}
+        reads = {dtype: _ows_style_reads([paths[v] for v in vars_]) for dtype, vars_ in groups.items()}
+        log.info(f'[{name:<36}] write {seconds:6.2f} s | size ' + ', '.join(f'{d} {sizes[d]:6.1f} MiB' for d in groups) +
+                 ' | reads ' + ', '.join(f'{d} {reads[d]:5.2f} s' for d in groups))
+        shutil.rmtree(folder)
+
+    folder = os.path.join(workdir, 'multiband')
+    os.makedirs(folder, exist_ok=True)
+    t0 = time.time()
+    write_cogs(ds[groups['uint16']], None, multiband_path=f'{folder}/SR.tif', compression='deflate')
+    seconds = time.time() - t0
+    log.info(f'[{"deflate+predictor, multi-band uint16":<36}] write {seconds:6.2f} s | size uint16 {os.path.getsize(f"{folder}/SR.tif")/1024**2:6.1f} MiB')
+    shutil.rmtree(folder)
+
+
+def _memory_datacube():
+    """Datacube on an in-memory index holding the product definitions of `yamls/`."""
+    import datacube
+    import yaml
+    from utils.metadata import PRODUCT_YAMLS
+
+    dc = datacube.Datacube(raw_config="[default]\nindex_driver: memory\n", app='benchmark')
+    for path in sorted(PRODUCT_YAMLS.glob('*.odc-product.yaml')):
+        with open(path) as f:
+            dc.index.products.add_document(yaml.safe_load(f))
+    return dc
+
+
+def _pixel_scan_footprint(ds, product, bands):
+    """Valid-data polygon the eodatasets3 way: every pixel of every band scanned at full resolution, then vectorised."""
+    from pathlib import Path
+    from eodatasets3 import DatasetPrepare, ValidDataMethod, images
+
+    with DatasetPrepare(dataset_location=Path('/tmp'), allow_absolute_paths=False) as preparer:
+        preparer.product_name = product
+        preparer.valid_data_method = ValidDataMethod.thorough
+        grid = images.GridSpec.from_odc_xarray(ds)
+        for name in bands:
+            preparer.note_measurement(name=name, path=f'{name}.tif', relative_to_dataset_location=True, grid=grid,
+                                      pixels=ds[name].values, nodata=ds[name].attrs['_FillValue'], expand_valid_data=True)
+        return preparer._measurements.consume_and_get_valid_data(preparer.valid_data_method)
+
+
+def bench_metadata_prep(log, workdir, tile_size_px=2500, n_datasets=20):
+    """
+    Per-dataset EO3 metadata preparation of a composite (`utils.metadata.prepare_eo3_metadata_NAS`) on an in-memory
+    index: measurements queried per dataset (legacy) against the cached product registry, and the cost of the
+    footprint modes against a full-resolution pixel scan. A PostgreSQL index adds its query latency to every legacy
+    round-trip, and the connection of the Datacube `reorder_measurements` used to open per call (baseline, z-scores).
+    """
+    import warnings
+    import numpy as np
+    import datacube
+    from utils import metadata
+
+    warnings.filterwarnings('ignore', message='Overriding property')
+    dc = _memory_datacube()
+    ds = _synthetic_product_dataset(tile_size_px)
+    bands = metadata.product_measurements('composites', dc)
+    ds = ds[bands].assign_attrs({'odc:region_code': 'x00_y00'})
+    yy, xx = np.mgrid[0:tile_size_px, 0:tile_size_px]
+    outside_swath = xx + yy < 0.6*tile_size_px                  # a tile at the edge of the Sentinel-2 swath
+    ds = ds.map(lambda da: da.where(~outside_swath, da.attrs['_FillValue']).astype(da.dtype).assign_attrs(da.attrs), keep_attrs=True)
+    files = [f'S2L2A_medcomp_x00y00_202507_{b}.tif' for b in bands]
+
+    def prepare(footprint):
+        return metadata.prepare_eo3_metadata_NAS(dc=dc, xr_cube=ds, collection_path=workdir, dataset_name='S2L2A_medcomp_x00y00_202507',
+                                                 product_name='composites', product_family='ard', name_measurements=files,
+                                                 datetime_list=[2025, 7, 1], footprint=footprint)
+
+    def legacy():
+        metadata._MEASUREMENTS.clear()                           # a query per call, as before the registry
+        return prepare('bounds')
+
+    t0 = time.time()
+    datacube.Datacube(raw_config="[default]\nindex_driver: memory\n", app='reorder')
+    log.info(f'Datacube opened per reorder_measurements call (legacy): {1000*(time.time() - t0):.1f} ms without a database connection')
+
+    variants = {
+        'legacy (query per dataset), bounds': legacy,
+        'cached registry, bounds': lambda: prepare('bounds'),
+        'cached registry, mask footprint': lambda: prepare('mask'),
+    }
+    for name, fn in variants.items():
+        fn()                                                     # warm-up
+        t0 = time.time()
+        for _ in range(n_datasets):
+            eo3_doc, _ = fn()
+        per_dataset = (time.time() - t0) / n_datasets
+        log.info(f'[{name:<38}] {1000*per_dataset:8.1f} ms per dataset | geometry area {eo3_doc.geometry.area/1e6:7.2f} km2')
+
+    t0 = time.time()
+    scanned = _pixel_scan_footprint(ds, 'composites', bands)
+    seconds = time.time() - t0
+    t0 = time.time()
+    downsampled = metadata.valid_data_footprint(ds)
+    seconds_mask = time.time() - t0
+    log.info(f'Valid-data footprint of {len(bands)} bands of {tile_size_px}x{tile_size_px} px: full-resolution pixel scan {1000*seconds:.0f} ms, '
+             f'downsampled mask (1/{metadata.FOOTPRINT_STEP}) {1000*seconds_mask:.0f} ms | '
+             f'area {scanned.area/1e6:.2f} vs {downsampled.area/1e6:.2f} km2, symmetric difference {scanned.symmetric_difference(downsampled).area/1e6:.3f} km2')
+
+
+def _peak_rss_mib():
+    """Peak RSS of this process (VmHWM: unlike ru_maxrss, it is not inherited from the parent across fork/exec)."""
+    import resource
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmHWM')) / 1024
+    except (OSError, StopIteration):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _write_synthetic_composites(workdir, tile_size_px, n_months, seed=0):
+    """
+    Monthly NDVI, EVI and PSRI2 bands (int16, x1000, nodata -32768, seasonal cycle, cloudy gaps) of one tile as COGs.
+    Returns {index: [COG path per month]} and the (month, y, x) float64 stack of the values (NaN = nodata) per index.
+    """
+    import numpy as np
+    import pandas as pd
+    from utils.cog_writer import write_cogs
+
+    rng = np.random.default_rng(seed)
+    base = _synthetic_product_dataset(tile_size_px, seed=seed)[['NDVI', 'EVI', 'PSRI2']]
+    paths, stacks = {si: [] for si in base.data_vars}, {si: [] for si in base.data_vars}
+    for month in pd.date_range('2020-01-01', periods=n_months, freq='MS'):
+        season = np.sin(2*np.pi*(month.month - 4)/12)
+        gaps = rng.random((tile_size_px//40 + 1, tile_size_px//40 + 1)) < 0.15
+        gaps = np.kron(gaps, np.ones((40, 40), bool))[:tile_size_px, :tile_size_px]   # cloudy 40 px cells
+        ds = base.copy()
+        for si in base.data_vars:
+            values = (base[si].values + 150*season + rng.normal(0, 40, gaps.shape)).round().clip(-32767, 32767)
+            values[gaps | (base[si].values == -32768)] = np.nan
+            stacks[si].append(values)
+            ds[si] = base[si].copy(data=np.where(np.isnan(values), -32768, values).astype('int16'))
+        for si, path in write_cogs(ds, lambda var: f'{workdir}/{var}_{month:%Y%m}.tif').items():
+            paths[si].append(path)
+    return paths, {si: np.stack(v) for si, v in stacks.items()}
+
+
+def _baseline_variant(variant, paths, block_rows=512):
+    """
+    Baseline mean/std (int16) of the synthetic composites, in this process:
+      - 'legacy': the whole time series of each index in memory, masked, float16, `.mean`/`.std` (the float16
+        `baseline_in_memory` before the int64 kernel)
+      - 'int64': the whole int16 time series of each index in memory, reduced by 512x512 blocks with the int64
+        `moments` kernel and float32 `mean_std` (as `baseline_in_memory`, one block per Dask chunk)
+      - 'streaming': `SumAccumulator`s updated one month and one block of rows at a time (as `baseline_streaming`)
+    Returns the layers, seconds and peak RSS (MiB).
+    """
+    import numpy as np
+    import rasterio
+    from rasterio.windows import Window
+    import xarray as xr
+    import rioxarray as rxr
+    from utils.running_stats import SumAccumulator, moments, mean_std
+
+    t0 = time.time()
+    layers = {}
+    if variant == 'legacy':
+        for si, files in paths.items():
+            da = xr.concat([rxr.open_rasterio(f).squeeze('band', drop=True) for f in files], dim='time').compute()
+            da = da.where(da != -32768).astype('float16')
+            layers[si] = (da.mean(dim='time', skipna=True).astype('float16').values, da.std(dim='time', skipna=True).astype('float16').values)
+            del da
+    elif variant == 'int64':
+        for si, files in paths.items():
+            stack = np.stack([rasterio.open(f).read(1) for f in files])
+            mean, std = (np.empty(stack.shape[1:], 'float32') for _ in range(2))
+            for y0 in range(0, stack.shape[1], block_rows):
+                for x0 in range(0, stack.shape[2], block_rows):
+                    block = (slice(y0, y0 + block_rows), slice(x0, x0 + block_rows))
+                    mean[block], std[block] = mean_std(*moments(stack[(slice(None),) + block], -32768))
+            layers[si] = (mean, std)
+            del stack
+    else:
+        with rasterio.open(paths['NDVI'][0]) as src:
+            height, width = src.height, src.width
+        stats = {si: SumAccumulator((height, width)) for si in paths}
+        for month in range(len(paths['NDVI'])):
+            for si, acc in stats.items():
+                with rasterio.open(paths[si][month]) as src:
+                    for y0 in range(0, height, block_rows):
+                        rows = slice(y0, min(y0 + block_rows, height))
+                        acc.update(src.read(1, window=Window(0, y0, width, rows.stop - y0)), rows, nodata=-32768)
+        layers = {si: (acc.mean(), acc.std()) for si, acc in stats.items()}
+    seconds = time.time() - t0
+    return _int16_layers(layers), seconds, _peak_rss_mib()
+
+
+def _int16_layers(layers):
+    """{index: (mean, std)} -> {'<index>_mean'/'<index>_std': int16 with nodata -32768}, as written by `baseline_dataset`."""
+    import numpy as np
+
+    out = {}
+    for si, (mean, std) in layers.items():
+        for name, values in ((f'{si}_mean', mean), (f'{si}_std', std)):
+            values = np.asarray(values, dtype='float64').round()
+            with np.errstate(invalid='ignore'):                  # float16 overflows (inf) of the legacy std
+                out[name] = np.where(np.isnan(values), -32768, values).astype('int16')
+    return out
+
+
+def bench_baseline_streaming(log, workdir, tile_size_px=1200, n_months=39):
+    """
+    Baseline mean/std of NDVI, EVI and PSRI2 over `n_months` synthetic monthly composites of one tile, each variant
+    in a fresh process: the legacy full time series in memory (float16) against the streaming statistics
+    (one month, one block at a time). Reports time, peak RSS and the int16 differences of both against a float64
+    reference. (An in-memory datacube index cannot search time ranges: the COGs are read directly.)
+    """
+    import warnings
+    import numpy as np
+
+    paths, stacks = _write_synthetic_composites(workdir, tile_size_px, n_months)
+    log.info(f'{n_months} monthly composites of {tile_size_px}x{tile_size_px} px written')
+    reference = {}
+    for si, stack in stacks.items():
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)        # all-NaN pixels
+            for name, values in ((f'{si}_mean', np.nanmean(stack, axis=0)), (f'{si}_std', np.nanstd(stack, axis=0))):
+                reference[name] = np.where(np.isnan(values), -32768, values.round()).astype('int16')
+    del stacks
+
+    for variant in ['legacy', 'streaming']:
+        out, seconds, peak = _in_fresh_process(_baseline_variant, variant, paths)
+        diffs = {name: np.abs(out[name].astype('int32') - reference[name]) for name in reference}
+        nodata = sum(int(((out[n] == -32768) != (reference[n] == -32768)).sum()) for n in reference)
+        log.info(f'[{variant:<9}] {seconds:6.1f} s | peak RSS {peak:7.0f} MiB | vs float64: max |diff| '
+                 + ', '.join(f'{n} {int(d.max())}' for n, d in diffs.items())
+                 + f' | pixels off by > 1: {sum(int((d > 1).sum()) for d in diffs.values())} | NoData mismatches {nodata}')
+
+
+def _write_synthetic_statistics(workdir, paths, months):
+    """
+    `baseline_stats` datasets (9 COGs each) of the synthetic composites, cumulative up to each of `months`
+    (counted from 1). Returns {month: {band: COG path}}.
+    """
+    import rasterio
+    import rioxarray as rxr
+    from utils.cog_writer import write_cogs
+    from utils.running_stats import SumAccumulator
+    from baseline_stats import statistics_dataset
+
+    geobox = rxr.open_rasterio(paths['NDVI'][0]).odc.geobox
+    stats = {si: SumAccumulator((geobox.height, geobox.width)) for si in paths}
+    written = {}
+    for month in range(1, max(months) + 1):
+        for si, acc in stats.items():
+            with rasterio.open(paths[si][month - 1]) as src:
+                acc.update(src.read(1), nodata=-32768)
+        if month in months:
+            stats_ds = statistics_dataset(stats, geobox, 'x00_y00')
+            written[month] = write_cogs(stats_ds, lambda var: f'{workdir}/bstats_{month:02d}_{var}.tif')
+    return written
+
+
+def _baseline_window_variant(lower, upper):
+    """Baseline mean/std (int16) of the window between two `baseline_stats` datasets, as `baseline_window`."""
+    import rasterio
+    from utils.running_stats import SumAccumulator
+    from baseline_stats import STATISTICS
+
+    t0 = time.time()
+
+    def read(dataset, si):
+        bands = []
+        for stat in STATISTICS:
+            with rasterio.open(dataset[f'{si}_{stat}']) as src:
+                bands.append(src.read(1))
+        return SumAccumulator(count=bands[0], total=bands[1], sumsq=bands[2])
+
+    layers = {}
+    for si in ['NDVI', 'EVI', 'PSRI2']:
+        window = read(upper, si) - read(lower, si)
+        layers[si] = (window.mean(), window.std())
+    seconds = time.time() - t0
+    return _int16_layers(layers), seconds, _peak_rss_mib()
+
+
+def bench_baseline_window(log, workdir, tile_size_px=1200, n_months=39, window_start=13):
+    """
+    Baseline mean/std of a window of months (`window_start` to `n_months`) of synthetic composites, each variant
+    in a fresh process: a streaming pass over the composites of the window against the difference of two
+    stored `baseline_stats` datasets (18 COGs read, no composite). Reports time, peak RSS and the int16
+    differences against a float64 reference of the window.
+    """
+    import warnings
+    import numpy as np
+
+    paths, stacks = _write_synthetic_composites(workdir, tile_size_px, n_months)
+    t0 = time.time()
+    statistics = _write_synthetic_statistics(workdir, paths, {window_start - 1, n_months})
+    log.info(f'{n_months} monthly composites of {tile_size_px}x{tile_size_px} px and the statistics up to months '
+             f'{window_start - 1} and {n_months} written (statistics: {round(time.time() - t0, 1)} s)')
+    reference = {}
+    for si, stack in stacks.items():
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)        # all-NaN pixels
+            window = stack[window_start - 1:]
+            for name, values in ((f'{si}_mean', np.nanmean(window, axis=0)), (f'{si}_std', np.nanstd(window, axis=0))):
+                reference[name] = np.where(np.isnan(values), -32768, values.round()).astype('int16')
+    del stacks
+
+    window_paths = {si: files[window_start - 1:] for si, files in paths.items()}
+    for variant in ['streaming', 'window']:
+        if variant == 'streaming':
+            out, seconds, peak = _in_fresh_process(_baseline_variant, 'streaming', window_paths)
+        else:
+            out, seconds, peak = _in_fresh_process(_baseline_window_variant, statistics[window_start - 1], statistics[n_months])
+        diffs = {name: np.abs(out[name].astype('int32') - reference[name]) for name in reference}
+        nodata = sum(int(((out[n] == -32768) != (reference[n] == -32768)).sum()) for n in reference)
+        log.info(f'[{variant:<9}] {seconds:6.1f} s | peak RSS {peak:7.0f} MiB | vs float64: max |diff| '
+                 + ', '.join(f'{n} {int(d.max())}' for n, d in diffs.items())
+                 + f' | pixels off by > 1: {sum(int((d > 1).sum()) for d in diffs.values())} | NoData mismatches {nodata}')
+
+
+def _baseline_robust_variant(paths, block_rows=512):
+    """Robust baseline (int16 median, MAD, p10, p90) of the synthetic composites, as `baseline_robust_streaming`."""
+    import numpy as np
+    import rasterio
+    from rasterio.windows import Window
+    from utils.running_stats import robust_statistics
+
+    t0 = time.time()
+    with rasterio.open(paths['NDVI'][0]) as src:
+        height, width = src.height, src.width
+    layers = {si: {} for si in paths}
+    for y0 in range(0, height, block_rows):
+        window = Window(0, y0, width, min(block_rows, height - y0))
+        for si, files in paths.items():
+            def read():
+                for f in files:
+                    with rasterio.open(f) as src:
+                        yield src.read(1, window=window)
+            for stat, values in robust_statistics(read, nodata=-32768).items():
+                layers[si].setdefault(stat, []).append(values)
+    seconds = time.time() - t0
+
+    out = {}
+    for si, by_stat in layers.items():
+        for stat, blocks in by_stat.items():
+            values = np.concatenate(blocks).round()
+            out[f'{si}_{stat}'] = np.where(np.isnan(values), -32768, values).astype('int16')
+    return out, seconds, _peak_rss_mib()
+
+
+def bench_baseline_robust(log, workdir, tile_size_px=1200, n_months=39):
+    """
+    Robust baseline (median, MAD, p10, p90 from radix histograms, 4 reads of every block) against the streaming
+    mean/std (1 read) of NDVI, EVI and PSRI2 over `n_months` synthetic composites of one tile, each in a
+    fresh process. Reports time, peak RSS and the int16 differences against float64 numpy references
+    (`nanmean`/`nanstd`, `nanmedian`/`nanpercentile` of the whole stack).
+    """
+    import warnings
+    import numpy as np
+
+    paths, stacks = _write_synthetic_composites(workdir, tile_size_px, n_months)
+    log.info(f'{n_months} monthly composites of {tile_size_px}x{tile_size_px} px written')
+    reference = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)            # all-NaN pixels
+        for si, stack in stacks.items():
+            median = np.nanmedian(stack, axis=0)
+            for stat, values in (('mean', np.nanmean(stack, axis=0)), ('std', np.nanstd(stack, axis=0)),
+                                 ('median', median), ('mad', np.nanmedian(np.abs(stack - median), axis=0)),
+                                 ('p10', np.nanpercentile(stack, 10, axis=0)), ('p90', np.nanpercentile(stack, 90, axis=0))):
+                reference[f'{si}_{stat}'] = np.where(np.isnan(values), -32768, values.round()).astype('int16')
+    del stacks
+
+    for variant in ['streaming', 'robust']:
+        if variant == 'streaming':
+            out, seconds, peak = _in_fresh_process(_baseline_variant, 'streaming', paths)
+        else:
+            out, seconds, peak = _in_fresh_process(_baseline_robust_variant, paths)
+        diffs = {name: np.abs(out[name].astype('int32') - reference[name]) for name in out}
+        log.info(f'[{variant:<9}] {seconds:6.1f} s | peak RSS {peak:7.0f} MiB | vs float64: max |diff| '
+                 + ', '.join(f'{n} {int(d.max())}' for n, d in diffs.items()))
+
+
+def _znorm_variant(variant, composite, mean, std, repeats=5):
+    """
+    Z-scores of one int16 composite against an int16 baseline mean/std, in this process:
+      - 'legacy': masked with `.where`, cast to float16, ((x - mu) / sigma) cast to float32 (the float16 z-normalization)
+      - 'float32': the `z_scores` kernel on the int16 arrays
+    Returns the z-scores, seconds per call and peak RSS (MiB).
+    """
+    import xarray as xr
+    from utils.running_stats import z_scores
+
+    dims = ('y', 'x')
+    x, mu, sigma = (xr.DataArray(a, dims=dims) for a in (composite, mean, std))
+    t0 = time.time()
+    for _ in range(repeats):
+        if variant == 'legacy':
+            x16, mu16, sigma16 = (a.where(a != -32768).astype('float16') for a in (x, mu, sigma))
+            z = ((x16 - mu16) / sigma16).astype('float32').values
+        else:
+            z = z_scores(composite, mean, std, nodata=-32768, base_nodata=-32768)
+    seconds = (time.time() - t0) / repeats
+    return z, seconds, _peak_rss_mib()
+
+
+def bench_baseline_precision(log, workdir, tile_size_px=1200, n_months=39):
+    """
+    float16 against int64/float32 arithmetic, each variant in a fresh process, with the accuracy against float64:
+      - baseline mean/std of NDVI, EVI and PSRI2 over `n_months` synthetic composites: the legacy float16 time
+        series in memory, the int64 block kernel in memory (`baseline_in_memory`), the int64 streaming
+        accumulators (`baseline_streaming`); int16 differences against float64 numpy
+      - z-scores of the last month against the (float64-exact) int16 baseline: legacy float16 against the float32
+        `z_scores` kernel; differences in z units against float64
+    """
+    import warnings
+    import numpy as np
+    import rasterio
+
+    paths, stacks = _write_synthetic_composites(workdir, tile_size_px, n_months)
+    log.info(f'{n_months} monthly composites of {tile_size_px}x{tile_size_px} px written')
+    reference = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)            # all-NaN pixels
+        for si, stack in stacks.items():
+            for name, values in ((f'{si}_mean', np.nanmean(stack, axis=0)), (f'{si}_std', np.nanstd(stack, axis=0))):
+                reference[name] = np.where(np.isnan(values), -32768, values.round()).astype('int16')
+    del stacks
+
+    for variant in ['legacy', 'int64', 'streaming']:
+        out, seconds, peak = _in_fresh_process(_baseline_variant, variant, paths)
+        diffs = {name: np.abs(out[name].astype('int32') - reference[name]) for name in reference}
+        nodata = sum(int(((out[n] == -32768) != (reference[n] == -32768)).sum()) for n in reference)
+        log.info(f'[baseline {variant:<9}] {seconds:6.1f} s | peak RSS {peak:7.0f} MiB | vs float64: max |diff| '
+                 + ', '.join(f'{n} {int(d.max())}' for n, d in diffs.items())
+                 + f' | pixels off by > 1: {sum(int((d > 1).sum()) for d in diffs.values())} | NoData mismatches {nodata}')
+
+    for si in ['NDVI', 'EVI', 'PSRI2']:
+        with rasterio.open(paths[si][-1]) as src:
+            composite = src.read(1)
+        mean, std = reference[f'{si}_mean'], reference[f'{si}_std']
+        valid = (composite != -32768) & (mean != -32768) & (std != -32768) & (std != 0)
+        z64 = np.where(valid, (composite.astype('float64') - mean) / np.where(valid, std, 1), np.nan)
+        for variant in ['legacy', 'float32']:
+            z, seconds, peak = _in_fresh_process(_znorm_variant, variant, composite, mean, std)
+            error = np.abs(z[valid].astype('float64') - z64[valid])
+            log.info(f'[z-score {si:<5} {variant:<7}] {seconds*1000:7.1f} ms | peak RSS {peak:6.0f} MiB | vs float64: '
+                     f'max |diff| {error.max():.2e}, mean {error.mean():.2e}, pixels off by > 0.01: {int((error > 0.01).sum())}/{error.size}')
+
+
+
+# ---------------- Z-NORMALIZATION BATCH ----------------
+def _read_layers(files, nodata=-32768):
+    """{band: COG path} -> 2-D xarray Dataset (as `dc.load(...).squeeze()`, with the `nodata` attribute)."""
+    import xarray as xr
+    import rioxarray as rxr
+
+    bands = {}
+    for name, f in files.items():
+        with rxr.open_rasterio(f) as src:                   # closed here, not at interpreter exit
+            da = src.squeeze('band', drop=True).load()
+        da.attrs = {'nodata': nodata}
+        bands[name] = da
+    return xr.Dataset(bands)
+
+
+def _znorm_single_shot(month, comp_paths, base_paths, out_dir):
+    """
+    One month as the single-shot `z_normalization.py` before the batch mode, in this (fresh) interpreter: the
+    module imported, then for each index the baseline mean/std read (one `dc.load` each) and decoded, the
+    composite read, int16 `z_scores`, and the 3 bands written as COGs. Returns the seconds of baseline reads
+    and decoding, of composite reads and z-scores, and of writing.
+    """
+    import z_normalization as zn                # the import cost of the single-shot script
+    from utils.cog_writer import write_cogs
+    import xarray as xr
+
+    t_base = t_z = 0.0
+    z_vars = {}
+    for si in ['NDVI', 'EVI', 'PSRI2']:
+        t0 = time.time()
+        ds_base = _read_layers({f'{si}_{s}': base_paths[f'{si}_{s}'] for s in ('mean', 'std')})
+        mu, sigma = ds_base[f'{si}_mean'], ds_base[f'{si}_std']
+        t_base += time.time() - t0
+        t0 = time.time()
+        x = _read_layers({si: comp_paths[si][month]})[si]
+        z_vars[f'{si}_z'] = xr.apply_ufunc(zn.z_scores, x, mu, sigma, kwargs=dict(nodata=-32768, base_nodata=-32768, spread_scale=1), keep_attrs=False)
+        t_z += time.time() - t0
+    ds_znorm = xr.Dataset(z_vars)
+    for var in ds_znorm.data_vars:
+        ds_znorm[var] = ds_znorm[var].rio.write_nodata(float('nan'), inplace=True)
+    t0 = time.time()
+    write_cogs(ds_znorm, lambda var: f'{out_dir}/single_{var}_{month:02d}.tif')
+    return t_base, t_z, time.time() - t0
+
+
+def _znorm_batch(comp_paths, base_paths, out_dir):
+    """
+    Every month in ONE interpreter with `z_normalization_batch`'s kernel: the 6 baseline layers read and decoded to
+    float32 once (`decode_baseline`), then per month the 3 composite bands read, `z_normalized_dataset`, and the
+    COGs written. Returns the seconds of the baseline load, the per-month (read + z-scores, write) seconds, and
+    the peak RSS (MiB).
+    """
+    import z_normalization as zn
+    from utils.cog_writer import write_cogs
+
+    t0 = time.time()
+    layers = zn.decode_baseline(_read_layers(base_paths))
+    t_base = time.time() - t0
+    months = []
+    for month in range(len(comp_paths['NDVI'])):
+        t0 = time.time()
+        ds_znorm = zn.z_normalized_dataset(_read_layers({si: comp_paths[si][month] for si in layers}), layers)
+        t_z = time.time() - t0
+        t0 = time.time()
+        write_cogs(ds_znorm, lambda var: f'{out_dir}/batch_{var}_{month:02d}.tif')
+        months.append((t_z, time.time() - t0))
+    return t_base, months, _peak_rss_mib()
+
+
+def bench_znorm_batch(log, workdir, tile_size_px=2000, n_months=12):
+    """
+    Per-month cost of z-normalizing `n_months` composites of one tile against its all-months baseline:
+      - 'single'  : one fresh interpreter per month (as `run_z_normalization.py --mode sequential`), which reads
+                    the baseline mean/std of each index in a separate load and decodes them again every month
+      - 'batch'   : one fresh interpreter for the tile (as `--mode batch`), the baseline loaded and decoded once
+    The z-scores of both are compared. Indexing (one `dc.index.datasets.add` per month in both) is not measured:
+    an in-memory datacube index cannot search the composites by time.
+    """
+    import warnings
+    import numpy as np
+    import rasterio
+    import rioxarray as rxr
+    from utils.cog_writer import write_cogs
+    from utils.running_stats import as_dataarray
+    from baseline import baseline_dataset
+
+    comp_paths, stacks = _write_synthetic_composites(workdir, tile_size_px, n_months)
+    geobox = rxr.open_rasterio(comp_paths['NDVI'][0]).odc.geobox
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)            # all-NaN pixels
+        layers = {
+            si: (as_dataarray(np.nanmean(stack, axis=0), geobox, f'{si}_mean'), as_dataarray(np.nanstd(stack, axis=0), geobox, f'{si}_std'))
+            for si, stack in stacks.items()
+        }
+    del stacks
+    base_paths = write_cogs(baseline_dataset(layers, '2020-01-01', '2020-12-31', 'x00_y00'), lambda var: f'{workdir}/baseline_{var}.tif')
+    log.info(f'{n_months} monthly composites and the baseline of {tile_size_px}x{tile_size_px} px written')
+
+    t0 = time.time()
+    single = [_in_fresh_process(_znorm_single_shot, month, comp_paths, base_paths, workdir) for month in range(n_months)]
+    single_total = time.time() - t0
+    t_base, t_z, t_write = (np.mean(v) for v in zip(*single))
+    log.info(f'[single   ] {single_total/n_months:6.2f} s per month | interpreter and imports {single_total/n_months - t_base - t_z - t_write:5.2f} s, '
+             f'baseline {t_base:5.2f} s, composite + z-scores {t_z:5.2f} s, COGs {t_write:5.2f} s')
+
+    t0 = time.time()
+    t_base, months, peak = _in_fresh_process(_znorm_batch, comp_paths, base_paths, workdir)
+    batch_total = time.time() - t0
+    t_z, t_write = (np.mean(v) for v in zip(*months))
+    log.info(f'[batch    ] {batch_total/n_months:6.2f} s per month | interpreter and imports {(batch_total - t_base - sum(map(sum, months)))/n_months:5.2f} s, '
+             f'baseline {t_base/n_months:5.2f} s (once: {t_base:.2f} s), composite + z-scores {t_z:5.2f} s, COGs {t_write:5.2f} s | peak RSS {peak:.0f} MiB')
+    log.info(f'Per-month cost: {single_total/n_months:.2f} s -> {batch_total/n_months:.2f} s ({100*(1 - batch_total/single_total):.0f}% less)')
+
+    diff = 0.0
+    for month in range(n_months):
+        for si in ['NDVI', 'EVI', 'PSRI2']:
+            with rasterio.open(f'{workdir}/single_{si}_z_{month:02d}.tif') as a, rasterio.open(f'{workdir}/batch_{si}_z_{month:02d}.tif') as b:
+                za, zb = a.read(1), b.read(1)
+            assert np.array_equal(np.isnan(za), np.isnan(zb)), f'NaN mismatch in {si} month {month}'
+            diff = max(diff, float(np.nanmax(np.abs(za - zb))))
+    log.info(f'single vs batch z-scores: max |diff| {diff:.2e}, identical NaNs')
+
+BENCHMARKS = {
+    'tile-grid-load': bench_tile_grid_load,
+    'pixel-kernel': bench_pixel_kernel,
+    'temporal-median': bench_temporal_median,
+    'scene-selection': bench_scene_selection,
+    'cog-cache': bench_cog_cache,
+    'scene-major': bench_scene_major,
+    'cog-writer': bench_cog_writer,
+    'metadata-prep': bench_metadata_prep,
+    'baseline-streaming': bench_baseline_streaming,
+    'baseline-window': bench_baseline_window,
+    'baseline-robust': bench_baseline_robust,
+    'baseline-precision': bench_baseline_precision,
+    'znorm-batch': bench_znorm_batch,
+}
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Benchmark pipeline components on synthetic data.")
+    p.add_argument("benchmark", choices=sorted(BENCHMARKS), help="Benchmark to run")
+    p.add_argument("--workdir", default=None, help="Folder for synthetic inputs (default: a temporary folder)")
+    args = p.parse_args()
+
+    mkdir("../logs/benchmarks")
+    log = setup_logger(logger_name='benchmarks_',
+                       logger_path=f'../logs/benchmarks/{args.benchmark}_{datetime.datetime.now(pytz.timezone("Europe/Athens")).strftime("%Y%m%dT%H%M%S")}.log',
+                       logger_format=LOG_FORMAT,
+                       )
+    log.addHandler(__import__("logging").StreamHandler(sys.stdout))
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_')
+    log.info(f'Benchmark: {args.benchmark} | workdir: {workdir}')
+    BENCHMARKS[args.benchmark](log, workdir)
@@ -13,71 +13,327 @@
 #######################################################################
 '''
 
-from utils.utils import setup_logger, generate_geojson_files_for_composites, mkdir
+from utils.utils import setup_logger, mkdir, job_log_handler
+from utils.scheduler import run_jobs_concurrently, read_completed_jobs
+from utils.planner import load_tiles, plan_jobs, pending_jobs, export_plan
+from utils.indexing import BulkIndexer, existing_dataset_keys
 
+import argparse
 import datetime, pytz
-import gc, os, sys, time
+import gc, sys, time
 import json
+import logging
+import re
 
 from pathlib import Path
 
+import datacube
+
 import subprocess
+from concurrent.futures import Future
+from functools import partial
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
+
+
+def composite_cli_flags(args):
+    """Options of the run forwarded to each single-shot `composites.py` job."""
+    flags = ["--workers", str(args.workers)]
+    if args.lazy_load:
+        flags.append("--lazy-load")
+    if args.load_on_tile_grid:
+        flags.append("--load-on-tile-grid")
+    if args.incremental:
+        flags.append("--incremental")
+    if args.select_by_scl:
+        flags.append("--select-by-scl")
+    if args.cog_cache:
+        flags += ["--cog-cache", args.cog_cache, "--cog-cache-gb", str(args.cog_cache_gb)]
+    if args.no_quicklooks:
+        flags.append("--no-quicklooks")
+    if args.scratch:
+        flags += ["--scratch", args.scratch]
+    flags += ["--cog-compression", args.cog_compression, "--footprint", args.footprint]
+    return flags
+
+
+def latest_month_jobs(jobs, n_months):
+    """Keys of the jobs of the latest `n_months` months of the plan."""
+    months = sorted({job.year_month for job in jobs})[-n_months:] if n_months > 0 else []
+    return {job.key for job in jobs if job.year_month in months}
+
+
+def record_published(done_file, gf, log, future):
+    """
+    Done-callback of a background publish-and-index: the task is completed only once its dataset is on the NAS and indexed.
+    A publish that queued its dataset on the bulk indexer resolves to the Future of the indexing, which is then awaited.
+    """
+    if future.exception() is None and isinstance(future.result(), Future):
+        future.result().add_done_callback(partial(record_published, done_file, gf, log))
+    elif future.exception() is None:
+        with done_file.open("a", encoding="utf-8") as df:
+            df.write(gf + "\n")
+        log.info(f"✔ Published {gf}")
+    else:
+        log.error(f"✖ Failed to publish {gf}: {future.exception()}")
+
+
+def run_pooled_job(job, client, **options):
+    """
+    Run ONE composite job of the plan in this interpreter, on the shared worker pool.
+    Returns 0 or 1, or the Future of its background publish-and-index (with a `publisher`).
+    """
+    from composites import generate_composite
+
+    year_month, tile_id, tile_geom = job.year_month, job.tile_id, job.tile
+
+    job_log = f'../logs/compgen/compgen_{year_month}_{tile_id}_{datetime.datetime.now(pytz.timezone("Europe/Athens")).strftime("%Y%m%dT%H%M%S")}.log'
+    with job_log_handler(job_log, LOG_FORMAT):
+        try:
+            published = generate_composite(year_month=year_month, tile_id=tile_id, tile_geom=tile_geom, client=client, **options)
+            return published if published is not None else 0
+        except Exception:
+            logging.exception("Fatal error in composites.py")
+            return 1
+
+
+def scene_major_groups(jobs, block=2):
+    """
+    Group the jobs by month and by `block` x `block` blocks of adjacent tiles (tile ids are xNN_yNN), so that
+    each group is composited from a single load of its scenes (see `composites.generate_composites_scene_major`).
+    Returns a list of (year_month, [(job key, tile_id, tile), ...]), in month order.
+    """
+    groups = {}
+    for job in jobs:
+        m = re.match(r"x(\d+)_y(\d+)$", job.tile_id)
+        key = (int(m.group(1))//block, int(m.group(2))//block) if m else job.tile_id
+        groups.setdefault((job.year_month, key), []).append((job.key, job.tile_id, job.tile))
+    return [(ym, tasks) for (ym, _), tasks in sorted(groups.items(), key=lambda kv: (kv[0][0], str(kv[0][1])))]
+
+
+def run_scene_major_group(year_month, tasks, client, **options):
+    """
+    Run the composites of ONE month group of tiles in this interpreter. Returns (job key, outcome) pairs, the outcome
+    being True/False or the Future of the background publish-and-index of the tile.
+    """
+    from composites import generate_composites_scene_major
+
+    job_log = f'../logs/compgen/compgen_{year_month}_scenemajor_{tasks[0][1]}_{datetime.datetime.now(pytz.timezone("Europe/Athens")).strftime("%Y%m%dT%H%M%S")}.log'
+    with job_log_handler(job_log, LOG_FORMAT):
+        try:
+            results = generate_composites_scene_major(year_month, [(tile_id, geom) for _, tile_id, geom in tasks], client, **options)
+        except Exception:
+            logging.exception("Fatal error in composites.py")
+            return [(gf, False) for gf, _, _ in tasks]
+    return [(gf, results.get(tile_id, False)) for gf, tile_id, _ in tasks]
+
+
+def measure_job_overhead(n_jobs, n_workers, log):
+    """
+    Compare the fixed cost each job pays before any data is touched:
+      - subprocess mode: a fresh interpreter imports `composites` and spins up/tears down a LocalCluster
+      - pooled mode: the warm pool is reused, so a job only resets worker state
+    """
+    from composites import start_worker_pool
+    from utils.cluster import close_local_cluster
+
+    code = (
+        "from composites import start_worker_pool\n"
+        "from utils.cluster import close_local_cluster\n"
+        f"close_local_cluster(*start_worker_pool(n_workers={n_workers}))\n"
+    )
+    t0 = time.time()
+    for _ in range(n_jobs):
+        subprocess.run([sys.executable, "-c", code], check=True)
+    per_job_subprocess = (time.time() - t0) / n_jobs
+
+    t0 = time.time()
+    cluster, client = start_worker_pool(n_workers=n_workers)
+    pool_startup = time.time() - t0
+    try:
+        t0 = time.time()
+        for _ in range(n_jobs):
+            client.run(lambda: __import__("gc").collect())
+        per_job_pooled = (time.time() - t0) / n_jobs
+    finally:
+        close_local_cluster(cluster, client)
+
+    log.info(f"Per-job overhead | subprocess: {per_job_subprocess:.2f} s | pooled: {per_job_pooled:.3f} s (+ {pool_startup:.2f} s pool start-up once per run)")
+    log.info(f"Overhead saved on {n_jobs} jobs: {round(n_jobs*per_job_subprocess - (pool_startup + n_jobs*per_job_pooled), 1)} s")
+
 
 if __name__ == "__main__":   
+    p = argparse.ArgumentParser(description="Run composites for all tiles and months.")
+    p.add_argument("--mode", choices=["subprocess", "pooled", "concurrent", "scene-major"], default="subprocess",
+                   help="subprocess: one fresh interpreter and LocalCluster per job; pooled: one warm worker pool for the whole run; "
+                        "concurrent: several single-shot subprocesses at once, within a memory/CPU budget; "
+                        "scene-major: on one warm worker pool, each month's scenes are loaded once per block of adjacent tiles")
+    p.add_argument("--workers", type=int, default=8, help="Dask worker processes of the pool (pooled mode) or of each job (concurrent mode)")
+    p.add_argument("--max-memory-gb", type=float, default=None, help="Total memory budget of concurrent jobs (default: 80%% of RAM)")
+    p.add_argument("--max-cpus", type=int, default=None, help="Total CPU budget of concurrent jobs (default: all logical CPUs)")
+    p.add_argument("--lazy-load", action="store_true", help="Load all bands of a UTM zone as one lazy dask graph")
+    p.add_argument("--load-on-tile-grid", action="store_true", help="Load straight onto the EPSG:3035 tile GeoBox (no UTM intermediate)")
+    p.add_argument("--incremental", action="store_true",
+                   help="Keep scene stack sidecars, and re-run the completed tasks of the latest --refresh-months months "
+                        "to merge newly published scenes into their composites")
+    p.add_argument("--select-by-scl", action="store_true", help="Select scenes by clear pixels inside the tile from a coarse SCL overview")
+    p.add_argument("--cog-cache", default=None, metavar="DIR", help="Read COGs through a persistent block cache in DIR, shared by all jobs (e.g. ../cache/cogs)")
+    p.add_argument("--cog-cache-gb", type=float, default=50.0, help="Size cap of the COG block cache in GB (default: 50)")
+    p.add_argument("--no-quicklooks", action="store_true", help="Skip the footprint and input scenes preview JPEGs of every composite")
+    p.add_argument("--cog-compression", choices=["deflate", "zstd", "lerc"], default="deflate", help="Compression of the band COGs (default: deflate)")
+    p.add_argument("--scratch", default=None, metavar="DIR",
+                   help="Stage each dataset in local DIR, verify it, and publish it to the NAS atomically before indexing; "
+                        "in pooled and scene-major modes the transfer runs in the background, overlapping the next job")
+    p.add_argument("--footprint", choices=["bounds", "mask"], default="bounds",
+                   help="Geometry of the indexed datasets: tile bounds, or valid-data polygon from a downsampled mask (default: bounds)")
+    p.add_argument("--index-batch", type=int, default=50,
+                   help="Pooled and scene-major modes: datasets indexed per transaction by the bulk indexer of the run (default: 50)")
+    p.add_argument("--tile-block", type=int, default=2, help="Scene-major mode: side of the blocks of adjacent tiles sharing one load (default: 2, i.e. 2x2 tiles)")
+    p.add_argument("--refresh-months", type=int, default=1, help="Latest months re-run in incremental mode (default: 1)")
+    p.add_argument("--benchmark-overhead", type=int, default=0, metavar="N",
+                   help="Only measure the per-job overhead of both modes over N empty jobs and exit")
+    args = p.parse_args()
+
     # Set up logger.
     mkdir("../logs/compgen")
     log = setup_logger(logger_name='admin_compgen_',
                         logger_path
                         
                         =f'../logs/compgen/admin_compgen_{datetime.datetime.now(pytz.timezone("Europe/Athens")).strftime("%Y%m%dT%H%M%S")}.log', 
-                        logger_format='%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s',
+                        logger_format=LOG_FORMAT,
                         )
     
-    # 1) generate/refresh the .geojson tasks
-    geojson_path = "../geojsons/compgen"
-    generate_geojson_files_for_composites(
-        output_dir=geojson_path,
-        tile_geojson_filepath='../anciliary/grid_20_v2.geojson',
+    if args.benchmark_overhead:
+        measure_job_overhead(args.benchmark_overhead, args.workers, log)
+        sys.exit(0)
+    
+    # 1) plan the tile-month jobs in memory
+    tiles = load_tiles(tile_geojson_filepath='../anciliary/grid_20_v2.geojson')
+    jobs = plan_jobs(
+        tiles,
         start_date=datetime.datetime(2020, 1, 1),
         end_date=datetime.datetime(2025, 11, 30),
+        prefix='compgen',
     )
     
-    # 2) collect tasks
-    if os.path.isdir(geojson_path):
-        geojson_files = sorted(
-            os.path.join(geojson_path, f)
-            for f in os.listdir(geojson_path)
-            if f.endswith(".geojson")
-        )
-    else:
-        geojson_files = [geojson_path] 
-        
+    # 2) keep the jobs neither completed nor already indexed (one query for the whole run)
     done_file = Path("../logs/compgen/admin_completed_geojsons.txt")
-    already_done = set()
-    if done_file.exists():
-        already_done = set(x for x in done_file.read_text().splitlines() if x)
+    already_done = read_completed_jobs(done_file)
+    refresh = latest_month_jobs(jobs, args.refresh_months) if args.incremental else set()
+    if refresh:
+        log.info(f"Incremental mode: re-running {len(refresh & already_done)} completed tasks of the latest {args.refresh_months} month(s)")
+        already_done -= refresh
 
-    # 3) run each in a fresh interpreter, sequentially
-    for i, gf in enumerate(geojson_files, 1):
-        if gf in already_done:
-            log.info(f"Skip already completed: {gf} [{i}/{len(geojson_files)}]")
-            continue
+    dc = datacube.Datacube(app='Composite indexing', env='drought')
+    existing = existing_dataset_keys(dc, ['composites'])
+    pending = pending_jobs(jobs, 'composites', existing, done=already_done, rerun=refresh)
+    plan_path = export_plan("../logs/compgen/admin_plan.json", jobs, pending)
 
-        log.info(f"[>] Launching single-shot: {gf} [{i}/{len(geojson_files)}]")
-        
-        rc = subprocess.run(
-            [sys.executable, "composites.py", "--geojson", gf],
-            check=False,
-        ).returncode
+    # 3) run the tasks
+    publisher = None
+    if args.scratch and args.mode in ("pooled", "scene-major"):
+        from utils.staging import Publisher
+        publisher = Publisher()
 
-        if rc == 0:
-            with done_file.open("a", encoding="utf-8") as df:
-                df.write(gf + "\n")
-            log.info(f"✔ Processed {gf} | [{i} / {len(geojson_files)}] ({round(100*((i)/len(geojson_files)),2)}%)")
-        else:
-            log.error(f"✖ Failed {gf} with exit code {rc} | [{i} / {len(geojson_files)}] ({round(100*((i)/len(geojson_files)),2)}%)")
-            # optional small backoff to avoid rapid-fire restarts on a flaky machine
-            time.sleep(2)
+    # in-process modes: one bulk indexer for the run
+    indexer = None
+    if args.mode in ("pooled", "scene-major"):
+        indexer = BulkIndexer(dc, batch_size=args.index_batch)
+
+    if args.mode == "concurrent":
+        run_jobs_concurrently(
+            jobs=[job.key for job in pending],
+            build_command=lambda gf: [sys.executable, "composites.py", "--plan", plan_path, "--job", gf] + composite_cli_flags(args),
+            done_file=done_file,
+            log=log,
+            rerun=refresh,
+            max_memory_mb=args.max_memory_gb*1024 if args.max_memory_gb else None,
+            max_cpus=args.max_cpus,
+            cpus_per_job=args.workers,
+            history_path="../logs/compgen/admin_job_costs.json",
+            default_memory_mb=16*1024,
+        )
+    elif args.mode == "scene-major":
+        from composites import start_worker_pool
+        from utils.cluster import close_local_cluster
+        log.info(f"Starting shared worker pool with {args.workers} workers")
+        cluster, client = start_worker_pool(n_workers=args.workers)
+
+        groups = scene_major_groups(pending, block=args.tile_block)
+        month_wall = {}
+        for i, (year_month, tasks) in enumerate(groups, 1):
+            log.info(f"[>] Scene-major group {year_month}: {len(tasks)} tiles from {tasks[0][1]} [{i}/{len(groups)}]")
+            job_start = time.time()
+            outcomes = run_scene_major_group(year_month, tasks, client, lazy_load=args.lazy_load, incremental=args.incremental,
+                                             select_by_scl=args.select_by_scl, cog_cache=args.cog_cache, cog_cache_gb=args.cog_cache_gb,
+                                             quicklooks=not args.no_quicklooks, cog_compression=args.cog_compression,
+                                             scratch=args.scratch, publisher=publisher, footprint=args.footprint,
+                                             indexer=indexer, existing=existing)
+            month_wall[year_month] = month_wall.get(year_month, 0) + time.time() - job_start
+            log.info(f"    Group wall time: {round(time.time() - job_start, 1)} s ({args.mode})")
+
+            for gf, outcome in outcomes:
+                if isinstance(outcome, Future):
+                    outcome.add_done_callback(partial(record_published, done_file, gf, log))
+                elif outcome:
+                    with done_file.open("a", encoding="utf-8") as df:
+                        df.write(gf + "\n")
+                    log.info(f"✔ Processed {gf}")
+                else:
+                    log.error(f"✖ Failed {gf}")
+        for year_month, wall in month_wall.items():
+            log.info(f"Month {year_month}: {round(wall/60, 2)} minutes")
+
+        if publisher is not None:
+            publisher.close()
+        indexer.close()
+        close_local_cluster(cluster, client)
+    else:
+        # run each sequentially, in a fresh interpreter or on the shared worker pool
+        client = cluster = None
+        if args.mode == "pooled":
+            from composites import start_worker_pool
+            from utils.cluster import close_local_cluster
+            log.info(f"Starting shared worker pool with {args.workers} workers")
+            cluster, client = start_worker_pool(n_workers=args.workers)
+    
+        for i, job in enumerate(pending, 1):
+            gf = job.key
+            job_start = time.time()
+            if args.mode == "pooled":
+                log.info(f"[>] Submitting to worker pool: {gf} [{i}/{len(pending)}]")
+                rc = run_pooled_job(job, client, lazy_load=args.lazy_load, load_on_tile_grid=args.load_on_tile_grid, incremental=args.incremental,
+                                    select_by_scl=args.select_by_scl, cog_cache=args.cog_cache, cog_cache_gb=args.cog_cache_gb,
+                                    quicklooks=not args.no_quicklooks, cog_compression=args.cog_compression,
+                                    scratch=args.scratch, publisher=publisher, footprint=args.footprint,
+                                    indexer=indexer, existing=existing)
+                if isinstance(rc, Future):
+                    log.info(f"    Job wall time: {round(time.time() - job_start, 1)} s ({args.mode}), publishing or indexing in the background")
+                    rc.add_done_callback(partial(record_published, done_file, gf, log))
+                    continue
+            else:
+                log.info(f"[>] Launching single-shot: {gf} [{i}/{len(pending)}]")
+                rc = subprocess.run(
+                    [sys.executable, "composites.py", "--plan", plan_path, "--job", gf] + composite_cli_flags(args),
+                    check=False,
+                ).returncode
+            log.info(f"    Job wall time: {round(time.time() - job_start, 1)} s ({args.mode})")
+
+            if rc == 0:
+                with done_file.open("a", encoding="utf-8") as df:
+                    df.write(gf + "\n")
+                log.info(f"✔ Processed {gf} | [{i} / {len(pending)}] ({round(100*((i)/len(pending)),2)}%)")
+            else:
+                log.error(f"✖ Failed {gf} with exit code {rc} | [{i} / {len(pending)}] ({round(100*((i)/len(pending)),2)}%)")
+                # optional small backoff to avoid rapid-fire restarts on a flaky machine
+                time.sleep(2)
+    
+        if publisher is not None:
+            publisher.close()
+        if indexer is not None:
+            indexer.close()
+        if cluster is not None:
+            close_local_cluster(cluster, client)
         
     # ---------------- OWS UPDATE ----------------
     try:
@@ -14,19 +14,38 @@
 '''
 
 
-from utils.utils import setup_logger, mkdir, generate_geojson_files_for_composites
+from utils.utils import setup_logger, mkdir
+from utils.scheduler import run_jobs_concurrently, read_completed_jobs
+from utils.planner import load_tiles, plan_jobs, pending_jobs, export_plan
+from utils.indexing import existing_dataset_keys
 
+import argparse
 import datetime, pytz
-import gc, os, sys, time
+import gc, sys, time
 import json
 
-import geopandas as gpd
+import datacube
 
 from pathlib import Path
 
 import subprocess
 
 if __name__ == "__main__":   
+    p = argparse.ArgumentParser(description="Run z-normalization for all tiles and months.")
+    p.add_argument("--mode", choices=["sequential", "concurrent", "batch"], default="sequential",
+                   help="sequential: one single-shot subprocess at a time; concurrent: several at once, within a memory/CPU budget; "
+                        "batch: one subprocess per tile for all its pending months, loading the baseline once")
+    p.add_argument("--max-memory-gb", type=float, default=None, help="Total memory budget of concurrent jobs (default: 80%% of RAM)")
+    p.add_argument("--max-cpus", type=int, default=None, help="Total CPU budget of concurrent jobs (default: all logical CPUs)")
+    p.add_argument("--climatology", action="store_true", help="Normalize with the climatology of each calendar month instead of the all-months baseline")
+    p.add_argument("--clim-window", type=int, default=None, help="Window (months on each side) of the climatology, with --climatology")
+    p.add_argument("--robust", action="store_true", help="Robust z-scores from the median and MAD of the baseline_robust")
+    p.add_argument("--baseline-start", default=None, help="Start (YYYY-MM-DD) of the baseline window, when tiles have baselines of several windows")
+    p.add_argument("--baseline-end", default=None, help="End (YYYY-MM-DD) of the baseline window")
+    args = p.parse_args()
+    baseline_args = (["--climatology"] if args.climatology else []) + (["--clim-window", str(args.clim_window)] if args.clim_window is not None else []) + (["--robust"] if args.robust else [])
+    baseline_args += (["--baseline-start", args.baseline_start] if args.baseline_start else []) + (["--baseline-end", args.baseline_end] if args.baseline_end else [])
+
     # Set up logger.
     mkdir("../logs/znorm")
     log = setup_logger(logger_name='admin_znorm_',
@@ -36,52 +55,83 @@ if __name__ == "__main__":
                         logger_format='%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s',
                         )
     
-    # 1) generate/refresh the .geojson tasks
-    geojson_path = "../geojsons/znorm"
-    generate_geojson_files_for_composites(
-        output_dir=geojson_path,
-        tile_geojson_filepath='../anciliary/grid_20_v2.geojson',
+    # 1) plan the tile-month jobs in memory
+    tiles = load_tiles(tile_geojson_filepath='../anciliary/grid_20_v2.geojson')
+    jobs = plan_jobs(
+        tiles,
         start_date=datetime.datetime(2023, 4, 1),
         end_date=datetime.datetime(2025, 11, 30),
-        prefix='znorm'
+        prefix='znorm',
     )
     
-    # 2) collect tasks
-    if os.path.isdir(geojson_path):
-        geojson_files = sorted(
-            os.path.join(geojson_path, f)
-            for f in os.listdir(geojson_path)
-            if f.endswith(".geojson")
-        )
-    else:
-        geojson_files = [geojson_path] 
-        
+    # 2) keep the jobs neither completed nor already indexed (one query for the whole run)
     done_file = Path("../logs/znorm/admin_completed_geojsons.txt")
-    already_done = set()
-    if done_file.exists():
-        already_done = set(x for x in done_file.read_text().splitlines() if x)
+    already_done = read_completed_jobs(done_file)
+    dc = datacube.Datacube(app='znorm', env='drought')
+    pending = pending_jobs(jobs, 'z_normalized', existing_dataset_keys(dc, ['z_normalized']), done=already_done)
+    plan_path = export_plan("../logs/znorm/admin_plan.json", jobs, pending)
 
-    # 3) run each in a fresh interpreter, sequentially
-    for i, gf in enumerate(geojson_files, 1):
-        if gf in already_done:
-            log.info(f"Skip already completed: {gf} [{i}/{len(geojson_files)}]")
-            continue
+    # 3) run the tasks
+    if args.mode == "concurrent":
+        run_jobs_concurrently(
+            jobs=[job.key for job in pending],
+            build_command=lambda gf: [sys.executable, "z_normalization.py", "--plan", plan_path, "--job", gf, *baseline_args],
+            done_file=done_file,
+            log=log,
+            max_memory_mb=args.max_memory_gb*1024 if args.max_memory_gb else None,
+            max_cpus=args.max_cpus,
+            cpus_per_job=1,
+            history_path="../logs/znorm/admin_job_costs.json",
+            default_memory_mb=2048,
+        )
+    elif args.mode == "batch":
+        # one fresh interpreter per tile: the baseline is loaded once for all its pending months
+        by_tile = {}
+        for job in pending:
+            by_tile.setdefault(job.tile_id, []).append(job)
+        for i, (tile_id, tile_jobs) in enumerate(by_tile.items(), 1):
+            months = sorted(job.year_month for job in tile_jobs)
+            log.info(f"[>] Launching batch: {tile_id} | {len(months)} months {months[0]} to {months[-1]} [{i}/{len(by_tile)}]")
 
-        log.info(f"[>] Launching single-shot: {gf} [{i}/{len(geojson_files)}]")
+            rc = subprocess.run(
+                [sys.executable, "z_normalization.py", "--tile", tile_id, "--start", months[0], "--end", months[-1], "--skip-indexed", *baseline_args],
+                check=False,
+            ).returncode
+
+            # only the months indexed by the batch are done: a month without composite yet (e.g. the current
+            # month) is processed by the tile but not normalized, and must stay pending for the next run
+            indexed = {
+                d.center_time.strftime('%Y-%m') for d in dc.find_datasets(
+                    product='z_normalized', region_code=tile_id.replace('_',''), time=(months[0], months[-1]))
+            }
+            written = [job for job in tile_jobs if job.year_month in indexed]
+            if written:
+                with done_file.open("a", encoding="utf-8") as df:
+                    df.writelines(job.key + "\n" for job in written)
+            if rc == 0:
+                log.info(f"✔ Processed {tile_id}: {len(written)}/{len(tile_jobs)} months normalized | [{i} / {len(by_tile)}] ({round(100*((i)/len(by_tile)),2)}%)")
+            else:
+                log.error(f"✖ Failed {tile_id} with exit code {rc}: {len(written)}/{len(tile_jobs)} months normalized | [{i} / {len(by_tile)}] ({round(100*((i)/len(by_tile)),2)}%)")
+                time.sleep(2)
+    else:
+        # run each in a fresh interpreter, sequentially
+        for i, job in enumerate(pending, 1):
+            gf = job.key
+            log.info(f"[>] Launching single-shot: {gf} [{i}/{len(pending)}]")
         
-        rc = subprocess.run(
-            [sys.executable, "z_normalization.py", "--geojson", gf],
-            check=False,
-        ).returncode
+            rc = subprocess.run(
+                [sys.executable, "z_normalization.py", "--plan", plan_path, "--job", gf, *baseline_args],
+                check=False,
+            ).returncode
 
-        if rc == 0:
-            with done_file.open("a", encoding="utf-8") as df:
-                df.write(gf + "\n")
-            log.info(f"✔ Processed {gf} | [{i} / {len(geojson_files)}] ({round(100*((i)/len(geojson_files)),2)}%)")
-        else:
-            log.error(f"✖ Failed {gf} with exit code {rc} | [{i} / {len(geojson_files)}] ({round(100*((i)/len(geojson_files)),2)}%)")
-            # optional small backoff to avoid rapid-fire restarts on a flaky machine
-            time.sleep(2)
+            if rc == 0:
+                with done_file.open("a", encoding="utf-8") as df:
+                    df.write(gf + "\n")
+                log.info(f"✔ Processed {gf} | [{i} / {len(pending)}] ({round(100*((i)/len(pending)),2)}%)")
+            else:
+                log.error(f"✖ Failed {gf} with exit code {rc} | [{i} / {len(pending)}] ({round(100*((i)/len(pending)),2)}%)")
+                # optional small backoff to avoid rapid-fire restarts on a flaky machine
+                time.sleep(2)
             
     # ---------------- OWS UPDATE ----------------
     try:
@@ -0,0 +1,177 @@
+'''
+######################################################################
+## ARISTOTLE UNIVERSITY OF THESSALONIKI
+## PERSLAB
+## REMOTE SENSING AND EARTH OBSERVATION TEAM
+##
+## DATE:             Oct-2026
+## SCRIPT:           utils/benchmarking.py
+## AUTHOR:           Vangelis Fotakidis (fotakidis@topo.auth.gr)
+##
+## DESCRIPTION:      Utility module with synthetic Sentinel-2 scenes and a local HTTP server
+##                      to benchmark the pipelines without Planetary Computer
+##
+#######################################################################
+'''
+
+import os
+import re
+import threading
+import http.server
+from functools import partial
+
+import numpy as np
+import pystac
+import rasterio
+from rasterio.transform import from_origin
+from odc.geo.geom import box as geo_box
+
+
+BANDS_R10m = ['B02', 'B03', 'B04']
+BANDS_R20m = ['B05', 'B07', 'B8A', 'SCL']
+
+STAC_EXTENSIONS = [
+    "https://stac-extensions.github.io/projection/v1.1.0/schema.json",
+    "https://stac-extensions.github.io/raster/v1.1.0/schema.json",
+    "https://stac-extensions.github.io/eo/v1.1.0/schema.json",
+]
+
+
+class _RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Static file handler with HTTP Range support (as GDAL /vsicurl/ expects), counting bytes served."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def do_GET(self):
+        self._serve(head=False)
+
+    def _serve(self, head):
+        path = self.translate_path(self.path.split('?')[0])
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get('Range', ''))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if head:
+            return
+
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start + 1)
+        self.wfile.write(data)
+        self.server.count(len(data))
+
+
+class ByteCountingHTTPServer(http.server.ThreadingHTTPServer):
+    """Local stand-in for a blob store: serves a directory and counts the requests and bytes served."""
+    daemon_threads = True
+
+    def __init__(self, directory):
+        super().__init__(('127.0.0.1', 0), partial(_RangeRequestHandler, directory=directory))
+        self._lock = threading.Lock()
+        self.reset()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def count(self, nbytes):
+        with self._lock:
+            self.requests += 1
+            self.bytes_served += nbytes
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_served = 0
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def _write_cog(path, data, transform, epsg, nodata):
+    profile = dict(
+        driver='COG', width=data.shape[1], height=data.shape[0], count=1, dtype=str(data.dtype),
+        crs=f'EPSG:{epsg}', transform=transform, nodata=nodata, blocksize=512, compress='DEFLATE',
+    )
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(data, 1)
+
+
+def write_synthetic_s2_scene(folder, base_url, scene_id, epsg, x0, y0, size_m, datetime, seed=0, mgrs_tile='34SFJ', cloud_patches=8):
+    """
+    Write a synthetic Sentinel-2 L2A scene as per-band COGs (10 m: B02/B03/B04, 20 m: B05/B07/B8A/SCL)
+    and return the matching pystac.Item, with projection and raster extension fields on the assets
+    so it can be loaded with odc.stac like a Planetary Computer item.
+
+    `x0`, `y0` are the upper-left corner of the scene in the UTM `epsg`. `cloud_patches` cloud/shadow
+    squares are drawn on SCL; eo:cloud_cover is random, unrelated to them.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    footprint = geo_box(x0, y0 - size_m, x0 + size_m, y0, f'EPSG:{epsg}').to_crs('EPSG:4326')
+    item = pystac.Item(
+        id=scene_id,
+        geometry=footprint.json,
+        bbox=list(footprint.boundingbox),
+        datetime=datetime,
+        properties={
+            'proj:epsg': epsg,
+            's2:mgrs_tile': mgrs_tile,
+            'eo:cloud_cover': float(rng.uniform(0, 60)),
+            's2:nodata_pixel_percentage': 0.0,
+        },
+        stac_extensions=list(STAC_EXTENSIONS),
+    )
+
+    for band in BANDS_R10m + BANDS_R20m:
+        res = 10 if band in BANDS_R10m else 20
+        n = int(size_m // res)
+        transform = from_origin(x0, y0, res, res)
+        if band == 'SCL':
+            # mostly vegetation (4), with cloud (9) and shadow (3) patches
+            data = np.full((n, n), 4, dtype='uint8')
+            for _ in range(cloud_patches):
+                r, c, h = rng.integers(0, n, 2).tolist() + [int(rng.integers(n//20, n//6))]
+                data[r:r+h, c:c+h] = rng.choice([3, 9])
+            nodata = 0
+        else:
+            # smooth field + noise, in the L2A DN range
+            yy, xx = np.mgrid[0:n, 0:n] / n
+            field = 1500 + 1000*np.sin(6*xx + seed) * np.cos(4*yy - seed)
+            data = (field + rng.normal(0, 150, (n, n))).clip(1, 10000).astype('uint16')
+            nodata = 0
+
+        path = os.path.join(folder, f'{scene_id}_{band}.tif')
+        _write_cog(path, data, transform, epsg, nodata)
+        item.add_asset(band, pystac.Asset(
+            href=f'{base_url}/{os.path.basename(folder)}/{scene_id}_{band}.tif',
+            media_type=pystac.MediaType.COG,
+            roles=['data'],
+            extra_fields={
+                'proj:epsg': epsg,
+                'proj:shape': [n, n],
+                'proj:transform': list(transform)[:6],
+                'raster:bands': [{'data_type': str(data.dtype), 'nodata': nodata}],
+            },
+        ))
+    return item
@@ -0,0 +1,80 @@
+'''
+######################################################################
+## ARISTOTLE UNIVERSITY OF THESSALONIKI
+## PERSLAB
+## REMOTE SENSING AND EARTH OBSERVATION TEAM
+##
+## DATE:             Oct-2026
+## SCRIPT:           utils/cluster.py
+## AUTHOR:           Vangelis Fotakidis (fotakidis@topo.auth.gr)
+##
+## DESCRIPTION:      Utility module to start the local Dask worker pool shared by the pipelines
+##
+#######################################################################
+'''
+
+import logging
+import tempfile
+
+import dask
+from dask.distributed import LocalCluster, Client
+
+
+DASK_CONFIG = {
+    'array.chunk-size': "256 MiB",
+    'array.slicing.split_large_chunks': True,
+    'distributed.comm.timeouts.connect': '120s',
+    'distributed.comm.timeouts.tcp': '120s',
+    'distributed.comm.retry.count': 10,
+    'distributed.scheduler.allowed-failures': 20,
+    "distributed.scheduler.worker-saturation": 1.1, # helps with memory pile up
+}
+
+
+def start_local_cluster(n_workers=8, threads_per_worker=1, dashboard_address=":8787"):
+    """
+    Start a process-based LocalCluster and connect a Client to it.
+
+    The same pool can be kept alive across many jobs (see `run_composites.py --mode pooled`),
+    so worker processes keep their imported modules and GDAL/rasterio environments warm.
+
+    Parameters
+    ----------
+    n_workers : int
+        Number of worker processes.
+    threads_per_worker : int
+        Threads per worker process.
+    dashboard_address : str
+        Address of the Dask dashboard.
+
+    Returns
+    -------
+    tuple[LocalCluster, Client]
+    """
+    dask.config.set(DASK_CONFIG)
+
+    cluster = LocalCluster(
+        n_workers=n_workers,
+        threads_per_worker=threads_per_worker,
+        processes=True,
+        memory_limit='auto',
+        local_directory=tempfile.mkdtemp(),
+        dashboard_address=dashboard_address,
+        # silence_logs=logging.WARN,
+        )
+    client = Client(cluster)
+    logging.info(f'Dask dashboard is available at: {client.dashboard_link}')
+
+    return cluster, client
+
+
+def close_local_cluster(cluster, client):
+    """Close a Client and its LocalCluster, tolerating either being None."""
+    try:
+        if client is not None:
+            logging.info('Closing Dask client')
+            client.close()
+    finally:
+        if cluster is not None:
+            logging.info('Closing Dask cluster')
+            cluster.close()
@@ -0,0 +1,364 @@
+'''
+######################################################################
+## ARISTOTLE UNIVERSITY OF THESSALONIKI
+## PERSLAB
+## REMOTE SENSING AND EARTH OBSERVATION TEAM
+##
+## DATE:             Oct-2026
+## SCRIPT:           utils/cog_cache.py
+## AUTHOR:           Vangelis Fotakidis (fotakidis@topo.auth.gr)
+##
+## DESCRIPTION:      Utility module with an opt-in, persistent, read-through disk cache of remote COG
+##                      byte ranges, served to GDAL by a local HTTP proxy
+##
+#######################################################################
+'''
+
+import base64
+import hashlib
+import http.server
+import logging
+import os
+import re
+import threading
+import uuid
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+
+
+BLOCK_SIZE = 256 * 1024     # byte ranges are cached as aligned blocks of this size
+
+
+class BlockCache:
+    """
+    Disk store of aligned byte blocks of remote files, keyed by the unsigned href (the URL without
+    its query string, so rotating SAS tokens do not invalidate it) and the block offset.
+
+    - Writes go to a uniquely named temporary file in the final folder, then `os.replace` it, so
+      concurrent writers (threads, or other jobs sharing the folder) never expose partial blocks;
+      two writers of the same block write identical bytes and the last rename wins.
+    - Reads touch the file's mtime, which is the LRU clock. When the cache grows over `max_bytes`,
+      the least recently used blocks are deleted until it is back under 90% of it. Files deleted by
+      another process meanwhile are simply skipped.
+    """
+
+    def __init__(self, folder, max_bytes, block_size=BLOCK_SIZE):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def _path(self, href, suffix):
+        digest = hashlib.sha1(f'{href}|{suffix}'.encode()).hexdigest()
+        return os.path.join(self.folder, digest[:2], digest[2:])
+
+    def _entries(self):
+        for sub in os.scandir(self.folder):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if '.tmp' in entry.name:
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, st.st_size, st.st_mtime
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        try:
+            previous = os.path.getsize(path)    # rewriting a block replaces its bytes, it does not add to them
+        except FileNotFoundError:
+            previous = 0
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._size += len(data) - previous
+            evict = self._size > self.max_bytes
+        if evict:
+            self.evict()
+
+    def get_block(self, href, index):
+        return self._read(self._path(href, index))
+
+    def put_block(self, href, index, data):
+        self._write(self._path(href, index), data)
+
+    def get_size(self, href):
+        data = self._read(self._path(href, 'size'))
+        return int(data) if data else None
+
+    def put_size(self, href, size):
+        self._write(self._path(href, 'size'), str(size).encode())
+
+    def evict(self):
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        target = 0.9 * self.max_bytes
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self._lock:
+            self._size = total
+
+
+class CacheStats:
+    """Block hit/miss and byte counters of the cache, reset per job."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = self.misses = 0
+            self.bytes_saved = self.bytes_fetched = 0
+            self.requests = self.upstream_requests = 0
+
+    def add(self, **counts):
+        with self._lock:
+            for k, v in counts.items():
+                setattr(self, k, getattr(self, k) + v)
+
+
+class _ProxyHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves GET/HEAD of `/<base64url(signed href)>/<file name>` from the block cache, fetching the
+    missing blocks of a Range request from the signed href in as few upstream requests as possible.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def _target(self):
+        encoded = self.path.lstrip('/').split('/')[0]
+        url = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)).decode()
+        return url, url.split('?')[0]
+
+    def do_HEAD(self):
+        url, href = self._target()
+        size = self.server.file_size(url, href)
+        if size is None:
+            self.send_error(502)
+            return
+        self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+
+    def do_GET(self):
+        url, href = self._target()
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get('Range', ''))
+        if not match:
+            # whole-file reads are passed through, uncached
+            upstream = self.server.session.get(url, timeout=self.server.timeout)
+            self.send_response(upstream.status_code)
+            self.send_header('Content-Length', str(len(upstream.content)))
+            self.end_headers()
+            self.wfile.write(upstream.content)
+            return
+
+        try:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else None
+            data, size = self.server.read_range(url, href, start, end)
+        except requests.HTTPError as exc:
+            self.send_error(exc.response.status_code if exc.response is not None else 502)
+            return
+        except requests.RequestException:
+            self.send_error(502)
+            return
+        if not data:
+            self.send_error(416)
+            return
+
+        self.send_response(206)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Range', f'bytes {start}-{start + len(data) - 1}/{size}')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class CachingCOGProxy(http.server.ThreadingHTTPServer):
+    """
+    Local HTTP proxy in front of the remote COGs. GDAL (in this process or in the Dask workers)
+    reads the rewritten hrefs from it, and it answers Range requests from the `BlockCache`.
+    """
+    daemon_threads = True
+
+    def __init__(self, cache, timeout=60, retries=5):
+        super().__init__(('127.0.0.1', 0), _ProxyHandler)
+        self.cache = cache
+        self.timeout = timeout
+        self.stats = CacheStats()
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=['GET', 'HEAD'])
+        self.session.mount('http://', HTTPAdapter(max_retries=retry, pool_maxsize=32))
+        self.session.mount('https://', HTTPAdapter(max_retries=retry, pool_maxsize=32))
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def proxy_href(self, signed_href):
+        encoded = base64.urlsafe_b64encode(signed_href.encode()).decode().rstrip('=')
+        return f'{self.url}/{encoded}/{quote(signed_href.split("?")[0].rsplit("/", 1)[-1])}'
+
+    def file_size(self, url, href):
+        size = self.cache.get_size(href)
+        if size is None:
+            upstream = self.session.get(url, headers={'Range': 'bytes=0-0'}, timeout=self.timeout)
+            self.stats.add(upstream_requests=1)
+            total = upstream.headers.get('Content-Range', '').rsplit('/', 1)[-1]
+            if upstream.status_code != 206 or not total.isdigit():
+                return None
+            size = int(total)
+            self.cache.put_size(href, size)
+        return size
+
+    @staticmethod
+    def _range_content(upstream, content, href, lo, hi):
+        """
+        Bytes `lo`..`hi` of an upstream response to that Range request, and whether they can be cached:
+        only a 206 whose Content-Range starts at `lo` with exactly `hi - lo + 1` bytes is. A 200 (the
+        Range header was ignored) or a 206 of another extent is served as far as it covers the range,
+        but not cached, so a truncated or misaligned response never ends up in the blocks.
+        """
+        match = re.match(r"bytes (\d+)-(\d+)/", upstream.headers.get('Content-Range', ''))
+        if upstream.status_code == 206 and match:
+            offset = int(match.group(1))
+        elif upstream.status_code == 200:
+            offset = 0
+        else:
+            raise requests.RequestException(f'Unexpected response to a range request of {href}: {upstream.status_code}')
+        if offset > lo:
+            raise requests.RequestException(f'Range response of {href} starts at {offset}, after {lo}')
+
+        cacheable = upstream.status_code == 206 and offset == lo and len(content) == hi - lo + 1
+        if not cacheable:
+            logging.warning(f'COG block cache: not caching the response of {href} to bytes={lo}-{hi} '
+                            f'({upstream.status_code}, {len(content)} bytes from {offset})')
+        return content[lo - offset:hi - offset + 1], cacheable
+
+    def read_range(self, url, href, start, end):
+        """Bytes `start`..`end` (inclusive, None for EOF) of `href` and its total size."""
+        size = self.file_size(url, href)
+        if size is None:
+            raise requests.RequestException(f'Cannot get the size of {href}')
+        end = size - 1 if end is None else min(end, size - 1)
+        if start > end:
+            return b'', size
+
+        bs = self.cache.block_size
+        first, last = start // bs, end // bs
+        blocks = {i: self.cache.get_block(href, i) for i in range(first, last + 1)}
+        missing = [i for i, b in blocks.items() if b is None]
+        hits = [i for i, b in blocks.items() if b is not None]
+
+        # fetch each run of consecutive missing blocks with a single upstream request
+        runs = []
+        for i in missing:
+            if runs and runs[-1][-1] == i - 1:
+                runs[-1].append(i)
+            else:
+                runs.append([i])
+        for run in runs:
+            lo, hi = run[0]*bs, min((run[-1] + 1)*bs, size) - 1
+            upstream = self.session.get(url, headers={'Range': f'bytes={lo}-{hi}'}, timeout=self.timeout)
+            upstream.raise_for_status()
+            content = upstream.content
+            self.stats.add(upstream_requests=1, bytes_fetched=len(content))
+            content, cacheable = self._range_content(upstream, content, href, lo, hi)
+            for i in run:
+                block = content[(i - run[0])*bs:(i - run[0] + 1)*bs]
+                blocks[i] = block
+                if cacheable:
+                    self.cache.put_block(href, i, block)
+
+        data = b''.join(blocks[i] for i in range(first, last + 1))
+        data = data[start - first*bs:end - first*bs + 1]
+        saved = sum(len(blocks[i]) for i in hits)
+        self.stats.add(requests=1, hits=len(hits), misses=len(missing), bytes_saved=saved)
+        return data, size
+
+
+_PROXY = None
+
+
+def start_cog_cache(folder, max_gb=50.0):
+    """
+    Start (once per process) the caching proxy that `odc_stac_load_Items` reads through.
+    Returns the running proxy; later calls return the same one.
+    """
+    global _PROXY
+    if _PROXY is None:
+        _PROXY = CachingCOGProxy(BlockCache(folder, max_bytes=int(max_gb * 1024**3))).start()
+        logging.info(f'COG block cache: {folder} (cap {max_gb} GB) served at {_PROXY.url}')
+    return _PROXY
+
+
+def active_cog_cache():
+    """The running caching proxy, or None if the cache was not enabled."""
+    return _PROXY
+
+
+def route_items_through_cache(signed_items):
+    """Copies of the (signed) items with their asset hrefs pointing at the caching proxy, if one is running."""
+    if _PROXY is None:
+        return signed_items
+    routed = []
+    for item in signed_items:
+        item = item.clone()
+        for asset in item.assets.values():
+            if asset.href.startswith(('http://', 'https://')):
+                asset.href = _PROXY.proxy_href(asset.href)
+        routed.append(item)
+    return routed
+
+
+def reset_cog_cache_stats():
+    if _PROXY is not None:
+        _PROXY.stats.reset()
+
+
+def log_cog_cache_stats():
+    """Log the hit/miss/bytes-saved counters of the job, if the cache is enabled."""
+    if _PROXY is None:
+        return
+    s = _PROXY.stats
+    blocks = s.hits + s.misses
+    logging.info(f'COG block cache: {s.requests} range reads | {s.hits}/{blocks} blocks hit ({round(100*s.hits/max(blocks, 1), 1)}%), '
+                 f'{s.misses} missed | {round(s.bytes_saved/1024**2, 2)} MiB saved, {round(s.bytes_fetched/1024**2, 2)} MiB fetched '
+                 f'in {s.upstream_requests} upstream requests')
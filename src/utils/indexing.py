@@ -0,0 +1,163 @@
+'''
+######################################################################
+## ARISTOTLE UNIVERSITY OF THESSALONIKI
+## PERSLAB
+## REMOTE SENSING AND EARTH OBSERVATION TEAM
+##
+## DATE:             Oct-2026
+## SCRIPT:           utils/indexing.py
+## AUTHOR:           Vangelis Fotakidis (fotakidis@topo.auth.gr)
+##
+## DESCRIPTION:      Utility module to index the datasets of a run in bulk: one query for the datasets already
+##                      indexed, and the EO3 documents of finished jobs added in batched transactions
+##
+#######################################################################
+'''
+
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+from datacube.index.hl import Doc2Dataset
+from datacube.model import Range
+from datacube.utils import changes
+from eodatasets3 import serialise
+
+
+def dataset_key(product, region_code, year_month):
+    """Key of a dataset in `existing_dataset_keys`: region codes are indexed without underscore (x00y00), months as 'YYYY-MM'."""
+    return (product, region_code.replace('_', ''), year_month)
+
+
+def existing_dataset_keys(dc, products):
+    """
+    ONE query per product for every active dataset already indexed.
+
+    Returns
+    -------
+    dict
+        `dataset_key(product, region_code, 'YYYY-MM')` -> dataset id, the month being that of the dataset start time.
+    """
+    t0 = time.time()
+    keys = {}
+    for product in products:
+        for row in dc.index.datasets.search_returning(('id', 'region_code', 'time'), product=product):
+            start = row.time.begin if isinstance(row.time, Range) else row.time
+            keys[dataset_key(product, row.region_code, start.strftime('%Y-%m'))] = row.id
+    logging.info(f'Loaded {len(keys)} indexed datasets of {", ".join(products)} in {round(time.time() - t0, 2)} s')
+    return keys
+
+
+class BulkIndexer:
+    """
+    Collects the EO3 documents of finished datasets and indexes them in batches, each in ONE transaction.
+
+    - `submit` queues a document (to add, or to update in place when it reuses the id of an indexed dataset) and
+      returns a Future, resolved with the dataset id once it is indexed, or with the error of this document.
+      The queue is flushed when it holds `batch_size` documents or its oldest one waited `max_wait` seconds,
+      checked by a background timer, so that the last partial batch of a long run is not held until `close`.
+    - Documents are resolved by one `Doc2Dataset` per product, created once. A document that does not resolve
+      fails alone; if a batch transaction fails, it is rolled back and its documents are retried one per
+      transaction, so that every failure is reported against its own document.
+    - `close` flushes the queue and reports the run.
+
+    Thread-safe: jobs and the background publisher may submit concurrently.
+    """
+
+    def __init__(self, dc, batch_size=50, max_wait=300):
+        self.dc = dc
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.indexed = 0
+        self.failed = 0
+        self._resolvers = {}
+        self._queue = []
+        self._oldest = None
+        self._lock = threading.RLock()
+        self._closed = threading.Event()
+        self._timer = None
+        if max_wait:
+            self._timer = threading.Thread(target=self._flush_when_due, name='bulk-indexer-timer', daemon=True)
+            self._timer.start()
+
+    def _flush_when_due(self):
+        while not self._closed.wait(min(self.max_wait, 5)):
+            with self._lock:
+                due = self._oldest is not None and time.time() - self._oldest >= self.max_wait
+            if due:
+                try:
+                    self.flush()
+                except Exception:
+                    logging.exception('Timed flush of the bulk indexer failed')
+
+    def _resolver(self, product):
+        if product not in self._resolvers:
+            self._resolvers[product] = Doc2Dataset(self.dc.index, products=[product], skip_lineage=True)
+        return self._resolvers[product]
+
+    def submit(self, eo3_doc, uri, label, update=False):
+        future = Future()
+        with self._lock:
+            self._queue.append((eo3_doc, uri, label, update, future))
+            self._oldest = self._oldest or time.time()
+            logging.info(f'Queued {label} for indexing ({len(self._queue)} pending)')
+            if len(self._queue) >= self.batch_size or time.time() - self._oldest >= self.max_wait:
+                self.flush()
+        return future
+
+    def _write(self, dataset, update):
+        if update:
+            self.dc.index.datasets.update(dataset, updates_allowed={('properties',): changes.allow_any})
+        else:
+            self.dc.index.datasets.add(dataset=dataset, with_lineage=False)
+
+    def _fail(self, label, future, error):
+        logging.error(f'✖ Indexing {label} failed: {error}')
+        self.failed += 1
+        future.set_exception(error if isinstance(error, Exception) else RuntimeError(error))
+
+    def flush(self):
+        with self._lock:
+            batch, self._queue, self._oldest = self._queue, [], None
+            if not batch:
+                return
+            t0 = time.time()
+            resolved = []
+            for eo3_doc, uri, label, update, future in batch:
+                try:
+                    dataset, err = self._resolver(eo3_doc.product.name)(doc_in=serialise.to_doc(eo3_doc), uri=uri)
+                except Exception as exc:
+                    dataset, err = None, exc
+                if err:
+                    self._fail(label, future, f'cannot resolve its EO3 document: {err}')
+                else:
+                    resolved.append((dataset, label, update, future))
+
+            try:
+                with self.dc.index.transaction():
+                    for dataset, label, update, future in resolved:
+                        self._write(dataset, update)
+                done = resolved
+            except Exception:
+                logging.warning(f'Batch of {len(resolved)} datasets rolled back, indexing them one by one')
+                done = []
+                for dataset, label, update, future in resolved:
+                    try:
+                        with self.dc.index.transaction():
+                            self._write(dataset, update)
+                        done.append((dataset, label, update, future))
+                    except Exception as exc:
+                        self._fail(label, future, exc)
+
+            for dataset, label, update, future in done:
+                future.set_result(dataset.id)
+            self.indexed += len(done)
+            logging.info(f'Indexed {len(done)}/{len(batch)} datasets in one batch in {round(time.time() - t0, 2)} s')
+
+    def close(self):
+        self._closed.set()
+        if self._timer is not None:
+            self._timer.join()
+        self.flush()
+        logging.info(f'Bulk indexer: {self.indexed} datasets indexed, {self.failed} failed')
@@ -14,6 +14,7 @@
 '''
 
 import rasterio as rio
+import rasterio.features
 from eodatasets3 import DatasetPrepare, DatasetDoc, ValidDataMethod
 from eodatasets3.model import ProductDoc, AccessoryDoc
 from eodatasets3 import serialise
@@ -21,16 +22,87 @@ from eodatasets3 import images
 from eodatasets3.stac import to_stac_item
 
 from shapely import Polygon
+import shapely.affinity
+import shapely.geometry
+import shapely.ops
 
 import datetime
+import time
+import numpy as np
 import pandas as pd
+import yaml
 from pathlib import Path
 
-import datacube
-
 import logging
 
 
+PRODUCT_YAMLS = Path(__file__).resolve().parents[2] / 'yamls'
+FOOTPRINT_STEP = 8              # pixel stride of the downsampled valid-data mask (footprint='mask')
+
+_MEASUREMENTS = {}              # product name -> band names in product order, loaded once per process
+
+
+def load_product_registry(dc=None):
+    """
+    Load the band names of every product into the process-wide registry: from the index with ONE
+    `dc.list_measurements()` if `dc` is given, else from the `yamls/*.odc-product.yaml` definitions.
+    """
+    if dc is not None:
+        df = dc.list_measurements()
+        for product in df.index.get_level_values(0).unique():
+            _MEASUREMENTS[product] = list(df.loc[product].name.values)
+        source = 'the index'
+    else:
+        for path in sorted(PRODUCT_YAMLS.glob('*.odc-product.yaml')):
+            with open(path) as f:
+                definition = yaml.safe_load(f)
+            _MEASUREMENTS[definition['name']] = [m['name'] for m in definition['measurements']]
+        source = str(PRODUCT_YAMLS)
+    logging.info(f'Loaded the measurements of {len(_MEASUREMENTS)} products from {source}')
+    return _MEASUREMENTS
+
+
+def product_measurements(product, dc=None):
+    """Band names of `product` in product order, from the registry (loaded on first use, reloaded once for an unknown product)."""
+    if product not in _MEASUREMENTS:
+        load_product_registry(dc)
+    if product not in _MEASUREMENTS:
+        raise ValueError(f"Unknown product '{product}', known products: {sorted(_MEASUREMENTS)}")
+    return _MEASUREMENTS[product]
+
+
+def valid_data_footprint(xr_cube, step=FOOTPRINT_STEP):
+    """
+    Valid-data polygon of a dataset (pixels valid in ANY band), in the CRS of its geobox, from a mask
+    downsampled by `step` and computed once for all bands. Same recipe as eodatasets3 (convex hull of the
+    vectorised mask, buffered and simplified by one mask pixel, clipped to the image), at 1/step^2 of the pixels.
+    Falls back to the bounding box when there is no valid pixel.
+    """
+    geobox = xr_cube.odc.geobox
+    bounds = shapely.geometry.box(*geobox.boundingbox)
+
+    mask = None
+    for name, da in xr_cube.data_vars.items():
+        pixels = np.asarray(da.isel(y=slice(None, None, step), x=slice(None, None, step)).values)
+        nodata = da.attrs.get('_FillValue', da.attrs.get('nodata'))
+        if nodata is None or (isinstance(nodata, float) and np.isnan(nodata)):
+            valid = np.isfinite(pixels) if np.issubdtype(pixels.dtype, np.floating) else pixels != 0
+        else:
+            valid = pixels != nodata
+        mask = valid if mask is None else mask | valid
+    if mask is None or not mask.any():
+        return bounds
+
+    shape = shapely.ops.unary_union([
+        shapely.geometry.shape(s) for s, v in rasterio.features.shapes(mask.astype('uint8'), mask=mask) if v == 1
+    ])
+    geom = shape.convex_hull.buffer(1, cap_style='square', join_style='bevel').simplify(1)
+    geom = geom.intersection(shapely.geometry.box(0, 0, mask.shape[1], mask.shape[0]))
+    t = geobox.affine * geobox.affine.scale(step)
+    geom = shapely.affinity.affine_transform(geom, (t.a, t.b, t.d, t.e, t.xoff, t.yoff))
+    return geom.intersection(bounds)
+
+
 def prepare_eo3_metadata_NAS(
     dc,
     xr_cube, 
@@ -44,11 +116,22 @@ def prepare_eo3_metadata_NAS(
     set_range=False,
     lineage_path=None,
     version=1,
+    dataset_id=None,
+    footprint='bounds',
+    properties=None,
     ) -> tuple[DatasetDoc, dict]:
     """
     Prepare eo3 metadata with NAS paths
+
+    `dataset_id` reuses the UUID of an indexed dataset (to update it in place); by default a new one is generated.
+    The band names come from the cached product registry (`product_measurements`), not from a query per dataset.
+    `footprint` sets the dataset geometry, computed once for all bands, no band is scanned by eodatasets3:
+    'bounds' (default) the bounding box of the grid, 'mask' the valid-data polygon of a downsampled mask
+    (`valid_data_footprint`).
+    `properties` are extra dataset properties, e.g. {'clim:month': 7}.
     """
 
+    t0 = time.time()
     y,m,d = datetime_list
     
     with DatasetPrepare(
@@ -59,6 +142,8 @@ def prepare_eo3_metadata_NAS(
     ) as preparer:
 
         preparer.valid_data_method = ValidDataMethod.bounds
+        if dataset_id is not None:
+            preparer.dataset_id = dataset_id
 
         preparer.product_name = product_name
         preparer.product_family = product_family
@@ -91,6 +176,8 @@ def prepare_eo3_metadata_NAS(
         if hasattr(xr_cube, 'eo:platform"'):
             preparer.properties["eo:platform"] = xr_cube.attrs['eo:platform']
         preparer.properties["eo:gsd"] = int(abs(xr_cube.odc.geobox.resolution.x))
+        for key, value in (properties or {}).items():
+            preparer.properties[key] = value
 
 
         if lineage_path:
@@ -99,20 +186,25 @@ def prepare_eo3_metadata_NAS(
         # if uuid_lineage:
         #     preparer.note_source_datasets(product_lineage, uuid_lineage) # As in ("ard", metadata["id"]), UUIDs from datacube schema
 
-        polygon_geometry = Polygon(xr_cube.odc.geobox.boundingbox.polygon.boundary.coords)
+        if footprint == 'bounds':
+            polygon_geometry = Polygon(xr_cube.odc.geobox.boundingbox.polygon.boundary.coords)
+        elif footprint == 'mask':
+            polygon_geometry = valid_data_footprint(xr_cube)
+        else:
+            raise ValueError(f"Unknown footprint '{footprint}', expected 'bounds' or 'mask'")
         preparer.geometry = polygon_geometry
 
-        bands = list(dc.list_measurements().loc[product_name].name.values)
+        grid = images.GridSpec.from_odc_xarray(xr_cube)
+        bands = product_measurements(product_name, dc)
         for name, path in zip(bands, name_measurements):
             # preparer.note_measurement(name, str(Path(path).resolve()), relative_to_dataset_location=False) # else: (name, f'{granule_dir}/{path}', relative_to_dataset_location=False)
             preparer.note_measurement(
                 name=name, 
                 path=path, 
                 relative_to_dataset_location=True,
-                grid=images.GridSpec.from_odc_xarray(xr_cube),
-                pixels=xr_cube[name],
+                grid=grid,
                 nodata=xr_cube[name].attrs['_FillValue'],
-                expand_valid_data=True
+                expand_valid_data=False
             )
 
         eo3_doc = preparer.to_dataset_doc()
@@ -143,14 +235,16 @@ def prepare_eo3_metadata_NAS(
 
     stac_path = f'{collection_path}/{dataset_name}.stac-metadata.json'
     stac_doc = to_stac_item(dataset=eo3, stac_item_destination_url=stac_path, collection_url=f'file://{collection_path}')
+    logging.info(f'Prepared the metadata of {dataset_name} ({footprint} footprint) in {round(time.time() - t0, 2)} s')
     return eo3_doc, stac_doc
 
 
 
 
-def reorder_measurements(product: str, relative_name_measurements: list[str]) -> list[str]:
+def reorder_measurements(product: str, relative_name_measurements: list[str], dc=None) -> list[str]:
     """
-    Reorder measurement filenames to match the fixed band order for a product.
+    Reorder measurement filenames to match the fixed band order for a product
+    (from the cached product registry, see `product_measurements`).
 
     Expected filename pattern:
         <product>_<BAND>.tif
@@ -158,8 +252,7 @@ def reorder_measurements(product: str, relative_name_measurements: list[str]) ->
         baseline_NDVI_mean.tif
     """
 
-    dc = datacube.Datacube(app='reorder', env='drought')
-    bands = list(dc.list_measurements().loc[product].name.values)
+    bands = product_measurements(product, dc)
 
     def extract_band(fname: str) -> str:
         stem = Path(fname).stem
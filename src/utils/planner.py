@@ -0,0 +1,169 @@
+'''
+######################################################################
+## ARISTOTLE UNIVERSITY OF THESSALONIKI
+## PERSLAB
+## REMOTE SENSING AND EARTH OBSERVATION TEAM
+##
+## DATE:             Oct-2026
+## SCRIPT:           utils/planner.py
+## AUTHOR:           Vangelis Fotakidis (fotakidis@topo.auth.gr)
+##
+## DESCRIPTION:      Utility module to plan the tile-month jobs of the run_* drivers in memory, from the tile grid
+##                      and a date range, with the grid of each tile computed once, and to export the plan as JSON
+##
+#######################################################################
+'''
+
+import datetime
+import json
+import logging
+import os
+import time
+
+import geopandas as gpd
+import odc.geo
+import odc.geo.geobox
+from odc.geo.geom import BoundingBox
+from dateutil.relativedelta import relativedelta
+from shapely.geometry import shape as shapely_shape, mapping
+
+from utils.indexing import dataset_key
+
+
+def tile_grid(tile_geom):
+    """
+    Geometry (EPSG:4326), search AOI (buffered φ,λ box), bounding box and 20 m GeoBox (EPSG:3035) of a tile,
+    from its GeoJSON geometry dict or shapely geometry, or the ones precomputed by a `Tile` of the plan.
+    """
+    if isinstance(tile_geom, Tile):
+        return tile_geom.grid
+    logging.info('Retrieve tile geometry')
+    # # Ensure shapely geometry
+    if isinstance(tile_geom, dict):
+        geom_ll = shapely_shape(tile_geom)
+    else:
+        geom_ll = tile_geom
+    geom_3035 = gpd.GeoSeries([geom_ll], crs="EPSG:4326").to_crs(epsg=3035)
+
+    minl, minf, maxl, maxf = geom_ll.bounds
+    minx, miny, maxx, maxy = geom_3035.total_bounds
+
+    logging.info('Create the Bounding Box (φ,λ)')
+    aoi_bbox = BoundingBox.from_xy(
+        (minl, maxl),
+        (minf, maxf)
+    ).buffered(xbuff=0.025, ybuff=0.025)
+
+    logging.info('Create the Bounding Box (x,y)')
+    tile_bbox = BoundingBox.from_xy(
+        (minx, maxx),
+        (miny, maxy),
+        crs='EPSG:3035'
+    )
+
+    tile_geobox = odc.geo.geobox.GeoBox.from_bbox(
+        tile_bbox,
+        resolution=odc.geo.Resolution(x=20,y=-20)
+    )
+    return geom_ll, aoi_bbox, tile_bbox, tile_geobox
+
+
+class Tile:
+    """A tile of the grid, with its geometry (EPSG:4326) and its `tile_grid` computed once for all its jobs."""
+
+    def __init__(self, tile_id, geometry):
+        self.tile_id = tile_id
+        self.geometry = geometry
+        self.grid = tile_grid(geometry)
+
+
+class Job:
+    """
+    One tile-month of a driver. `key` is the path the per-job GeoJSON of the legacy fan-out had
+    (`<legacy_dir>/<prefix>_<YYYYMM>_<tile_id>.geojson`), so the done files and job cost histories of
+    earlier runs remain valid.
+    """
+
+    def __init__(self, key, tile, year_month):
+        self.key = key
+        self.tile = tile
+        self.year_month = year_month
+
+    @property
+    def tile_id(self):
+        return self.tile.tile_id
+
+    def __repr__(self):
+        return f'Job({self.key})'
+
+
+def load_tiles(tile_geojson_filepath="../anciliary/grid_20_v2.geojson"):
+    """Tiles of the grid by tile id, read once, with their grids precomputed."""
+    t0 = time.time()
+    aoi = gpd.read_file(tile_geojson_filepath).to_crs("EPSG:4326")
+    tiles = {tile["tile_ids"]: Tile(tile["tile_ids"], tile.geometry) for _, tile in aoi.iterrows()}
+    logging.info(f'Loaded {len(tiles)} tiles from {tile_geojson_filepath} in {round(time.time() - t0, 2)} s')
+    return tiles
+
+
+def plan_jobs(tiles, start_date, end_date, prefix='compgen', legacy_dir=None):
+    """
+    Jobs of every tile and month from `start_date` to `end_date` (both included), in the order of the sorted
+    legacy GeoJSON file names (month, then tile).
+    """
+    legacy_dir = legacy_dir or f'../geojsons/{prefix}'
+    jobs = []
+    current_date = start_date
+    while current_date <= end_date:
+        for tile_id, tile in tiles.items():
+            key = os.path.join(legacy_dir, f'{prefix}_{current_date.strftime("%Y%m")}_{tile_id}.geojson')
+            jobs.append(Job(key, tile, current_date.strftime("%Y-%m")))
+        current_date += relativedelta(months=1)
+    return sorted(jobs, key=lambda job: job.key)
+
+
+def pending_jobs(jobs, product=None, existing=None, done=(), rerun=()):
+    """
+    Jobs left to run: neither in the `done` keys of the driver, nor already indexed (`existing`, see
+    `utils.indexing.existing_dataset_keys`, for `product`), unless their key is in `rerun`.
+    """
+    pending, n_done, n_indexed = [], 0, 0
+    for job in jobs:
+        if job.key in rerun:
+            pending.append(job)
+        elif job.key in done:
+            n_done += 1
+        elif existing is not None and dataset_key(product, job.tile_id, job.year_month) in existing:
+            n_indexed += 1
+        else:
+            pending.append(job)
+    logging.info(f'Plan: {len(jobs)} jobs, {n_done} completed, {n_indexed} already indexed, {len(pending)} to run')
+    return pending
+
+
+def export_plan(path, jobs, pending):
+    """
+    Write the plan to ONE JSON file, for audit and resume: the tile geometries once, and every job as
+    [key, tile_id, year_month, pending].
+    """
+    pending_keys = {job.key for job in pending}
+    tiles = {job.tile_id: job.tile for job in jobs}
+    plan = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'tiles': {tile_id: mapping(tile.geometry) for tile_id, tile in tiles.items()},
+        'jobs': [[job.key, job.tile_id, job.year_month, job.key in pending_keys] for job in jobs],
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(plan, f)
+    logging.info(f'Plan of {len(jobs)} jobs ({len(pending_keys)} pending) written to {path}')
+    return path
+
+
+def read_plan_job(path, key):
+    """The job `key` of an exported plan, with its tile rebuilt from the plan (single-shot jobs, see `--plan`/`--job`)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        plan = json.load(f)
+    for job_key, tile_id, year_month, _ in plan['jobs']:
+        if job_key == key:
+            return Job(job_key, Tile(tile_id, shapely_shape(plan['tiles'][tile_id])), year_month)
+    raise ValueError(f'Job {key} is not in the plan {path}')
@@ -0,0 +1,150 @@
+'''
+######################################################################
+## ARISTOTLE UNIVERSITY OF THESSALONIKI
+## PERSLAB
+## REMOTE SENSING AND EARTH OBSERVATION TEAM
+##
+## DATE:             Oct-2026
+## SCRIPT:           utils/quicklooks.py
+## AUTHOR:           Vangelis Fotakidis (fotakidis@topo.auth.gr)
+##
+## DESCRIPTION:      Utility module to render the quicklooks of a composite (input scenes preview, footprint
+##                      of the scenes) from decimated data, in a background thread off the critical path
+##
+#######################################################################
+'''
+
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils.sentinel2 import plot_mgrs_tiles_with_aoi
+
+
+QUICKLOOK_MAX_SIZE = 512        # pixels along the longest side of each scene panel
+QUICKLOOK_DPI = 150
+QUANTILE_SAMPLE_SIZE = 100_000  # valid pixels sampled for the colour stretch
+
+
+def approximate_quantiles(values, q=(0.02, 0.98), nodata=0, sample_size=QUANTILE_SAMPLE_SIZE, seed=0):
+    """
+    Quantiles `q` of the valid (finite, != `nodata`) values of an array, from a random sample of at most
+    `sample_size` of them. Returns NaNs if there is no valid value.
+    """
+    values = np.asarray(values).ravel()
+    valid = values[np.isfinite(values) & (values != nodata)]
+    if valid.size == 0:
+        return tuple(float('nan') for _ in q)
+    if valid.size > sample_size:
+        valid = np.random.default_rng(seed).choice(valid, sample_size, replace=False)
+    return tuple(float(v) for v in np.quantile(valid, q))
+
+
+def decimate(da, max_size=QUICKLOOK_MAX_SIZE):
+    """Every n-th pixel of a (..., y, x) DataArray, so that its longest side is at most `max_size` pixels."""
+    step = max(1, math.ceil(max(da.sizes['y'], da.sizes['x']) / max_size))
+    return da.isel(y=slice(None, None, step), x=slice(None, None, step))
+
+
+def render_preview(da, var_name, save_path, dpi=QUICKLOOK_DPI, col_wrap=4):
+    """
+    FacetGrid of a decimated (time, y, x) DataArray, one panel per scene, stretched between the approximate
+    2% and 98% quantiles of its valid pixels, saved as a JPEG.
+    """
+    import matplotlib
+    matplotlib.use("Agg", force=True)
+    import matplotlib.pyplot as plt
+
+    da = da.compute()
+    da_valid = da.where(da != 0)                     # mask nodata=0 so it doesn’t skew scaling
+    vmin, vmax = approximate_quantiles(da_valid.values)
+
+    fg = da_valid.plot(col='time', col_wrap=col_wrap, vmin=vmin, vmax=vmax)
+    fg.fig.suptitle(f"Preview – {var_name}", fontsize=16, fontweight="bold", y=1.02)
+    fg.fig.savefig(save_path, format="jpeg", dpi=dpi, bbox_inches="tight")
+    plt.close(fg.fig)
+    logging.info(f"Saved preview for '{var_name}' to {save_path}")
+
+
+class QuicklookRenderer:
+    """
+    Renders the quicklooks of one composite job in a single background thread, so that they never block
+    the composite. Rendering failures are logged and do not fail the job.
+
+    - `decimated` returns the decimated variable of the scene stack: a copy of a few MB for in-memory data, a lazy
+      slice for dask data, to be computed in the SAME `dask.compute` as the composite, so that the scenes are
+      read once for both.
+    - `preview` queues the rendering of a decimated variable (still lazy ones are computed by the background
+      thread, reading the scenes again).
+    - `footprint` queues the plot of the footprints of the scenes.
+    - `close` (once, later calls are no-ops) waits for the pending quicklooks, and reports the seconds they
+      took in the background against the seconds the job spent on them (queueing + final wait), i.e. the
+      seconds saved per job.
+
+    With `enabled=False` every call is a no-op (quicklooks skipped for the run).
+    """
+
+    def __init__(self, enabled=True, max_size=QUICKLOOK_MAX_SIZE, dpi=QUICKLOOK_DPI):
+        self.enabled = enabled
+        self.max_size = max_size
+        self.dpi = dpi
+        self.render_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self._futures = []
+        self._closed = False
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='quicklooks') if enabled else None
+
+    def _timed(self, fn, *args, **kwargs):
+        t0 = time.time()
+        try:
+            fn(*args, **kwargs)
+        finally:
+            self.render_seconds += time.time() - t0
+
+    def _submit(self, fn, *args, **kwargs):
+        self._futures.append(self._pool.submit(self._timed, fn, *args, **kwargs))
+
+    def decimated(self, ds, var_name):
+        if not self.enabled:
+            return None
+        if var_name not in ds.data_vars:
+            raise ValueError(f"Variable '{var_name}' not found in dataset.")
+        da = decimate(ds[var_name], self.max_size)
+        if da.chunks is None:
+            da = da.copy(deep=True)                  # do not keep the full-resolution stack alive
+        return da
+
+    def preview(self, da, var_name, save_path):
+        if not self.enabled or da is None:
+            return
+        t0 = time.time()
+        self._submit(render_preview, da, var_name, save_path, dpi=self.dpi)
+        self.blocked_seconds += time.time() - t0
+
+    def footprint(self, items, aoi_bbox, save_path):
+        if not self.enabled:
+            return
+        t0 = time.time()
+        self._submit(plot_mgrs_tiles_with_aoi, list(items), aoi_bbox, save_path=save_path, dpi=self.dpi)
+        self.blocked_seconds += time.time() - t0
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if not self.enabled:
+            logging.info('Quicklooks skipped for this run')
+            return
+        t0 = time.time()
+        for future in self._futures:
+            try:
+                future.result()
+            except Exception:
+                logging.exception('Quicklook rendering failed (the composite is not affected)')
+        self._pool.shutdown(wait=True)
+        self.blocked_seconds += time.time() - t0
+        logging.info(f'Quicklooks: {len(self._futures)} rendered in {round(self.render_seconds, 1)} s in the background, '
+                     f'the job waited {round(self.blocked_seconds, 1)} s for them | {round(self.render_seconds - self.blocked_seconds, 1)} s saved')
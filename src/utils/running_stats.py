@@ -0,0 +1,314 @@
+'''
+######################################################################
+## ARISTOTLE UNIVERSITY OF THESSALONIKI
+## PERSLAB
+## REMOTE SENSING AND EARTH OBSERVATION TEAM
+##
+## DATE:             Oct-2026
+## SCRIPT:           utils/running_stats.py
+## AUTHOR:           Vangelis Fotakidis (fotakidis@topo.auth.gr)
+##
+## DESCRIPTION:      Utility module to stream the monthly composites of a tile block by block, and to keep
+##                      per-pixel running statistics over them in memory independent of the number of months, or
+##                      exact sums that can be added and subtracted between periods, or exact quantiles from
+##                      radix histograms
+##
+#######################################################################
+'''
+
+import logging
+import time
+
+import numpy as np
+from odc.geo.xr import wrap_xr
+
+from utils.utils import nas_patch
+
+
+BLOCK_ROWS = 512                # rows of a block (= the y dask chunks of the product loads)
+RADIX_BITS = 6                  # fine bins per coarse bin of the radix histograms: 2**6 = 64
+RADIX_DOMAIN = (-2048, 6144)    # values ranked exactly by the radix histograms (int16 indices x1000), clamped outside
+
+
+def find_composites(dc, tile_id, time_range, product='composites'):
+    """Datasets of `product` of a tile in `time_range`, sorted by time; an error if there are none."""
+    datasets = sorted(
+        dc.find_datasets(product=product, region_code=tile_id.replace('_', ''), time=time_range),
+        key=lambda d: d.center_time,
+    )
+    if not datasets:
+        raise ValueError(f'No {product} datasets of tile {tile_id} in {time_range}')
+    return datasets
+
+
+def load_composites_lazily(dc, tile_id, time_range, measurements, product='composites', block_rows=BLOCK_ROWS):
+    """
+    Every composite of a tile in `time_range`, opened lazily (dask, `block_rows` rows per chunk) on the grid of the
+    first one: blocks of rows are then read from any of them, any number of times. Returns [(dataset, 2-D dataset)].
+    """
+    lazy = []
+    for dataset in find_composites(dc, tile_id, time_range, product):
+        ds = dc.load(
+            datasets=[dataset],
+            measurements=measurements,
+            dask_chunks=dict(x=-1, y=block_rows),
+            patch_url=nas_patch,
+            **({'like': lazy[0][1].odc.geobox} if lazy else {}),
+        ).isel(time=0)
+        lazy.append((dataset, ds))
+    return lazy
+
+
+def iter_composite_blocks(dc, tile_id, time_range, measurements, product='composites', block_rows=BLOCK_ROWS):
+    """
+    Stream the composites of a tile ONE month at a time, `block_rows` rows at a time.
+
+    Parameters
+    ----------
+    dc : datacube.Datacube
+    tile_id : str
+        Tile id (xNN_yNN).
+    time_range : tuple of str
+        (start, end) dates of the months.
+    measurements : list of str
+        Bands read from each composite.
+
+    Yields
+    ------
+    (numpy.datetime64, slice, dict)
+        Time of the composite, the rows of the block, and band -> block (nodata kept as is).
+        The first item yielded is (None, None, lazy dataset of the first month), for its GeoBox (shared by all
+        months) and the attributes (nodata) of its bands.
+    """
+    datasets = find_composites(dc, tile_id, time_range, product)
+    logging.info(f'Streaming {len(datasets)} {product} datasets of {tile_id}, {block_rows} rows at a time')
+
+    geobox = None
+    for dataset in datasets:
+        t0 = time.time()
+        ds = dc.load(
+            datasets=[dataset],
+            measurements=measurements,
+            dask_chunks=dict(x=-1, y=block_rows),
+            patch_url=nas_patch,
+            **({'like': geobox} if geobox is not None else {}),
+        )
+        if geobox is None:
+            geobox = ds.odc.geobox
+            yield None, None, ds
+        for y0 in range(0, ds.sizes['y'], block_rows):
+            rows = slice(y0, min(y0 + block_rows, ds.sizes['y']))
+            block = ds.isel(time=0, y=rows).compute()
+            yield ds.time.values[0], rows, {m: block[m].values for m in measurements}
+        logging.info(f'        {str(ds.time.values[0])[:7]} streamed in {round(time.time() - t0, 1)} s')
+
+
+def moments(values, nodata=None, axis=0):
+    """
+    Block kernel: count, sum and sum of squares (int64, exact) of the valid values (!= `nodata`) of an integer
+    block along `axis`, e.g. the time axis of a (time, y, x) block of int16 composites.
+    """
+    values = np.asarray(values)
+    valid = values != nodata if nodata is not None else np.ones(values.shape, bool)
+    x = np.where(valid, values, 0).astype('int64')
+    return valid.sum(axis=axis, dtype='int64'), x.sum(axis=axis), (x * x).sum(axis=axis)
+
+
+def mean_std(count, total, sumsq, ddof=0, dtype='float32'):
+    """
+    Mean and standard deviation (`dtype`) from exact integer moments, NaN where there are no values (more than
+    `ddof` for the std). The variance is (n*sumsq - sum**2) / (n*(n - ddof)): its numerator is computed in int64,
+    so there is no cancellation error, and only the final division and square root are rounded.
+    """
+    n = np.asarray(count, dtype='int64')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(n > 0, total / n, np.nan)
+        var = (n * sumsq - np.asarray(total, dtype='int64')**2) / (n.astype('float64') * (n - ddof))
+        std = np.where(n > ddof, np.sqrt(np.maximum(var, 0)), np.nan)
+    return mean.astype(dtype), std.astype(dtype)
+
+
+def z_scores(values, centre, spread, nodata=None, base_nodata=None, spread_scale=1):
+    """
+    Block kernel: float32 z-scores (values - centre) / (spread * spread_scale) of int16 blocks, NaN where the
+    value (`nodata`) or the baseline (`base_nodata`) is missing. `values` may have leading dims (e.g. time) over
+    the (y, x) of the baseline. No float16 or float64 copy of the blocks is made.
+
+    A baseline already decoded to float32 (NaN where missing, spread scaled: see `z_normalization.decode_baseline`)
+    is used as is, with `base_nodata=None` and `spread_scale=1`: the only array allocated is then the output.
+    """
+    values, centre, spread = np.asarray(values), np.asarray(centre), np.asarray(spread)
+    # the mask is built from the raw (unscaled) baseline layers
+    missing = np.zeros(values.shape, bool)
+    if nodata is not None:
+        missing |= values == nodata
+    if base_nodata is not None:
+        missing |= (centre == base_nodata) | (spread == base_nodata)
+    z = np.subtract(values, centre, dtype='float32')
+    spread = spread.astype('float32', copy=False)
+    if spread_scale != 1:
+        spread = spread * np.float32(spread_scale)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z /= spread
+    z[missing] = np.nan
+    return z
+
+
+class SumAccumulator:
+    """
+    Per-pixel count, sum and sum of squares of the valid values of an integer 2-D series (the int16 composite
+    indices), held in int64: exact, so that the statistics of two periods can be added, and those of a period
+    subtracted from a longer one that contains it, without any rounding.
+
+    - `update(values, rows, nodata)` adds the valid values (!= `nodata`) of a block of rows.
+    - `a + b` / `a - b` combine the statistics of two periods of the same grid.
+    - `mean()` / `std(ddof=0)` are float32 (see `mean_std`), NaN where no value was seen.
+    """
+
+    def __init__(self, shape=None, count=None, total=None, sumsq=None):
+        if count is None:
+            count, total, sumsq = (np.zeros(shape, dtype='int64') for _ in range(3))
+        self.count = np.asarray(count, dtype='int64')
+        self.sum = np.asarray(total, dtype='int64')
+        self.sumsq = np.asarray(sumsq, dtype='int64')
+
+    def update(self, values, rows=slice(None), nodata=None):
+        values = np.asarray(values, dtype='int64')
+        valid = values != nodata if nodata is not None else np.ones(values.shape, bool)
+        x = np.where(valid, values, 0)
+        self.count[rows] += valid
+        self.sum[rows] += x
+        self.sumsq[rows] += x * x
+
+    def __add__(self, other):
+        return SumAccumulator(count=self.count + other.count, total=self.sum + other.sum, sumsq=self.sumsq + other.sumsq)
+
+    def __sub__(self, other):
+        return SumAccumulator(count=self.count - other.count, total=self.sum - other.sum, sumsq=self.sumsq - other.sumsq)
+
+    def copy(self):
+        return SumAccumulator(count=self.count.copy(), total=self.sum.copy(), sumsq=self.sumsq.copy())
+
+    def mean(self, dtype='float32'):
+        return mean_std(self.count, self.sum, self.sumsq, dtype=dtype)[0]
+
+    def std(self, ddof=0, dtype='float32'):
+        return mean_std(self.count, self.sum, self.sumsq, ddof, dtype)[1]
+
+    def nbytes(self):
+        return self.count.nbytes + self.sum.nbytes + self.sumsq.nbytes
+
+
+def radix_quantiles(read, quantiles, nodata=None, domain=RADIX_DOMAIN, bits=RADIX_BITS, transform=None):
+    """
+    Exact per-pixel quantiles of an integer 2-D series, from two-level radix histograms instead of the stack of
+    the series: memory is O(pixels x bins), whatever the length of the series (up to 255 values per pixel).
+
+    Pass 1 counts the values of each pixel in coarse bins of 2**`bits` values, which locates the bin of each
+    rank; pass 2 counts the values of that coarse bin only, in its 2**`bits` fine bins, which gives the exact
+    value of the rank. Quantiles interpolate linearly between ranks, as `numpy.nanquantile`.
+    Memory per pixel: one coarse histogram, then one fine histogram per quantile (uint8 counts).
+
+    Parameters
+    ----------
+    read : callable
+        Returns a new iterable of the 2-D blocks of the series (one per observation), for each pass.
+    quantiles : list of float
+        In [0, 1].
+    nodata : int or None
+        Value of the blocks not counted.
+    domain : (int, int)
+        [low, high) of the values ranked exactly; values outside are clamped to it.
+    transform : callable or None
+        Applied to each block (int64) before ranking, e.g. to rank absolute deviations.
+
+    Returns
+    -------
+    list of numpy.ndarray
+        float64 quantile per pixel for each of `quantiles`, NaN where no value is valid.
+    """
+    low, high = domain
+    width = 1 << bits
+    n_coarse = -(-(high - low) // width)
+
+    def codes():
+        # Flat int32 codes (value - low) of each block, -1 where not valid (its coarse bin, -1, matches none)
+        n = 0
+        for values in read():
+            n += 1
+            if n > np.iinfo(np.uint8).max:
+                raise ValueError(f'radix_quantiles counts up to {np.iinfo(np.uint8).max} values per pixel')
+            values = np.asarray(values)
+            x = values.astype('int32') if transform is None else transform(values.astype('int32'))
+            code = np.clip(x, low, high - 1) - low
+            if nodata is not None:
+                code[values == nodata] = -1
+            yield values.shape, code.ravel()
+
+    shape, coarse = None, None
+    for shape, code in codes():
+        if coarse is None:
+            coarse = np.zeros((code.size, n_coarse), dtype='uint8')
+        pix = np.flatnonzero(code >= 0)
+        coarse.reshape(-1)[pix * n_coarse + (code[pix] >> bits)] += 1
+    cum = np.cumsum(coarse, axis=1, dtype='uint8')
+    del coarse
+    count = cum[:, -1].astype('int32')
+    pixels = np.arange(count.size)
+
+    # The lower rank of each quantile (0-based), its coarse bin and its rank within it. The upper rank (+1) is
+    # the next value: in the same fine histogram, or the smallest value of the next coarse bins (`following`).
+    targets = []
+    for q in quantiles:
+        position = q * np.maximum(count - 1, 0)
+        rank = np.floor(position).astype('int32')
+        coarse_bin = np.minimum((cum <= rank[:, None].astype('uint8')).sum(axis=1, dtype='int32'), n_coarse - 1)
+        below = np.where(coarse_bin > 0, cum[pixels, np.maximum(coarse_bin - 1, 0)], 0)
+        targets.append((position - rank, coarse_bin, rank - below))
+    del cum
+
+    fine = [np.zeros((count.size, width), dtype='uint8') for _ in targets]
+    following = [np.full(count.size, high - low, dtype='int32') for _ in targets]
+    for _, code in codes():
+        b = code >> bits
+        for (_, coarse_bin, _), hist, nxt in zip(targets, fine, following):
+            pix = np.flatnonzero(b == coarse_bin)
+            hist.reshape(-1)[pix * width + (code[pix] & (width - 1))] += 1
+            np.minimum(nxt, np.where(b > coarse_bin, code, high - low), out=nxt)
+
+    out = []
+    for (fraction, coarse_bin, residual), hist, nxt in zip(targets, fine, following):
+        cumf = np.cumsum(hist, axis=1, dtype='uint8')
+        lower = coarse_bin * width + np.minimum((cumf <= residual[:, None].astype('uint8')).sum(axis=1, dtype='int32'), width - 1)
+        upper = np.where(
+            residual + 1 < cumf[:, -1],
+            coarse_bin * width + np.minimum((cumf <= (residual[:, None] + 1).astype('uint8')).sum(axis=1, dtype='int32'), width - 1),
+            nxt,
+        )
+        quantile = low + lower + fraction * (upper - lower)
+        out.append(np.where(count > 0, quantile, np.nan).reshape(shape))
+    return out
+
+
+def robust_statistics(read, nodata=None, percentiles=(10, 90), domain=RADIX_DOMAIN):
+    """
+    Exact per-pixel median, MAD (median absolute deviation from the median) and `percentiles` of an integer 2-D
+    series with `radix_quantiles`: 2 passes over `read()` for the median and percentiles, 2 for the MAD.
+    Returns {'median', 'mad', 'p<percentile>'...: float64, NaN where no value is valid}.
+    """
+    quantiles = [0.5] + [p / 100 for p in percentiles]
+    median, *ps = radix_quantiles(read, quantiles, nodata, domain)
+    # Twice the deviations are integers (the median of an even count may end in .5)
+    doubled_median = np.nan_to_num(2 * median).astype('int32')
+    (mad,) = radix_quantiles(
+        read, [0.5], nodata, (0, 2 * (domain[1] - domain[0])), bits=RADIX_BITS + 1,
+        transform=lambda x: np.abs(2 * np.clip(x, domain[0], domain[1] - 1) - doubled_median.reshape(x.shape)),
+    )
+    stats = {'median': median, 'mad': mad / 2}
+    stats.update({f'p{p}': values for p, values in zip(percentiles, ps)})
+    return stats
+
+
+def as_dataarray(values, geobox, name):
+    """2-D array on `geobox` as a named (y, x) DataArray with its CRS and coordinates."""
+    return wrap_xr(values, geobox, nodata=None).rename(name)
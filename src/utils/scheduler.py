@@ -0,0 +1,208 @@
+'''
+######################################################################
+## ARISTOTLE UNIVERSITY OF THESSALONIKI
+## PERSLAB
+## REMOTE SENSING AND EARTH OBSERVATION TEAM
+##
+## DATE:             Oct-2026
+## SCRIPT:           utils/scheduler.py
+## AUTHOR:           Vangelis Fotakidis (fotakidis@topo.auth.gr)
+##
+## DESCRIPTION:      Utility module to run the single-shot CLI jobs of the run_* drivers concurrently
+##                      under a total memory and CPU budget
+##
+#######################################################################
+'''
+
+import json
+import re
+import subprocess
+import time
+from pathlib import Path
+
+import psutil
+
+
+def read_completed_jobs(done_file: Path) -> set:
+    """Read the `admin_completed_geojsons.txt` resume file of a driver."""
+    if done_file.exists():
+        return set(x for x in done_file.read_text().splitlines() if x)
+    return set()
+
+
+def _tile_of(job_key: str):
+    match = re.search(r"x\d+_y\d+", job_key)
+    return match.group(0) if match else None
+
+
+class JobCostHistory:
+    """
+    Recorded peak RSS (MB) of past runs, kept in a JSON file next to the driver logs.
+
+    The memory estimate of a job is, in order of preference:
+      1. the peak RSS recorded for the same job,
+      2. the largest peak RSS recorded for the same tile (footprint, number of MGRS tiles and
+         UTM zones of a tile barely change from month to month),
+      3. the default estimate given by the driver.
+    """
+
+    def __init__(self, path, default_mb):
+        self.path = Path(path) if path else None
+        self.default_mb = default_mb
+        self.peaks = {}
+        if self.path is not None and self.path.exists():
+            self.peaks = json.loads(self.path.read_text())
+
+    def estimate_mb(self, job_key: str) -> float:
+        if job_key in self.peaks:
+            return self.peaks[job_key]
+        tile = _tile_of(job_key)
+        same_tile = [mb for k, mb in self.peaks.items() if tile is not None and _tile_of(k) == tile]
+        if same_tile:
+            return max(same_tile)
+        return self.default_mb
+
+    def record(self, job_key: str, peak_mb: float):
+        self.peaks[job_key] = round(peak_mb, 1)
+
+    def save(self):
+        if self.path is not None:
+            self.path.write_text(json.dumps(self.peaks, indent=2, sort_keys=True))
+
+
+def _tree_rss_mb(proc: subprocess.Popen) -> float:
+    """RSS of a job process and all its children (e.g. the workers of its LocalCluster)."""
+    try:
+        parent = psutil.Process(proc.pid)
+        procs = [parent] + parent.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return 0.0
+
+    rss = 0
+    for p in procs:
+        try:
+            rss += p.memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    return rss / 1024**2
+
+
+def run_jobs_concurrently(
+    jobs,
+    build_command,
+    done_file,
+    log,
+    max_memory_mb=None,
+    max_cpus=None,
+    cpus_per_job=1,
+    history_path=None,
+    default_memory_mb=4096,
+    poll_interval=2.0,
+    rerun=(),
+):
+    """
+    Run single-shot CLI jobs as concurrent subprocesses, admitting a job only while the sum of the
+    memory reserved by running jobs and its own estimate stays within `max_memory_mb`, and the
+    CPUs stay within `max_cpus`. At least one job always runs, so an oversized job cannot stall the run.
+
+    A running job reserves the larger of its estimate and its currently observed RSS. The peak RSS
+    of every successful job is recorded in `history_path` and feeds the estimates of the next runs.
+
+    Resume semantics are those of the sequential drivers: jobs listed in `done_file` are skipped,
+    and a job is appended to `done_file` only once it exits with code 0.
+
+    Parameters
+    ----------
+    jobs : list[str]
+        Job keys (the GeoJSON paths), in the order they should be attempted.
+    build_command : callable
+        Maps a job key to the argv of its subprocess.
+    done_file : pathlib.Path
+        The `admin_completed_geojsons.txt` of the driver.
+    log : logging.Logger
+        Admin logger of the driver.
+    max_memory_mb : float or None
+        Total memory budget. Defaults to 80% of the physical memory.
+    max_cpus : int or None
+        Total CPU budget. Defaults to the number of logical CPUs.
+    cpus_per_job : int
+        CPUs used by a single job (e.g. the Dask workers of a composite).
+    history_path : str or pathlib.Path or None
+        JSON file with the recorded peak RSS of past runs.
+    default_memory_mb : float
+        Estimate for jobs without any recorded history.
+    poll_interval : float
+        Seconds between RSS samples / exit checks.
+    rerun : iterable of str
+        Jobs to run even if they are listed in `done_file` (e.g. composites refreshed incrementally).
+
+    Returns
+    -------
+    dict
+        Number of `completed`, `failed` and `skipped` jobs.
+    """
+    if max_memory_mb is None:
+        max_memory_mb = 0.8 * psutil.virtual_memory().total / 1024**2
+    if max_cpus is None:
+        max_cpus = psutil.cpu_count(logical=True)
+
+    history = JobCostHistory(history_path, default_memory_mb)
+    already_done = read_completed_jobs(done_file) - set(rerun)
+    total = len(jobs)
+
+    pending = []
+    skipped = 0
+    for i, job in enumerate(jobs, 1):
+        if job in already_done:
+            log.info(f"Skip already completed: {job} [{i}/{total}]")
+            skipped += 1
+        else:
+            pending.append((i, job))
+
+    log.info(f"Scheduling {len(pending)} jobs | memory budget: {round(max_memory_mb)} MB | CPU budget: {max_cpus} | CPUs per job: {cpus_per_job}")
+
+    running = {}
+    completed = failed = 0
+    while pending or running:
+        # 1) admit as many pending jobs as the budget allows, in order, back-filling smaller jobs
+        reserved_mb = sum(max(r["estimate_mb"], r["rss_mb"]) for r in running.values())
+        reserved_cpus = cpus_per_job * len(running)
+        for i, job in list(pending):
+            estimate_mb = history.estimate_mb(job)
+            fits = (reserved_mb + estimate_mb <= max_memory_mb) and (reserved_cpus + cpus_per_job <= max_cpus)
+            if running and not fits:
+                continue
+
+            log.info(f"[>] Launching single-shot: {job} [{i}/{total}] | estimate {round(estimate_mb)} MB | {len(running)+1} running")
+            proc = subprocess.Popen(build_command(job))
+            running[job] = dict(i=i, proc=proc, estimate_mb=estimate_mb, rss_mb=0.0, peak_mb=0.0, start=time.time())
+            pending.remove((i, job))
+            reserved_mb += estimate_mb
+            reserved_cpus += cpus_per_job
+
+        # 2) sample memory and collect finished jobs
+        time.sleep(poll_interval)
+        for job, r in list(running.items()):
+            r["rss_mb"] = _tree_rss_mb(r["proc"])
+            r["peak_mb"] = max(r["peak_mb"], r["rss_mb"])
+
+            rc = r["proc"].poll()
+            if rc is None:
+                continue
+
+            del running[job]
+            i = r["i"]
+            elapsed = round(time.time() - r["start"], 1)
+            if rc == 0:
+                with done_file.open("a", encoding="utf-8") as df:
+                    df.write(job + "\n")
+                history.record(job, r["peak_mb"])
+                history.save()
+                completed += 1
+                log.info(f"✔ Processed {job} | peak RSS {round(r['peak_mb'])} MB | {elapsed} s | [{i} / {total}] ({round(100*(i/total),2)}%)")
+            else:
+                failed += 1
+                log.error(f"✖ Failed {job} with exit code {rc} | [{i} / {total}] ({round(100*(i/total),2)}%)")
+
+    log.info(f"Scheduler finished: {completed} completed, {failed} failed, {skipped} skipped")
+    return dict(completed=completed, failed=failed, skipped=skipped)
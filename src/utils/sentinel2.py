@@ -14,10 +14,15 @@
 '''
 
 import logging
+import os
+import sqlite3
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import xml.etree.ElementTree as ET
-from typing import List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 import pystac
 import pandas as pd
@@ -25,10 +30,109 @@ import pandas as pd
 
 import geopandas as gpd
 import numpy as np
+import xarray as xr
 from shapely.geometry import box
+from types import SimpleNamespace
 
+from utils.utils import mkdir
+from utils import spectral_indices
 
-def check_gri_refinement(items: List[pystac.Item]) -> Tuple[List[pystac.Item], pd.DataFrame]:
+
+GRI_CACHE_PATH = "../cache/gri_refinement.sqlite"
+
+# SCL classes masked out: cloud shadows, unclassified, cloud medium/high probability, thin cirrus, snow/ice
+SCL_INVALID_VALUES = [3, 7, 8, 9, 10, 11]
+
+# https://planetarycomputer.microsoft.com/dataset/sentinel-2-l2a#Baseline-Change
+BASELINE400_CUTOVER = pd.Timestamp('2022-01-25')
+BASELINE400_OFFSET = 1000
+
+
+class RefinementCache:
+    """
+    Persistent `item_id -> Image_Refining flag` cache in SQLite.
+
+    The refinement flag of a scene never changes, so reruns and neighbouring tiles that share
+    scenes read it from here instead of downloading the datastrip metadata again.
+    Only definitive flags (parsed from a downloaded MTD_DS.xml) are stored.
+    The database is opened in WAL mode so that concurrent jobs can share it.
+    """
+
+    def __init__(self, path=GRI_CACHE_PATH):
+        mkdir(os.path.dirname(path) or ".")
+        self.con = sqlite3.connect(path, timeout=30)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("CREATE TABLE IF NOT EXISTS refinement (item_id TEXT PRIMARY KEY, flag TEXT NOT NULL)")
+        self.con.commit()
+
+    def get_many(self, item_ids: List[str]) -> Dict[str, str]:
+        flags = {}
+        ids = list(item_ids)
+        for k in range(0, len(ids), 500):  # stay below the SQLite variable limit
+            chunk = ids[k:k+500]
+            rows = self.con.execute(
+                f"SELECT item_id, flag FROM refinement WHERE item_id IN ({','.join('?'*len(chunk))})", chunk
+            ).fetchall()
+            flags.update(dict(rows))
+        return flags
+
+    def put_many(self, flags: Dict[str, str]):
+        with self.con:
+            self.con.executemany("INSERT OR REPLACE INTO refinement (item_id, flag) VALUES (?, ?)", flags.items())
+
+    def close(self):
+        self.con.close()
+
+
+def _datastrip_metadata_href(item: pystac.Item):
+    for asset_key, asset_data in item.assets.items():
+        if "datastrip-metadata" in asset_key.lower(): # and asset_data.href.endswith(".xml"):
+            return asset_data.href
+    return None
+
+
+def _http_session(max_workers: int, retries: int) -> requests.Session:
+    """Session with a connection pool sized to the number of fetch threads, and retries with backoff."""
+    retry = Retry(
+        total=retries,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+    )
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def _fetch_refining_flag(session: requests.Session, url: str, timeout: float) -> str:
+    """Download a datastrip MTD_DS.xml and return its Image_Refining flag."""
+    try:
+        xml_response = session.get(url, timeout=timeout)
+    except requests.RequestException as exc:
+        logging.warning(f"Failed to fetch {url.split('?')[0]}: {exc}")
+        return "Fetch Failed"
+    if xml_response.status_code != 200:
+        return "Fetch Failed"
+
+    try:
+        root = ET.fromstring(xml_response.content)
+    except ET.ParseError as exc:
+        logging.warning(f"Malformed datastrip metadata at {url.split('?')[0]}: {exc}")
+        return "Fetch Failed"
+    refining_element = root.find(".//Geometric_Info/Image_Refining")
+    return refining_element.get("flag") if refining_element is not None else "Not Found"
+
+
+def check_gri_refinement(
+    items: List[pystac.Item],
+    max_workers: int = 16,
+    retries: int = 5,
+    timeout: float = 60,
+    cache_path: Optional[str] = GRI_CACHE_PATH,
+    sign_href: Optional[Callable[[str], str]] = None,
+) -> Tuple[List[pystac.Item], pd.DataFrame]:
     """ Function to search whether the provided scene is refined via GRI or not.
     Regarding mis-registration (as observed in 2023 vs 2024):
     See: https://forum.step.esa.int/t/geometric-gri-refinement-in-sentinel-2-level-1c-early-images-below-pb-3-0/44024/2
@@ -41,63 +145,73 @@ def check_gri_refinement(items: List[pystac.Item]) -> Tuple[List[pystac.Item], p
        <RGM>COMPUTED</RGM>
        <Image_Refining flag="REFINED">
 
+    Flags are first looked up in the persistent cache; the remaining datastrip files are downloaded
+    concurrently over a pooled HTTP session (bounded by `max_workers`, with retries).
+
     Args:
         items (List[pystac.Item]):List of pystac.item.Item from pystac_client.item_search.ItemSearch
+        max_workers (int): Maximum number of concurrent downloads
+        retries (int): Retries per download on connection errors and 429/5xx responses
+        timeout (float): Timeout of a single download in seconds
+        cache_path (str or None): SQLite file of the refinement cache. None disables the cache.
+        sign_href (callable or None): Signs a datastrip href before download (e.g. planetary_computer.sign),
+            for items returned unsigned by the catalog
 
     Returns:
         Tuple:
             - List[pystac.Item], List of pystac.Item objects with REFINED status and
             - pd.DataFrame, DataFrame with refinement status for each item
     """
+    cache = RefinementCache(cache_path) if cache_path else None
+    try:
+        flags = cache.get_many([item.id for item in items]) if cache else {}
+        cached = set(flags)
+        logging.info(f"{len(flags)}/{len(items)} refinement flags found in cache")
+
+        # Fetch XML content of the items missing from the cache
+        to_fetch = {}
+        for item in items:
+            if item.id in flags:
+                continue
+            datastrip_metadata_url = _datastrip_metadata_href(item)
+            if datastrip_metadata_url:
+                to_fetch[item.id] = sign_href(datastrip_metadata_url) if sign_href else datastrip_metadata_url
+            else:
+                # log.info("datastrip_metadata.xml not found in STAC item")
+                flags[item.id] = "Metadata Not Found"
+
+        if to_fetch:
+            session = _http_session(max_workers, retries)
+            with session, ThreadPoolExecutor(max_workers=max_workers) as pool:
+                futures = {
+                    pool.submit(_fetch_refining_flag, session, url, timeout): item_id
+                    for item_id, url in to_fetch.items()
+                }
+                fetched = {futures[f]: f.result() for f in as_completed(futures)}
+            flags.update(fetched)
+
+            if cache:
+                cache.put_many({k: v for k, v in fetched.items() if v != "Fetch Failed"})
+    finally:
+        if cache:
+            cache.close()
+
     refined_items = []
     refinement_data = []
-
-    # Loop through items and extract `Image_Refining` flag
-    
     for i, item in enumerate(items):
-        datastrip_metadata_url = None
-        for asset_key, asset_data in items[0].assets.items():
-            if "datastrip-metadata" in asset_key.lower(): # and asset_data.href.endswith(".xml"):
-                # datastrip_metadata_url = planetary_computer.sign(asset_data.href)
-                datastrip_metadata_url = asset_data.href
-                break
-
-        if datastrip_metadata_url:
-            # log.info(f"Processing: {datastrip_metadata_url}")
-            # logging.info(f"Processing: {item.id}") #log.info(f"Processing: {datastrip_metadata_url}")
-
-            # Fetch XML content
-            xml_response = requests.get(datastrip_metadata_url)
-            if xml_response.status_code == 200:
-                root = ET.fromstring(xml_response.content)
-
-                # Extract Image_Refining flag
-                refining_element = root.find(".//Geometric_Info/Image_Refining")
-                refining_flag = refining_element.get("flag") if refining_element is not None else "Not Found"
-
-                logging.info(f"{i+1}/{len(items)} - {item.id} -> {refining_flag}")
-
-                # Store item and status in dataframe
-                refinement_data.append({
-                    "item_id": item.id,
-                    "refinement_status": refining_flag
-                })
-
-                # Append to refined_items if the flag is 'REFINED'
-                if refining_flag == "REFINED":
-                    refined_items.append(item)
-            else:
-                # log.info(f"Failed to fetch XML: {xml_response.status_code}")
-                refinement_data.append({
-                    "item_id": item.id,
-                    "refinement_status": "Fetch Failed"
-                })
-        else:
-            # log.info("datastrip_metadata.xml not found in STAC item")
-            refinement_data.append({
-                "item_id": item.id,
-                "refinement_status": "Metadata Not Found"
-            })
+        refining_flag = flags[item.id]
+        source = "cached" if item.id in cached else "fetched" if item.id in to_fetch else "no datastrip metadata in the STAC item"
+        logging.info(f"{i+1}/{len(items)} - {item.id} -> {refining_flag} ({source})")
+
+        # Store item and status in dataframe
+        refinement_data.append({
+            "item_id": item.id,
+            "refinement_status": refining_flag
+        })
+
+        # Append to refined_items if the flag is 'REFINED'
+        if refining_flag == "REFINED":
+            refined_items.append(item)
 
     # Create a DataFrame
     df_refinement_status = pd.DataFrame(refinement_data)
@@ -118,7 +232,7 @@ def mask_with_scl(ds, bands):
     # - 9: cloud high probability
     # - 10: thin cirrus
     # - 11: snow or ice
-    invalid_scl_values = [3, 7, 8, 9, 10, 11]
+    invalid_scl_values = SCL_INVALID_VALUES
     logging.info(f'               Masking bits: {invalid_scl_values}')
     cloud_binary_mask = ds.SCL.isin(invalid_scl_values)
 
@@ -128,7 +242,89 @@ def mask_with_scl(ds, bands):
     return ds
 
 
-def plot_mgrs_tiles_with_aoi(filtered_items, aoi_bbox, save_path=None):    
+PIXEL_KERNEL_BANDS = ['B02', 'B03', 'B04', 'B05', 'B07', 'B8A']
+PIXEL_KERNEL_INDICES = {'EVI': (-1, 1), 'NDVI': (-1, 1), 'PSRI2': (-1, 4)}
+
+
+def s2_pixel_kernel(post_cutover, b02, b03, b04, b05, b07, b8a, scl=None):
+    """
+    Fused per-pixel kernel on plain (numpy) blocks of raw L2A DN, 0 being NoData:
+      1. subtract the Sen2Cor 4.00 offset on scenes flagged in `post_cutover` (values <= offset become NoData),
+      2. keep 0 < DN <= 12000 and, if `scl` is given, the SCL classes not in SCL_INVALID_VALUES,
+      3. compute EVI, NDVI and PSRI2 with `utils.spectral_indices` and clip them to their typical range.
+
+    Blocks are (time, y, x) and `post_cutover` holds one flag per scene (any shape that flattens to
+    (T,) or a single flag). The outputs are allocated once and filled scene by scene, so the
+    temporaries of the arithmetic never exceed one (y, x) slice. The masked bands are float32 (their
+    values are integers, so this is exact) and the indices are computed from them in float32, with
+    no per-scene float64 copies. The former chain of xarray passes computed the indices in float64
+    (`ds.where(ds > 0, np.nan)` promotes the uint16 bands to float64) and cast them to float32: the
+    bands, NDVI and PSRI2 are equal to it, EVI differs by float32 rounding (up to ~1e-4 where its
+    denominator is small, so a few pixels at the edges of its clip range change between value and NaN).
+
+    Returns
+    -------
+    tuple[np.ndarray]
+        The six masked bands (float32, NaN for NoData) followed by EVI, NDVI, PSRI2 (float32).
+    """
+    raw = dict(zip(PIXEL_KERNEL_BANDS, (b02, b03, b04, b05, b07, b8a)))
+    post_cutover = np.broadcast_to(np.asarray(post_cutover).reshape(-1), b02.shape[:1])
+    names = PIXEL_KERNEL_BANDS + list(PIXEL_KERNEL_INDICES)
+    out = {name: np.empty(b02.shape, dtype=np.float32) for name in names}
+
+    def scene_bands(t, *bands):
+        return SimpleNamespace(**{b: out[b][t] for b in bands})
+
+    for t in range(b02.shape[0]):
+        offset = np.float32(BASELINE400_OFFSET if post_cutover[t] else 0)
+        invalid = None if scl is None else np.isin(scl[t], SCL_INVALID_VALUES)
+
+        for name, band in raw.items():
+            x = out[name][t]
+            np.subtract(band[t], offset, out=x, dtype=np.float32)
+            drop = ~((x > 0) & (x <= 12000))
+            if invalid is not None:
+                drop |= invalid
+            x[drop] = np.nan
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out['EVI'][t] = spectral_indices.evi(scene_bands(t, 'B02', 'B04', 'B8A'))
+            out['NDVI'][t] = spectral_indices.ndvi(scene_bands(t, 'B04', 'B8A'))
+            out['PSRI2'][t] = spectral_indices.psri2(scene_bands(t, 'B03', 'B05', 'B07'))
+
+        for si, (lo, hi) in PIXEL_KERNEL_INDICES.items():
+            x = out[si][t]
+            x[~((x >= lo) & (x <= hi))] = np.nan
+
+    return tuple(out[name] for name in names)
+
+
+def apply_s2_pixel_kernel(ds, scl=None):
+    """
+    Apply `s2_pixel_kernel` to the uint16 bands of a (time,y,x) Dataset in a single pass, block
+    by block on dask inputs. The Sen2Cor 4.00 offset is applied to scenes after BASELINE400_CUTOVER.
+
+    Returns
+    -------
+    xr.Dataset
+        Masked bands and EVI/NDVI/PSRI2, float32 with NaN for NoData.
+    """
+    post_cutover = ds.time > BASELINE400_CUTOVER
+    inputs = [post_cutover] + [ds[b] for b in PIXEL_KERNEL_BANDS] + ([scl] if scl is not None else [])
+    names = PIXEL_KERNEL_BANDS + list(PIXEL_KERNEL_INDICES)
+
+    outputs = xr.apply_ufunc(
+        s2_pixel_kernel,
+        *inputs,
+        output_core_dims=[[]]*len(names),
+        dask='parallelized',
+        output_dtypes=[np.float32]*len(names),
+    )
+    out = xr.Dataset(dict(zip(names, outputs)))
+    return out.transpose('time', 'y', 'x')
+
+
+def plot_mgrs_tiles_with_aoi(filtered_items, aoi_bbox, save_path=None, dpi=300):    
     # https://gist.github.com/scottyhq/ed8247f3ae1d42543f7bbfb02a5fa8ad
     """
     Plot MGRS tiles from a STAC ItemCollection with an AOI bbox overlay.
@@ -144,6 +340,8 @@ def plot_mgrs_tiles_with_aoi(filtered_items, aoi_bbox, save_path=None):
     save_path : str or None
         If None, plot will be displayed in the current cell.
         If a string, the plot will be saved at that location (JPEG, 300 DPI).
+    dpi : int
+        Resolution of the saved JPEG.
     """
     
     import matplotlib
@@ -222,7 +420,7 @@ def plot_mgrs_tiles_with_aoi(filtered_items, aoi_bbox, save_path=None):
     # Save or show
     if save_path:
         logging.info(f'Write input scenes footprint overlay: {save_path}')
-        fig.savefig(save_path, format='jpeg', dpi=300, bbox_inches='tight')
+        fig.savefig(save_path, format='jpeg', dpi=dpi, bbox_inches='tight')
         plt.close(fig)
     else:
         plt.show()
\ No newline at end of file
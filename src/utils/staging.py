@@ -0,0 +1,161 @@
+'''
+######################################################################
+## ARISTOTLE UNIVERSITY OF THESSALONIKI
+## PERSLAB
+## REMOTE SENSING AND EARTH OBSERVATION TEAM
+##
+## DATE:             Oct-2026
+## SCRIPT:           utils/staging.py
+## AUTHOR:           Vangelis Fotakidis (fotakidis@topo.auth.gr)
+##
+## DESCRIPTION:      Utility module to stage the files of a dataset on local scratch disk, verify them, and
+##                      publish the dataset directory to the NAS collection tree by rename
+##
+#######################################################################
+'''
+
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import rasterio
+
+
+def file_checksum(path, chunk_size=4 * 1024**2):
+    """SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def verify_cog(path):
+    """Raise RuntimeError unless `path` is a readable, tiled GeoTIFF: reads its last block and its smallest overview."""
+    try:
+        with rasterio.open(path) as src:
+            if src.block_shapes[0][1] == src.width and src.width > 512:
+                raise RuntimeError(f'{path} is not tiled')
+            src.read(1, window=rasterio.windows.Window(src.width - 1, src.height - 1, 1, 1))
+            overviews = src.overviews(1)
+            if overviews:
+                src.read(1, out_shape=(max(1, src.height // overviews[-1]), max(1, src.width // overviews[-1])))
+    except rasterio.errors.RasterioError as exc:
+        raise RuntimeError(f'{path} is not a readable GeoTIFF: {exc}') from exc
+
+
+class StagedDataset:
+    """
+    Directory of ONE dataset (`<nas_root>/<folder>`), written first to `<scratch_root>/<folder>` on fast local disk.
+
+    - Write every file of the dataset under `local_path`. Read existing files (e.g. a previous scene stack) from `final_path`.
+    - `verify` checksums the files and checks that the GeoTIFFs are readable COGs.
+    - `publish` copies the directory next to its final location on the NAS (`.<name>.partial-<id>`), checks the copies
+      against the checksums, then renames it into place, so readers never see a partially copied dataset. A dataset
+      already there (re-run, incremental update) is first renamed aside (`.<name>.old-<id>`) and deleted once the new
+      one is in place: this replacement is two renames, NOT atomic, and `final_path` is briefly missing between them
+      (SMB has no atomic directory exchange). The local copy is removed once published; on failure it is kept and
+      the partial copy removed.
+
+    With `scratch_root=None` nothing is staged: `local_path` is `final_path`, and `verify`/`publish` do nothing.
+    """
+
+    def __init__(self, nas_root, folder, scratch_root=None):
+        self.final_path = f'{nas_root}/{folder}'
+        self.staged = scratch_root is not None
+        self.local_path = f'{scratch_root}/{folder}' if self.staged else self.final_path
+        self.checksums = {}
+        os.makedirs(self.local_path, exist_ok=True)
+
+    def verify(self):
+        if not self.staged:
+            return
+        t0 = time.time()
+        self.checksums = {}
+        for name in sorted(os.listdir(self.local_path)):
+            path = f'{self.local_path}/{name}'
+            if name.lower().endswith('.tif'):
+                verify_cog(path)
+            self.checksums[name] = file_checksum(path)
+        logging.info(f'Verified {len(self.checksums)} staged files in {self.local_path} in {round(time.time() - t0, 1)} s')
+
+    def publish(self, max_workers=8):
+        if not self.staged:
+            return
+        if not self.checksums:
+            self.verify()
+        t0 = time.time()
+        parent, name = os.path.split(self.final_path)
+        os.makedirs(parent, exist_ok=True)
+        partial = f'{parent}/.{name}.partial-{uuid.uuid4().hex[:8]}'
+        os.makedirs(partial)
+        try:
+            # small files dominate on SMB: copy them concurrently to overlap the per-file latency
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                list(pool.map(lambda n: shutil.copyfile(f'{self.local_path}/{n}', f'{partial}/{n}'), self.checksums))
+            for n, checksum in self.checksums.items():
+                if file_checksum(f'{partial}/{n}') != checksum:
+                    raise RuntimeError(f'Checksum mismatch of {n} copied to {partial}')
+
+            if os.path.exists(self.final_path):
+                previous = f'{parent}/.{name}.old-{uuid.uuid4().hex[:8]}'
+                os.rename(self.final_path, previous)
+                try:
+                    os.rename(partial, self.final_path)
+                except Exception:
+                    os.rename(previous, self.final_path)        # put the previous dataset back
+                    raise
+                shutil.rmtree(previous, ignore_errors=True)
+            else:
+                os.rename(partial, self.final_path)
+        except Exception:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+
+        size = sum(os.path.getsize(f'{self.local_path}/{n}') for n in self.checksums)
+        shutil.rmtree(self.local_path, ignore_errors=True)
+        logging.info(f'Published {len(self.checksums)} files ({round(size/1024**2, 1)} MiB) to {self.final_path} in {round(time.time() - t0, 1)} s')
+
+    def discard(self):
+        """Remove the staged files (nothing was produced, or the job failed)."""
+        if self.staged:
+            shutil.rmtree(self.local_path, ignore_errors=True)
+
+
+class Publisher:
+    """
+    Runs the publish (and index) step of each job in a background thread, so the transfer of a dataset to the NAS
+    overlaps the compute of the next job. At most `max_pending` datasets wait on scratch: `submit` blocks beyond that.
+    The Future returned by `submit` resolves to the return value of `fn`.
+    """
+
+    def __init__(self, max_pending=2):
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='publisher')
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+
+    def submit(self, fn, label):
+        self._slots.acquire()
+        def run():
+            try:
+                return fn()
+            except Exception:
+                logging.exception(f'Publishing {label} failed')
+                raise
+            finally:
+                self._slots.release()
+        future = self._pool.submit(run)
+        self._futures.append(future)
+        logging.info(f'Queued {label} for publishing')
+        return future
+
+    def close(self):
+        """Wait for all queued datasets to be published."""
+        self._pool.shutdown(wait=True)
+        failed = sum(1 for f in self._futures if f.exception() is not None)
+        logging.info(f'Publisher: {len(self._futures) - failed} datasets published, {failed} failed')
@@ -13,7 +13,10 @@
 #######################################################################
 '''
 
+import datetime
 import logging
+import os
+from functools import lru_cache
 import odc.geo
 
 import pystac_client
@@ -25,15 +28,46 @@ import numpy as np
 
 from rasterio.enums import Resampling
 from utils.downsample import s2_downsample_dataset_10m_to_20m
-from utils.sentinel2 import mask_with_scl
+from utils.sentinel2 import mask_with_scl, SCL_INVALID_VALUES
+from utils.cog_cache import route_items_through_cache
 
 import gc
 
 
 BANDS_R10m = ['B02', 'B03', 'B04']
 BANDS_R20m = ['B05', 'B07', 'B8A', 'SCL']
+RESAMPLING_R10m_TO_R20m = {**{band: 'average' for band in BANDS_R10m}, '*': 'nearest'}
+RESAMPLING_TO_TILE = {**{band: 'average' for band in BANDS_R10m}, 'SCL': 'nearest', '*': 'bilinear'}
 
+
+class CountingStacApiIO(StacApiIO):
+    """StacApiIO that counts the HTTP round-trips made to the STAC catalog (landing page, search pages)."""
+    roundtrips = 0
+    searches = 0
+
+    def request(self, href, *args, **kwargs):
+        CountingStacApiIO.roundtrips += 1
+        if href.rstrip('/').endswith('/search'):
+            CountingStacApiIO.searches += 1
+        return super().request(href, *args, **kwargs)
+
+
+def reset_stac_roundtrips():
+    CountingStacApiIO.roundtrips = 0
+    CountingStacApiIO.searches = 0
+
+
+def log_stac_roundtrips():
+    logging.info(f'STAC catalog round-trips of this job: {CountingStacApiIO.roundtrips} (search requests: {CountingStacApiIO.searches})')
+
+
+@lru_cache(maxsize=None)
 def connect_to_STAC_catalog(catalog_endpoint="planetary_computer"):
+    """
+    Open a client to a STAC catalog. Clients are cached per endpoint for the lifetime of the process,
+    so all searches of a job (and of the following jobs on a shared worker pool) reuse the same
+    client and its HTTP session. Items are returned unsigned; they are signed right before loading.
+    """
     # Open a client 
     retry = Retry(
         total=10,
@@ -42,7 +76,7 @@ def connect_to_STAC_catalog(catalog_endpoint="planetary_computer"):
         allowed_methods=None, # {*} for CORS
     )
         
-    stac_api_io = StacApiIO(max_retries=retry)
+    stac_api_io = CountingStacApiIO(max_retries=retry)
 
     logging.info("        Initialize the STAC client")
     if catalog_endpoint=='planetary_computer':
@@ -69,19 +103,15 @@ def connect_to_STAC_catalog(catalog_endpoint="planetary_computer"):
     return catalog
 
 
-def refetch_S2L2A_items_from_catalog(epsg_filtered_items):
-    catalog = connect_to_STAC_catalog(catalog_endpoint="planetary_computer")
-    ids = [item.id for item in epsg_filtered_items]
-    search = catalog.search(
-        ids=ids,
-        collections=["sentinel-2-l2a"],  # optional but recommended
-        limit=len(ids)
-    )
-
-    return search.item_collection()
-
-
-def odc_stac_load_Items(unsigned_items, aoi_bbox, bands, epsg, resolution):
+def odc_stac_load_Items(unsigned_items, aoi_bbox, bands, epsg, resolution, resampling=None, compute=True, geobox=None, groupby='time'):
+    """
+    Sign and load STAC items with odc.stac. With `compute=False` the dask-backed dataset is returned
+    as is (nothing is read until it is computed). `resampling` is passed to odc.stac per band, e.g.
+    {"B02": "average", "*": "nearest"}. If `geobox` is given, the items are loaded straight onto it
+    and `aoi_bbox`, `epsg` and `resolution` are ignored. `groupby` is passed to odc.stac ('time' merges
+    items with the same timestamp). If the COG block cache is enabled (`utils.cog_cache.start_cog_cache`),
+    all reads go through it.
+    """
     # Harden GDAL before odc/rasterio touch anything networky
     import os
     os.environ.setdefault("GDAL_HTTP_TIMEOUT", "30")
@@ -94,32 +124,146 @@ def odc_stac_load_Items(unsigned_items, aoi_bbox, bands, epsg, resolution):
     import planetary_computer as pc
     import odc.stac
     
-    signed_items = [pc.sign(it) for it in unsigned_items]
-    return odc.stac.stac_load(
+    signed_items = route_items_through_cache([pc.sign(it) for it in unsigned_items])
+    if geobox is not None:
+        grid = dict(geobox=geobox)
+    else:
+        grid = dict(
+            bbox=aoi_bbox,
+            crs=f'EPSG:{epsg}',  # {epsgs[0]}
+            resolution=resolution,
+        )
+    ds = odc.stac.stac_load(
         signed_items,
-        bbox=aoi_bbox,
         bands=bands,
         chunks=dict(y=512, x=1024),
-        crs=f'EPSG:{epsg}',  # {epsgs[0]}
-        resolution=resolution,
-        groupby='time', # if 'time' loads all items, retaining duplicates
+        groupby=groupby, # if 'time' loads all items, retaining duplicates
         fail_on_error=False,
-        # resampling={
-        #     "*": RESAMPLING_ALGO,
-        # },
-    ).compute()
+        resampling=resampling,
+        **grid,
+    )
+    return ds.compute() if compute else ds
     
 
-def process_epsg(filtered_items, aoi_bbox, EPSG):
+# SCL classes counted as a clear observation: dark area pixels, vegetation, bare soils, water
+SCL_CLEAR_VALUES = [v for v in range(2, 12) if v not in SCL_INVALID_VALUES]
+
+
+def tile_clear_masks(unsigned_items, tile_geobox, tile_geom, resolution=320):
+    """
+    Clear-pixel masks of each item over the tile, from a coarse read of its SCL asset only.
+
+    SCL is loaded with nearest resampling on the tile GeoBox zoomed out to `resolution` metres,
+    so GDAL serves it from a COG overview and reads a few blocks per scene instead of the full
+    20 m band. One layer per item, in the order of `unsigned_items`.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Boolean (n_items, y, x) clear masks and the (y, x) mask of the pixels inside `tile_geom`.
+    """
+    from odc.geo.xr import rasterize
+
+    lowres_geobox = tile_geobox.zoom_out(resolution / abs(tile_geobox.resolution.x))
+    scl = odc_stac_load_Items(
+        unsigned_items, None, ['SCL'], None, None,
+        resampling='nearest',
+        compute=True,
+        geobox=lowres_geobox,
+        groupby=lambda item, parsed, idx: idx,  # one layer per item, in input order
+    ).SCL.values
+
+    inside = rasterize(tile_geom.to_crs(lowres_geobox.crs), lowres_geobox).values.astype(bool)
+    clear = np.isin(scl, SCL_CLEAR_VALUES) & inside
+    return clear, inside
+
+
+def greedy_clear_coverage(clear, inside, target_obs=3, target_fraction=0.95, max_scenes=None):
+    """
+    Greedy weighted set cover: repeatedly pick the scene that adds the most clear observations
+    to pixels that still have fewer than `target_obs`, until `target_fraction` of the pixels
+    inside the tile reach `target_obs` clear observations, no scene adds any, or `max_scenes`
+    are picked.
+
+    Returns
+    -------
+    list[int]
+        Indices of the picked scenes, in the order they were picked.
+    """
+    count = np.zeros(inside.shape, dtype=np.int32)
+    n_inside = max(int(inside.sum()), 1)
+    remaining = list(range(clear.shape[0]))
+    picked = []
+
+    while remaining and (max_scenes is None or len(picked) < max_scenes):
+        if (count[inside] >= target_obs).sum() / n_inside >= target_fraction:
+            break
+        needs = count < target_obs
+        gains = [int((clear[i] & needs).sum()) for i in remaining]
+        best = int(np.argmax(gains))
+        if gains[best] == 0:
+            break
+        i = remaining.pop(best)
+        picked.append(i)
+        count += clear[i]
+    return picked
+
+
+def coverage_summary(clear, inside, picked, target_obs):
+    """Fraction of tile pixels with >= `target_obs` clear observations, and the mean count, for a scene subset."""
+    count = clear[list(picked)].sum(axis=0) if len(picked) else np.zeros(inside.shape, dtype=int)
+    return float((count[inside] >= target_obs).mean()), float(count[inside].mean())
+
+
+def process_epsg(filtered_items, aoi_bbox, EPSG, lazy=False, geobox=None):
+    """
+    Load and SCL-mask the items of one native UTM zone at 20 m. `filtered_items` are the (unsigned)
+    items of the job's single catalog search; they are reused for both resolution passes.
+
+    With `lazy=True` all seven bands are loaded in a single dask graph on the 20 m grid, the 10 m
+    bands being averaged at read time, and the SCL mask is applied chunk-wise. Nothing is
+    materialised, so peak memory follows the chunk size rather than scenes x buffered AOI.
+
+    With a `geobox` (e.g. the EPSG:3035 tile GeoBox) the bands are loaded straight onto it in a single
+    pass: 10 m bands by average, 20 m bands by bilinear and SCL by nearest resampling, reading only
+    the source blocks that intersect the geobox. No UTM intermediate is produced, so the result
+    needs no further reprojection.
+    """
     
     logging.info(f'                                 ')
     logging.info(f'Loading bands of diferent resolutions in EPSG:{EPSG}')
     
     processed_bands = []
-    geobox = None
     logging.info(f'    Filtering items with native UTM EPSG:{EPSG}')
     epsg_filtered_items = [item for item in filtered_items if item.properties['proj:epsg']==EPSG]
     logging.info(f'    {len(epsg_filtered_items)} Items in EPSG:{EPSG}')
+    
+    if lazy or geobox is not None:
+        BANDS = BANDS_R10m + BANDS_R20m
+        logging.info('    Single-pass loading parameters:')
+        logging.info(f'        Bands: {BANDS}')
+        if geobox is not None:
+            logging.info(f'        Target grid: {geobox.crs} {geobox.shape} at {geobox.resolution} (no UTM intermediate)')
+            resampling = RESAMPLING_TO_TILE
+        else:
+            logging.info(f'        Spatial resolution: 20 (10m bands by Resampling.average at read time)')
+            resampling = RESAMPLING_R10m_TO_R20m
+        ds_epsg = odc_stac_load_Items(
+            epsg_filtered_items, 
+            aoi_bbox, 
+            BANDS, 
+            EPSG,
+            20,
+            resampling=resampling,
+            compute=not lazy,
+            geobox=geobox,
+        )
+        ds_epsg = ds_epsg[['time','y','x']+BANDS]
+        
+        logging.info(f'    Apply masks on clouds, shadows, thin cirrus, and snow/ice')
+        return mask_with_scl(ds_epsg, list(BANDS))
+    
+    geobox_r20m = None      # set by the 20m pass, which runs before the 10m one
     for RESOLUTION in [20, 10]:
         if RESOLUTION==10:
             BANDS=BANDS_R10m
@@ -131,12 +275,9 @@ def process_epsg(filtered_items, aoi_bbox, EPSG):
         logging.info(f'        Bands: {BANDS}')
         logging.info(f'        Spatial resolution: {RESOLUTION}')
 
-        logging.info(f'        Get Assets from STAC Items')
-        assets_to_load = refetch_S2L2A_items_from_catalog(epsg_filtered_items)
-        
         logging.info(f'        Loading {len(epsg_filtered_items)} STAC Items....')
         ds_cube = odc_stac_load_Items(
-            assets_to_load, 
+            epsg_filtered_items, 
             aoi_bbox, 
             BANDS, 
             EPSG,
@@ -150,12 +291,12 @@ def process_epsg(filtered_items, aoi_bbox, EPSG):
             # ds_cube = s2_downsample_dataset_10m_to_20m(ds_cube)
             # RESAMPLING_ALGO = "average" # not the same as rasterio.enums.Resampling.average
             # logging.info(f'        Align binned bands to native 20m bands (shape matching): method={RESAMPLING_ALGO}')
-            # ds_bands = ds_cube.odc.reproject(how=geobox, resampling=RESAMPLING_ALGO)
-            ds_bands = ds_cube.odc.reproject(how=geobox, resampling=Resampling.average) #, dst_nodata=0)
+            # ds_bands = ds_cube.odc.reproject(how=geobox_r20m, resampling=RESAMPLING_ALGO)
+            ds_bands = ds_cube.odc.reproject(how=geobox_r20m, resampling=Resampling.average) #, dst_nodata=0)
         elif RESOLUTION==20:
             logging.info('        Fix order of dimensions')
             ds_bands = ds_cube[['time','y','x']+list(ds_cube.data_vars)]
-            geobox = ds_cube.odc.geobox
+            geobox_r20m = ds_cube.odc.geobox
         
         del ds_cube
         logging.info(f'        Append bands to the band-list of EPSG:{EPSG}')
@@ -196,6 +337,31 @@ def process_epsg(filtered_items, aoi_bbox, EPSG):
     return ds_epsg_masked
 
 
+def _sum_dtype(dtype):
+    """Accumulator dtype of a running sum: uint32 for uint8/uint16 bands, int64/float64 otherwise."""
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.unsignedinteger) and dtype.itemsize <= 2:
+        return np.uint32
+    if np.issubdtype(dtype, np.integer):
+        return np.int64
+    return np.float64
+
+
+def _fold_nodata0(acc, data, method):
+    """
+    Fold one source into the running accumulator(s) of `merge_nodata0`, 0 being NoData.
+    Works on numpy and dask arrays alike (element-wise, so dask folds chunk by chunk).
+    """
+    if method == "mean":
+        total, count = acc
+        total = total + data.astype(total.dtype)
+        count = count + (data != 0).astype(np.uint8)
+        return total, count
+
+    pick = np.maximum if method == "max" else np.minimum
+    return np.where(acc == 0, data, np.where(data == 0, acc, pick(acc, data)))
+
+
 def merge_nodata0(
     datasets, 
     vars_mode="intersection", 
@@ -203,6 +369,116 @@ def merge_nodata0(
     chunks=None
 ):
     """
+    Merge multiple xarray Datasets on time,y,x where:
+      - union of times is used
+      - 0 is treated as NoData (ignored)
+      - overlaps are combined using the given method (max, mean, min)
+      - result preserves original integer dtype (0 for NoData)
+
+    The sources are folded one at a time into running accumulators in their own dtype
+    (max/min), or into a sum (uint32 for uint16 bands) and a uint8 count (mean), with 0 as the
+    NoData sentinel. No float copies and no stacked `source` dimension are allocated, and dask
+    inputs stay lazy and are reduced chunk by chunk. The mean is truncated to the band dtype,
+    as the float path did. For the median use `merge_nodata0_stacked`.
+
+    Parameters
+    ----------
+    datasets : list[xr.Dataset]
+        Input datasets. Must be on the same grid (x,y) and share coordinates when times overlap.
+    vars_mode : {"intersection", "union"}
+        Which set of data variables to merge.
+    method : {"max", "mean", "min"}
+        Aggregation method for overlaps.
+    chunks : dict or "auto" or None
+        Optional dask chunking to apply to the result.
+
+    Returns
+    -------
+    xr.Dataset
+        Merged dataset with union time and aggregated overlaps.
+    """
+    if len(datasets) == 0:
+        raise ValueError("Provide at least one dataset")
+    if method == "median":
+        raise ValueError("method='median' needs all sources at once: use merge_nodata0_stacked")
+    if method not in ("max", "mean", "min"):
+        raise ValueError("method must be one of: 'max', 'mean', 'min'")
+    if method == "mean" and len(datasets) > np.iinfo(np.uint8).max:
+        raise ValueError(f"At most {np.iinfo(np.uint8).max} datasets can be averaged (uint8 count)")
+
+    # 1) Union of times
+    all_times = np.unique(np.concatenate([ds["time"].values for ds in datasets]))
+
+    # 2) Variable selection
+    if vars_mode == "intersection":
+        var_names = set(datasets[0].data_vars)
+        for ds in datasets[1:]:
+            var_names &= set(ds.data_vars)
+    elif vars_mode == "union":
+        var_names = set()
+        for ds in datasets:
+            var_names |= set(ds.data_vars)
+    else:
+        raise ValueError("vars_mode must be 'intersection' or 'union'")
+
+    # Only keep 3D (time,y,x) vars
+    def is_band(da):
+        return set(da.dims) == {"time", "y", "x"}
+
+    var_names = [v for v in var_names if v in datasets[0] and is_band(datasets[0][v])]
+
+    # 3) Fold each variable, one source at a time
+    merged = {}
+    for v in var_names:
+        reference = None
+        acc = None
+        for ds in datasets:
+            if v not in ds:
+                continue
+            # align on union of times; integer dtype is kept by filling with the 0 sentinel
+            da = ds[v].reindex(time=all_times, fill_value=0).transpose("time", "y", "x")
+            if reference is None:
+                reference = da
+                if method == "mean":
+                    acc = (da.data.astype(_sum_dtype(da.dtype)), (da.data != 0).astype(np.uint8))
+                else:
+                    acc = da.data
+                continue
+
+            if da.shape != reference.shape:
+                raise ValueError(f"'{v}' has shape {da.shape}, expected {reference.shape}: datasets must share the (x,y) grid")
+            acc = _fold_nodata0(acc, da.data, method)
+
+        if method == "mean":
+            total, count = acc
+            # count==0 only where total==0, so dividing by 1 there keeps the 0 NoData
+            divisor = np.maximum(count, 1).astype(total.dtype)
+            acc = total / divisor if np.issubdtype(total.dtype, np.floating) else total // divisor
+
+        merged[v] = reference.copy(data=acc.astype(reference.dtype))
+
+    # 4) Build output dataset
+    reference = datasets[0].reindex(time=all_times, fill_value=0)
+    out = xr.Dataset(merged, coords={c: reference[c] for c in reference.coords})
+
+    if chunks is not None:
+        out = out.chunk(chunks if chunks != "auto" else {})
+
+    return out
+
+
+def merge_nodata0_stacked(
+    datasets, 
+    vars_mode="intersection", 
+    method="median", 
+    chunks=None
+):
+    """
+    Stacked counterpart of `merge_nodata0`, kept for the reducers that need all sources at once
+    (median). Every source is upcast to float with NaN for NoData and concatenated along a new
+    `source` dimension, so memory peaks at N_sources x T x Y x X x 8 bytes per band: opt in
+    explicitly, and prefer `merge_nodata0` for max/mean/min.
+
     Merge multiple xarray Datasets on time,y,x where:
       - union of times is used
       - 0 is treated as NoData (ignored)
@@ -306,6 +582,156 @@ def merge_nodata0(
     return out
 
 
+@lru_cache(maxsize=None)
+def _median_network(n):
+    """
+    Comparators (i, j), i < j, of Batcher's odd-even merge sort for `n` elements, pruned to those
+    that place the lower half (positions 0..n//2), which is all a median with trailing missing
+    values needs. Comparators of the next power of two that touch positions >= n are dropped,
+    as if those positions held +inf.
+    """
+    size = 1
+    while size < n:
+        size *= 2
+
+    pairs = []
+    p = 1
+    while p < size:
+        k = p
+        while k >= 1:
+            for j in range(k % p, size - k, 2*k):
+                for i in range(min(k, size - j - k)):
+                    if (i + j) // (2*p) == (i + j + k) // (2*p):
+                        pairs.append((i + j, i + j + k))
+            k //= 2
+        p *= 2
+
+    needed, kept = set(range(n//2 + 1)), []
+    for i, j in reversed([(i, j) for i, j in pairs if j < n]):
+        if i in needed or j in needed:
+            kept.append((i, j))
+            needed |= {i, j}
+    return tuple(reversed(kept))
+
+
+def _nanmedian_last_axis(values, integral=False):
+    """
+    NaN-aware median over the last axis of a float block, bit-identical to np.nanmedian
+    (the mean of the two middle values is computed in the input dtype).
+
+    The series are moved to the first axis, NaN replaced by a sentinel that sorts last (65535 in
+    uint16 when `integral` values fit in it, +inf otherwise), and sorted by a sorting network of
+    element-wise min/max over whole (y, x) slices. The median then sits at positions
+    (n-1)//2 and n//2 of each pixel, n being its number of valid values.
+    """
+    dtype = values.dtype
+    valid = ~np.isnan(values)
+    n_valid = valid.sum(axis=-1)
+
+    if integral:
+        work = np.moveaxis(np.where(valid, values, np.iinfo(np.uint16).max), -1, 0).astype(np.uint16, order='C')
+    else:
+        work = np.moveaxis(np.where(valid, values, np.inf), -1, 0).astype(dtype, order='C')
+    del valid
+
+    for i, j in _median_network(work.shape[0]):
+        low = np.minimum(work[i], work[j])
+        np.maximum(work[i], work[j], out=work[j])
+        work[i] = low
+
+    lower = np.take_along_axis(work, np.maximum(n_valid - 1, 0)[None] // 2, axis=0)[0].astype(dtype)
+    upper = np.take_along_axis(work, (n_valid // 2)[None], axis=0)[0].astype(dtype)
+    median = (lower + upper) / dtype.type(2)
+    median[n_valid == 0] = np.nan
+    return median.astype(dtype, copy=False)
+
+
+def nanmedian_time(ds, dim='time', integral_vars=()):
+    """
+    Median over `dim` of a Dataset of float (time,y,x) variables, skipping NaN: a drop-in for
+    `ds.median(dim=dim)` giving bit-identical results, but without np.nanmedian's per-pixel copies
+    and sorts. Runs block by block under dask (`dim` is brought into a single chunk).
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Float variables with NaN for NoData.
+    dim : str
+        Dimension to reduce.
+    integral_vars : iterable of str
+        Variables holding whole numbers within the uint16 range (e.g. the masked reflectance bands),
+        sorted as uint16 instead of floats.
+
+    Returns
+    -------
+    xr.Dataset
+        Median of each variable, in its input dtype.
+    """
+    out = {}
+    for v, da in ds.data_vars.items():
+        if not np.issubdtype(da.dtype, np.floating):
+            raise TypeError(f"'{v}' is {da.dtype}: nanmedian_time expects float variables with NaN for NoData")
+        if da.chunks is not None:
+            da = da.chunk({dim: -1})
+        out[v] = xr.apply_ufunc(
+            _nanmedian_last_axis,
+            da,
+            input_core_dims=[[dim]],
+            kwargs=dict(integral=v in integral_vars),
+            dask='parallelized',
+            output_dtypes=[da.dtype],
+        )
+    return xr.Dataset(out)
+
+
+def write_scene_stack(ds, path, scene_ids, complevel=4):
+    """
+    Write the masked uint16 (time,y,x) scene stack of a composite to a compressed NetCDF sidecar,
+    with the IDs of the scenes it holds, so that the composite can later be updated from new scenes
+    only. The file is written next to its final path and renamed, so a failed write never leaves a
+    stack that disagrees with its scene IDs.
+    """
+    encoding = {
+        v: dict(zlib=True, complevel=complevel, shuffle=True, chunksizes=(1, min(512, ds.sizes['y']), min(512, ds.sizes['x'])))
+        for v in ds.data_vars
+    }
+    stack = ds.assign_attrs({'composite:input': '\n'.join(scene_ids)})
+    tmp_path = f'{path}.tmp'
+    stack.to_netcdf(tmp_path, engine='netcdf4', encoding=encoding)
+    os.replace(tmp_path, path)
+    logging.info(f'Saved scene stack of {len(scene_ids)} scenes ({ds.sizes["time"]} dates) to {path}')
+
+
+def read_scene_stack(path, geobox):
+    """
+    Read a scene stack sidecar written by `write_scene_stack` onto the tile `geobox`.
+
+    Returns
+    -------
+    tuple[xr.Dataset, list[str]]
+        The uint16 (time,y,x) stack, loaded in memory, and the IDs of the scenes it holds.
+    """
+    with xr.open_dataset(path, engine='netcdf4', mask_and_scale=False) as stack:
+        stack = stack.load()
+    scene_ids = [i for i in stack.attrs.pop('composite:input', '').split('\n') if i]
+    stack = stack.drop_vars('spatial_ref', errors='ignore').odc.assign_crs(geobox.crs)
+    logging.info(f'Read scene stack of {len(scene_ids)} scenes ({stack.sizes["time"]} dates) from {path}')
+    return stack, scene_ids
+
+
+def crop_shared_stack(ds, items, tile_geobox):
+    """
+    Pixels of `tile_geobox` and dates of `items` out of a time series loaded once on a larger GeoBox of the
+    same pixel grid (scene-major compositing). Raises ValueError if the tile is not aligned with it.
+    """
+    roi = ds.odc.geobox.overlap_roi(tile_geobox)
+    ds = ds.isel(y=roi[0], x=roi[1])
+    if ds.odc.geobox != tile_geobox:
+        raise ValueError(f'Tile GeoBox is not aligned with the shared GeoBox: {tile_geobox} vs {ds.odc.geobox}')
+    times = np.unique([np.datetime64(i.datetime.astimezone(datetime.timezone.utc).replace(tzinfo=None), 'ns') for i in items])
+    return ds.isel(time=np.isin(ds.time.values, times))
+
+
 def save_dataset_preview(ds, var_name, save_path, dpi=300, col_wrap=4, **plot_kwargs):
     """
     Create a FacetGrid preview of a variable in a Dataset over time and save as a JPEG.
@@ -333,6 +759,10 @@ def save_dataset_preview(ds, var_name, save_path, dpi=300, col_wrap=4, **plot_kw
 
     # fg = ds[var_name].plot(col='time', col_wrap=col_wrap, **plot_kwargs)
     da = ds[var_name]
+    if da.chunks is not None:
+        # lazy cube: quantiles cannot reduce across dask chunks, and plotting would materialise the
+        # full stack, so the preview is rendered from every 4th pixel
+        da = da.isel(y=slice(None, None, 4), x=slice(None, None, 4)).compute()
     da_valid = da.where(da != 0)                     # mask nodata=0 so it doesn’t skew scaling
 
     # pick sensible bounds from quantiles across all times (lazy-safe with dask)
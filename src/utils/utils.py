@@ -15,6 +15,7 @@
 
 import os, json, datetime, argparse
 import logging
+from contextlib import contextmanager
 from pathlib import Path
 import geopandas as gpd
 from shapely.geometry import mapping
@@ -67,6 +68,24 @@ def setup_logger(logger_name, logger_path, logger_format):
     return logger
 
 
+@contextmanager
+def job_log_handler(logger_path, logger_format):
+    """
+    Temporarily attach a FileHandler to the root logger, so that a job run in-process
+    (e.g. on a shared worker pool) still writes its own log file, as a single-shot subprocess does.
+    """
+    mkdir(os.path.dirname(logger_path))
+    handler = logging.FileHandler(logger_path, encoding="utf-8", errors="strict")
+    handler.setFormatter(logging.Formatter(logger_format))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    try:
+        yield handler
+    finally:
+        root.removeHandler(handler)
+        handler.close()
+
+
 def generate_geojson_files_for_composites(
     output_dir="../geojsons/compgen",
     tile_geojson_filepath="../anciliary/grid_20_v2.geojson",
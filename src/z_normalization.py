@@ -22,14 +22,19 @@ import xarray as xr
 import rioxarray as rxr
 
 import datetime
-import calendar
+import json
 
 import time
 from pathlib import Path
 
+from baseline import SPECTRAL_INDICES, find_baselines
+from baseline_stats import month_bounds
 from utils.metadata import prepare_eo3_metadata_NAS, reorder_measurements
 from utils.utils import mkdir, setup_logger
 from utils.utils import nas_patch
+from utils.cog_writer import write_cogs
+from utils.running_stats import find_composites, z_scores
+from climatology import find_climatology
 
 import warnings
 import logging
@@ -38,213 +43,312 @@ warnings.filterwarnings('ignore')
 logging.getLogger("distributed.worker.memory").setLevel(logging.ERROR)
 
 
-def z_normalization(year_month: str, tile_id: str):
-    logging.info('#######################################################################')
-    
-    client = None
-    cluster = None
-    
+# MAD of a normal distribution = 0.6745 sigma: robust z-scores divide by 1.4826 MAD
+MAD_TO_SIGMA = 1.4826
+
+NASROOT = '//nas-rs.topo.auth.gr/Latomeia/DROUGHT'
+PRODUCT_NAME = 'z_normalized'
+
+
+def decode_baseline(ds_base, centre='mean', spread='std', spread_scale=1, spectral_indices=SPECTRAL_INDICES):
+    """
+    Decode the int16 centre/spread layers of a baseline dataset ONCE, for any number of composites.
+
+    Returns
+    -------
+    dict
+        index -> (centre, spread * `spread_scale`), float32 numpy arrays, NaN where the baseline is nodata: the
+        `z_scores` kernel then needs neither a nodata mask of the baseline nor a cast or scaling per composite.
+    """
+    layers = {}
+    for si in spectral_indices:
+        mu, sigma = ds_base[f'{si}_{centre}'], ds_base[f'{si}_{spread}']
+        nodata = mu.attrs.get('nodata', -32768)
+        missing = (mu.values == nodata) | (sigma.values == sigma.attrs.get('nodata', nodata))
+        c = mu.values.astype('float32')
+        s = sigma.values.astype('float32')
+        if spread_scale != 1:
+            s *= np.float32(spread_scale)
+        c[missing] = np.nan
+        s[missing] = np.nan
+        layers[si] = (c, s)
+    return layers
+
+
+def load_normalization_baseline(dc, tile_id, month=None, climatology=False, clim_window=None, robust=False, baseline_start=None, baseline_end=None):
+    """
+    The baseline a composite of a tile is normalized with, in ONE `dc.load` of its 6 layers, decoded to float32.
+
+    Parameters
+    ----------
+    month : int
+        Calendar month of the composites, with `climatology` (the `climatology` of that month, of `clim_window`
+        months on each side if given). Otherwise the all-months `baseline`, or `baseline_robust` with `robust`.
+    baseline_start, baseline_end : str
+        Window ('YYYY-MM-DD') of the `baseline` / `baseline_robust`: needed when the tile has baselines of several
+        windows (`baseline_window.py`).
+
+    Returns
+    -------
+    (dict, dict, GeoBox)
+        index -> (centre, spread) float32 (see `decode_baseline`), the `znorm:*` properties of the z_normalized
+        datasets, and the GeoBox of the baseline (the grid the composites are loaded on).
+    """
+    if robust and climatology:
+        raise ValueError('Robust z-scores are computed from the all-months baseline_robust, not from a climatology')
+    centre, spread, spread_scale = ('median', 'mad', MAD_TO_SIGMA) if robust else ('mean', 'std', 1)
+    if climatology:
+        clim_dataset = find_climatology(dc, tile_id, month, clim_window)
+        base_query = dict(datasets=[clim_dataset])
+        properties = {'znorm:baseline': 'climatology', 'clim:window': clim_dataset.metadata_doc['properties'].get('clim:window')}
+        logging.info(f'Climatology of month {month}: {clim_dataset.id}')
+    else:
+        product_name = 'baseline_robust' if robust else 'baseline'
+        datasets = find_baselines(dc, tile_id, baseline_start, baseline_end, product_name)
+        windows = ', '.join(f'{d.time.begin:%Y-%m-%d} to {d.time.end:%Y-%m-%d}' for d in datasets)
+        if not datasets:
+            raise ValueError(f'No {product_name} dataset of tile {tile_id}' + (f' for the window {baseline_start} to {baseline_end}' if baseline_start or baseline_end else ''))
+        if len(datasets) > 1:
+            raise ValueError(f'{len(datasets)} {product_name} datasets of tile {tile_id} ({windows}): select one with baseline_start/baseline_end')
+        base_query = dict(product=product_name, datasets=datasets)
+        properties = {'znorm:baseline': 'baseline_robust'} if robust else None
+        logging.info(f'{product_name} {windows}: {datasets[0].id}')
+
+    ds_base = dc.load(
+        **base_query,
+        measurements=[f'{si}_{stat}' for si in SPECTRAL_INDICES for stat in (centre, spread)],
+        patch_url=nas_patch
+    ).squeeze()
+    layers = decode_baseline(ds_base, centre, spread, spread_scale)
+    logging.info(f'Loaded baseline ({base_query.get("product", "climatology")}): {round(sum(c.nbytes + s.nbytes for c, s in layers.values())/1024**2)} MiB float32')
+    return layers, properties, ds_base.odc.geobox
+
+
+def z_normalized_dataset(ds_comp, layers):
+    """`z_normalized` dataset ({index}_z, float32, nodata NaN) of one 2-D composite against a decoded baseline."""
+    z_vars = {}
+    for si, (mu, sigma) in layers.items():
+        x = ds_comp[si]
+        z_vars[f'{si}_z'] = xr.DataArray(
+            z_scores(x.values, mu, sigma, nodata=x.attrs.get('nodata', -32768)),
+            coords=x.coords, dims=x.dims,
+        )
+    ds_znorm = xr.Dataset(z_vars)
+    for var in list(ds_znorm.data_vars):
+        ds_znorm[var] = ds_znorm[var].rio.write_nodata(np.nan, inplace=True) # _FillValue
+        ds_znorm[var].encoding.update({"dtype": 'float32'})
+    return ds_znorm
+
+
+def write_z_normalized(dc, ds_znorm, tile_id, year_month, properties=None):
+    """Write the `z_normalized` dataset of a tile-month as COGs with their EO3/STAC metadata, and index it."""
     dt = datetime.datetime.strptime(year_month, "%Y-%m")
-    start_date = dt.replace(day=1).strftime("%Y-%m-%d")
-    last_day = calendar.monthrange(dt.year, dt.month)[1]
-    end_date = dt.replace(day=last_day).strftime("%Y-%m-%d")
-    datetime_list = [int(start_date[:4]), int(start_date[5:7]), int(start_date[8:10])] 
-    
-    dc = datacube.Datacube(app='znorm', env='drought')
-    
-    start_time = time.time()
-    logging.info(f'Starting Z-Normalization for {tile_id} | {year_month}')
-
-    logging.info('Create directories and naming conversions')   
-    NASROOT='//nas-rs.topo.auth.gr/Latomeia/DROUGHT'
-    PRODUCT_NAME = 'z_normalized'
+    start_date, end_date = month_bounds(year_month)
+    datetime_list = [dt.year, dt.month, 1]
+
     FOLDER=f'{PRODUCT_NAME}/{tile_id.split('_')[0]}/{tile_id.split('_')[1]}/{datetime_list[0]}/{datetime_list[1]}/01'
     DATASET= f'S2L2A_znorm_{tile_id.replace('_','')}_{datetime_list[0]}{datetime_list[1]}'
-    
-    collection_path = f"{NASROOT}/{PRODUCT_NAME}"
     dataset_path = f"{NASROOT}/{FOLDER}"
     mkdir(dataset_path)
     eo3_path = f'{dataset_path}/{DATASET}.odc-metadata.yaml'
     stac_path = f'{dataset_path}/{DATASET}.stac-metadata.json'
-    log.info(f'Dataset location: {dataset_path}')
-    
-    try:
-        z_norm_vi_list = []
-        for spectral_index in ["NDVI", "EVI", "PSRI2"]:
-            logging.info(f'Z-Normalization | {spectral_index}')
-            
-            ds_base = dc.load(
-                product='baseline',
-                region_code=tile_id.replace('_',''),
-                measurements=[f'{spectral_index}_mean', f'{spectral_index}_std'],
-                # dask_chunks=dict(x=512, y=512),
-                patch_url=nas_patch
-            ).squeeze()
-            logging.info(f'Loaded baseline')
-            
-            for var in list(ds_base.data_vars):
-                logging.info(f'Set up values | {var}')
-                ds_base[var] = (
-                    ds_base[var]
-                    .where(ds_base[var] != ds_base[var].attrs.get('nodata', -32768))
-                    .astype('float16')
-                )
-
-            ds_comp = dc.load(
-                product='composites',
-                region_code=tile_id.replace('_',''),
-                time=year_month,
-                measurements=spectral_index,
-                # dask_chunks=dict(x=512, y=512),
-                patch_url=nas_patch
-            )
-            logging.info(f'Loaded composite')
-            
-            logging.info(f'Set up values | {spectral_index}')
-            ds_comp[spectral_index] = (
-                ds_comp[spectral_index]
-                .where(ds_comp[spectral_index] != ds_comp[spectral_index].attrs.get('nodata', -32768))
-                .astype('float16')
-            )
-            
-            logging.info(f'Setting up normalization ... ')
-            x = ds_comp[spectral_index]
-            mu = ds_base[f'{spectral_index}_mean']
-            sigma = ds_base[f'{spectral_index}_std']
-            logging.info(f'Setting up normalization ... done')
-
-            logging.info(f'Normalizing ... ')
-            ds_znorm_vi = ((x - mu) / sigma).astype('float32')
-            del x, mu, sigma
-            ds_znorm_vi.name = f"{spectral_index}_z"
-            ds_znorm_vi = ds_znorm_vi.to_dataset()
-            logging.info(f'Normalizing ... done')
-            
-            z_norm_vi_list.append(ds_znorm_vi)
-            del ds_znorm_vi
+    logging.info(f'Dataset location: {dataset_path}')
+
+    logging.info('Assign time range and tile ID in metadata')
+    ds_znorm.attrs['dtr:start_datetime']=start_date
+    ds_znorm.attrs['dtr:end_datetime']=end_date
+    ds_znorm.attrs['odc:region_code']=tile_id
+
+    logging.info('Write bands to raster COG files')
+    name_measurements = list(write_cogs(ds_znorm, lambda var: f'{dataset_path}/{DATASET}_{var}.tif').values())
+
+    logging.info(f'Assert relative paths and product measurements are matched')
+    relative_name_measurements = [p.split("/")[-1] for p in name_measurements]
+    relative_name_measurements = reorder_measurements(
+        product=PRODUCT_NAME,
+        relative_name_measurements=relative_name_measurements,
+        dc=dc)
+
+    logging.info('Prepare metadata YAML document')
+    eo3_doc, stac_doc = prepare_eo3_metadata_NAS(
+        dc=dc,
+        xr_cube=ds_znorm,
+        collection_path=Path(NASROOT),
+        dataset_name=DATASET,
+        product_name=PRODUCT_NAME,
+        product_family='ard',
+        bands=list(ds_znorm.data_vars),
+        name_measurements=relative_name_measurements,
+        datetime_list=datetime_list,
+        set_range=False,
+        lineage_path=None,
+        version=1,
+        properties=properties,
+        )
+
+    logging.info('Write metadata YAML document to disk')
+    serialise.to_path(Path(eo3_path), eo3_doc)
+    with open(stac_path, 'w') as json_file:
+        json.dump(stac_doc, json_file, indent=4, default=False)
+
+    logging.info('Create datacube.model.Dataset from eo3 metadata')
+    WORKING_ON_CLOUD=False
+    uri = eo3_path if WORKING_ON_CLOUD else f"file:///{eo3_path}"
+
+    resolver = Doc2Dataset(dc.index)
+    dataset_tobe_indexed, err  = resolver(doc_in=serialise.to_doc(eo3_doc), uri=uri)
+    if err:
+        raise RuntimeError(f'Tile {tile_id} | Time: {year_month} | {err}')
+
+    logging.info('Index to datacube')
+    dc.index.datasets.add(dataset=dataset_tobe_indexed, with_lineage=False)
+
+
+def z_normalization_batch(tile_id: str, start_month: str, end_month: str, climatology=False, clim_window=None, robust=False, skip_indexed=False, dc=None,
+                          baseline_start=None, baseline_end=None):
+    """
+    Z-normalize every composite of a tile from `start_month` to `end_month` (YYYY-MM, included), loading and
+    decoding the baseline ONCE for all of them.
+
+    The composites are streamed one month at a time through the float32 `z_scores` kernel, and each month's
+    `z_normalized` dataset is written and indexed as soon as it is computed: a failure loses that month only.
+    With `climatology`, the months are processed grouped by calendar month, so that each of the 12 climatologies
+    is loaded once and only one is held in memory. `skip_indexed` leaves out the months already indexed.
+    `baseline_start`/`baseline_end` select the window of the baseline (see `load_normalization_baseline`).
+
+    Returns
+    -------
+    list of str
+        The months that failed.
+    """
+    if robust and climatology:
+        raise ValueError('Robust z-scores are computed from the all-months baseline_robust, not from a climatology')
+    dc = dc or datacube.Datacube(app='znorm', env='drought')
+    batch_start = time.time()
+    logging.info('#######################################################################')
+    logging.info(f'Starting Z-Normalization for {tile_id} | {start_month} to {end_month}')
+
+    datasets = find_composites(dc, tile_id, (month_bounds(start_month)[0], month_bounds(end_month)[1]))
+    if skip_indexed:
+        indexed = {
+            d.center_time.strftime('%Y-%m') for d in dc.find_datasets(
+                product=PRODUCT_NAME, region_code=tile_id.replace('_',''),
+                time=(month_bounds(start_month)[0], month_bounds(end_month)[1]))
+        }
+        datasets = [d for d in datasets if d.center_time.strftime('%Y-%m') not in indexed]
+        logging.info(f'{len(indexed)} months already indexed, skipped')
+
+    groups = {}
+    for dataset in datasets:
+        groups.setdefault(dataset.center_time.month if climatology else None, []).append(dataset)
+
+    failed, done = [], 0
+    for month, group in groups.items():
+        try:
+            layers, properties, geobox = load_normalization_baseline(dc, tile_id, month, climatology, clim_window, robust, baseline_start, baseline_end)
+        except Exception as error:
+            logging.error(f'✖✖✖ FAILED to load the baseline of Tile {tile_id}' + (f' | month {month}' if month else '') + f' | with Exception: {error}')
+            failed += [d.center_time.strftime('%Y-%m') for d in group]
+            continue
+
+        for dataset in group:
+            year_month = dataset.center_time.strftime('%Y-%m')
+            start_time = time.time()
+            try:
+                logging.info(f'Z-Normalization | {tile_id} | {year_month}')
+                ds_comp = dc.load(
+                    datasets=[dataset],
+                    measurements=list(layers),
+                    like=geobox,
+                    patch_url=nas_patch
+                ).isel(time=0)
+                ds_znorm = z_normalized_dataset(ds_comp, layers)
+                del ds_comp
+                write_z_normalized(dc, ds_znorm, tile_id, year_month, properties)
+                del ds_znorm
+                done += 1
+                logging.info(f'             ✔✔✔ COMPLETED: Tile {tile_id} | Time: {year_month} | In {round(time.time() - start_time, 1)} s')
+            except Exception as VI_error:
+                logging.error(f'✖✖✖ FAILED for : Tile {tile_id} | Time: {year_month} | with Exception: {VI_error}') # ✗
+                failed.append(year_month)
             gc.collect()
-        
-        logging.info(f'Merging into one dataset')
-        ds_znorm = xr.merge(z_norm_vi_list)
-        if len(ds_znorm.dims):
-            ds_znorm = ds_znorm.squeeze()
-        
-        
-        logging.info('Scale and Define data types & nodata per band')
-        for var in list(ds_znorm.data_vars):
-            scale = 1 
-            dtype = 'float32'
-            nodata = np.nan #-32768
-            # ds_znorm[var] = (ds_znorm[var]*scale).round()
-            # ds_znorm[var] = ds_znorm[var].fillna(nodata).astype(dtype)
-            ds_znorm[var] = ds_znorm[var].rio.write_nodata(nodata, inplace=True) # _FillValue 
-            ds_znorm[var].encoding.update({"dtype": dtype})
-            # composite[si].encoding["scale_factor"] = 1/scale
-
-
-        logging.info('Assign time range and tile ID in metadata')
-        ds_znorm.attrs['dtr:start_datetime']=start_date
-        ds_znorm.attrs['dtr:end_datetime']=end_date
-        ds_znorm.attrs['odc:region_code']=tile_id
-        
-        
-        logging.info('Write bands to raster COG files')
-        name_measurements = []
-        for var in list(ds_znorm.data_vars):
-            file_path = f'{dataset_path}/{DATASET}_{var}.tif'
-            
-            ds_znorm[var].rio.to_raster(
-                raster_path=file_path, 
-                driver='COG',
-                dtype=str(ds_znorm[var].dtype),
-                windowed=True
-                )
-            name_measurements.append(file_path)
-            
-            logging.info(f'Write {var.upper()} -> {file_path}')
-            
-        logging.info(f'Assert relative paths and product measurements are matched')
-        relative_name_measurements = [p.split("/")[-1] for p in name_measurements]
-        relative_name_measurements = reorder_measurements(
-            product=PRODUCT_NAME, 
-            relative_name_measurements=relative_name_measurements)
-        
-        logging.info('Prepare metadata YAML document')
-        eo3_doc, stac_doc = prepare_eo3_metadata_NAS(
-            dc=dc,
-            xr_cube=ds_znorm, 
-            collection_path=Path(NASROOT),
-            dataset_name=DATASET,
-            product_name=PRODUCT_NAME,
-            product_family='ard',
-            bands=list(ds_znorm.data_vars),
-            name_measurements=relative_name_measurements,
-            datetime_list=datetime_list,
-            set_range=False,
-            lineage_path=None,
-            version=1,
-            )
-        
-        del ds_znorm
+        del layers
         gc.collect()
-        
-        
-        logging.info('Write metadata YAML document to disk')
-        serialise.to_path(Path(eo3_path), eo3_doc)
-        with open(stac_path, 'w') as json_file:
-            json.dump(stac_doc, json_file, indent=4, default=False)
-        
-        logging.info('Create datacube.model.Dataset from eo3 metadata')
-        WORKING_ON_CLOUD=False
-        uri = eo3_path if WORKING_ON_CLOUD else f"file:///{eo3_path}"
 
-        resolver = Doc2Dataset(dc.index)
-        dataset_tobe_indexed, err  = resolver(doc_in=serialise.to_doc(eo3_doc), uri=uri)
-        
-        if err:
-            msg=f'             ✖✖✖ FAILED : Tile {tile_id} | Time: {year_month} | with Exception: {err}' # ✗
-            logging.error(msg)
-            logging.info('#######################################################################')
-            raise RuntimeError(msg)
-            
-        logging.info('Index to datacube')
-        dc.index.datasets.add(dataset=dataset_tobe_indexed, with_lineage=False)
-        
-        logging.info(f'')
-        logging.info(f'             ✔✔✔ COMPLETED: Tile {tile_id} | Time: {year_month} | In {round((time.time() - start_time)/60, 2)} minutes')
-        logging.info(f'')
+    logging.info(f'✔ {done}/{done + len(failed)} months of Tile {tile_id} z-normalized in {round((time.time() - batch_start)/60, 2)} minutes'
+                 + (f' | {round((time.time() - batch_start)/done, 1)} s per month' if done else ''))
+    logging.info('#######################################################################')
+    return sorted(failed)
+
+
+def z_normalization(year_month: str, tile_id: str, climatology=False, clim_window=None, robust=False, baseline_start=None, baseline_end=None):
+    """
+    Z-normalized NDVI, EVI and PSRI2 of the composite of a tile-month, written and indexed as a `z_normalized` dataset.
+
+    By default the composite is compared to the all-months `baseline` of the tile. `climatology` compares it to the
+    `climatology` of its calendar month instead (of `clim_window` months on each side, if given), so that the
+    seasonal cycle does not inflate σ. `robust` computes robust z-scores, (x - median) / (1.4826 MAD), from the
+    `baseline_robust` of the tile. `baseline_start`/`baseline_end` select the window of the baseline when the tile
+    has several. A batch of one month: see `z_normalization_batch` for several months. Errors are logged, not
+    raised: returns [`year_month`] if the month failed, [] otherwise.
+    """
+    try:
+        return z_normalization_batch(tile_id, year_month, year_month, climatology, clim_window, robust,
+                                     baseline_start=baseline_start, baseline_end=baseline_end)
     except Exception as VI_error:
         logging.error(f'✖✖✖ FAILED for : Tile {tile_id} | with Exception: {VI_error}') # ✗
         logging.info('#######################################################################')
-    finally:
-        try:
-            if client is not None:
-                logging.info('Closing Dask client')
-                client.close()
-        finally:
-            if cluster is not None:
-                logging.info('Closing Dask cluster')
-                logging.info('#######################################################################')
-                cluster.close()
-            else:
-                logging.info('#######################################################################')
- 
+        return [year_month]
+
 
 if __name__ == "__main__":
-    import argparse, json, sys, os, pytz
-    import datetime
-    from utils.utils import setup_logger
+    import argparse, sys, pytz
 
-    p = argparse.ArgumentParser(description="Run ONE z-normalization from a single .geojson and exit.")
-    p.add_argument("--geojson", required=True, help="Path to a single GeoJSON file")
+    p = argparse.ArgumentParser(description="Run ONE z-normalization from a single .geojson, or from a job of a plan, or a batch of months of a tile, and exit.")
+    p.add_argument("--geojson", default=None, help="Path to a single GeoJSON file")
+    p.add_argument("--plan", default=None, help="Plan exported by run_z_normalization.py (with --job)")
+    p.add_argument("--job", default=None, help="Key of the job in --plan")
+    p.add_argument("--tile", default=None, help="Batch mode: tile ID whose months --start to --end are normalized with one baseline load")
+    p.add_argument("--start", default=None, help="Batch mode: first month, YYYY-MM")
+    p.add_argument("--end", default=None, help="Batch mode: last month, YYYY-MM")
+    p.add_argument("--skip-indexed", action="store_true", help="Batch mode: leave out the months already indexed")
+    p.add_argument("--climatology", action="store_true", help="Normalize with the climatology of the calendar month instead of the all-months baseline")
+    p.add_argument("--clim-window", type=int, default=None, help="Window (months on each side) of the climatology, with --climatology")
+    p.add_argument("--robust", action="store_true", help="Robust z-scores from the median and MAD of the baseline_robust")
+    p.add_argument("--baseline-start", default=None, help="Start (YYYY-MM-DD) of the baseline window, when the tile has baselines of several windows")
+    p.add_argument("--baseline-end", default=None, help="End (YYYY-MM-DD) of the baseline window")
     args = p.parse_args()
+    modes = [args.geojson is not None, args.plan is not None and args.job is not None, args.tile is not None]
+    if sum(modes) != 1:
+        p.error("give either --geojson, or --plan and --job, or --tile with --start and --end")
+    if args.tile and (args.start is None or args.end is None):
+        p.error("--tile needs --start and --end")
 
     try:
-        with open(args.geojson, "r", encoding="utf-8") as f:
-            d = json.load(f)
-        year_month = d["properties"]["year_month"]
-        tile_id    = d["properties"]["tile_id"]
-        tile_geom  = d["geometry"]
+        if args.tile:
+            log = setup_logger(
+                logger_name='znorm_',
+                logger_path=f'../logs/znorm/znorm_{args.start}_{args.end}_{args.tile}_{datetime.datetime.now(pytz.timezone("Europe/Athens")).strftime("%Y%m%dT%H%M%S")}.log',
+                logger_format='%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s',
+            )
+            failed = z_normalization_batch(
+                args.tile, args.start, args.end,
+                climatology=args.climatology, clim_window=args.clim_window, robust=args.robust, skip_indexed=args.skip_indexed,
+                baseline_start=args.baseline_start, baseline_end=args.baseline_end)
+            if failed:
+                logging.error(f'Failed months of {args.tile}: {", ".join(failed)}')
+            sys.exit(1 if failed else 0)
+
+        if args.plan:
+            from utils.planner import read_plan_job
+            job = read_plan_job(args.plan, args.job)
+            year_month, tile_id = job.year_month, job.tile_id
+        else:
+            with open(args.geojson, "r", encoding="utf-8") as f:
+                d = json.load(f)
+            year_month = d["properties"]["year_month"]
+            tile_id    = d["properties"]["tile_id"]
+            tile_geom  = d["geometry"]
         
         log = setup_logger(
             logger_name='znorm_',
@@ -252,9 +356,10 @@ if __name__ == "__main__":
             logger_format='%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s',
         )
 
-        z_normalization(year_month=year_month, tile_id=tile_id)
-        sys.exit(0)         # success (including "skipped" is still success)
+        failed = z_normalization(year_month=year_month, tile_id=tile_id, climatology=args.climatology, clim_window=args.clim_window, robust=args.robust,
+                                 baseline_start=args.baseline_start, baseline_end=args.baseline_end)
+        sys.exit(1 if failed else 0)    # a failed month must not be recorded as done by the drivers
     except Exception:
         import logging
-        logging.exception("Fatal error in composites.py")
+        logging.exception("Fatal error in z_normalization.py")
         sys.exit(1)        # fail
\ No newline at end of file
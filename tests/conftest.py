@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of the repository are imported as in src/ (e.g. `from utils.staging import ...`)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
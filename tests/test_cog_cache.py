@@ -0,0 +1,122 @@
+'''
+Tests of the COG block cache of utils/cog_cache.py: a local HTTP server stands in for the blob store.
+'''
+
+import http.server
+import threading
+from functools import partial
+
+import numpy as np
+import pytest
+import requests
+
+from utils.benchmarking import ByteCountingHTTPServer
+from utils.cog_cache import BlockCache, CachingCOGProxy
+
+
+BLOCK = 1024
+FILE_SIZE = 10*BLOCK + 100      # ten full blocks and a short last one
+
+
+@pytest.fixture
+def remote(tmp_path):
+    folder = tmp_path / 'remote'
+    folder.mkdir()
+    payload = np.random.default_rng(0).integers(0, 256, FILE_SIZE, dtype='uint8').tobytes()
+    (folder / 'scene.tif').write_bytes(payload)
+    return folder, payload
+
+
+@pytest.fixture
+def server(remote):
+    server = ByteCountingHTTPServer(str(remote[0])).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class _NoRangeHandler(http.server.SimpleHTTPRequestHandler):
+    """Static file handler that ignores the Range header and answers 200 with the whole file."""
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _proxy(tmp_path, max_bytes=1024**3):
+    return CachingCOGProxy(BlockCache(str(tmp_path / 'cache'), max_bytes=max_bytes, block_size=BLOCK), retries=0).start()
+
+
+def _get(url, start, end):
+    response = requests.get(url, headers={'Range': f'bytes={start}-{end}'}, timeout=5)
+    assert response.status_code == 206
+    return response.content
+
+
+def _cached_bytes(cache):
+    return sum(size for _, size, _ in cache._entries())
+
+
+def test_same_bytes_hits_and_misses(tmp_path, remote, server):
+    _, payload = remote
+    proxy = _proxy(tmp_path)
+    url = f'{server.url}/scene.tif'
+    try:
+        ranges = [(0, 99), (1000, 3100), (FILE_SIZE - 500, FILE_SIZE - 1)]
+        for start, end in ranges:
+            assert _get(proxy.proxy_href(url), start, end) == _get(url, start, end) == payload[start:end + 1]
+        # blocks 0 | 0-3 | 9-10: block 0 is read twice
+        assert (proxy.stats.hits, proxy.stats.misses) == (1, 6)
+        upstream = server.requests
+
+        # the blocks of the second pass are all cached: no upstream request
+        for start, end in ranges:
+            assert _get(proxy.proxy_href(url), start, end) == payload[start:end + 1]
+        assert (proxy.stats.hits, proxy.stats.misses) == (1 + 7, 6)
+        assert server.requests == upstream
+    finally:
+        proxy.shutdown()
+        proxy.server_close()
+
+
+def test_eviction_under_cap(tmp_path, remote, server):
+    _, payload = remote
+    proxy = _proxy(tmp_path, max_bytes=4*BLOCK)
+    url = f'{server.url}/scene.tif'
+    try:
+        for i in range(FILE_SIZE // BLOCK + 1):
+            start = i*BLOCK
+            assert _get(proxy.proxy_href(url), start, min(start + BLOCK, FILE_SIZE) - 1) == payload[start:start + BLOCK]
+            assert _cached_bytes(proxy.cache) <= 4*BLOCK
+        assert proxy.cache._size == _cached_bytes(proxy.cache)
+
+        # the first block was the least recently used: evicted, fetched again
+        misses = proxy.stats.misses
+        assert _get(proxy.proxy_href(url), 0, 99) == payload[:100]
+        assert proxy.stats.misses == misses + 1
+    finally:
+        proxy.shutdown()
+        proxy.server_close()
+
+
+def test_rewritten_block_size(tmp_path):
+    cache = BlockCache(str(tmp_path / 'cache'), max_bytes=1024**3, block_size=BLOCK)
+    for _ in range(3):
+        cache.put_block('https://store/scene.tif', 0, b'x'*BLOCK)
+    assert cache._size == _cached_bytes(cache) == BLOCK
+
+
+def test_range_ignored_upstream_not_cached(tmp_path, remote):
+    folder, payload = remote
+    plain = http.server.ThreadingHTTPServer(('127.0.0.1', 0), partial(_NoRangeHandler, directory=str(folder)))
+    threading.Thread(target=plain.serve_forever, daemon=True).start()
+    proxy = _proxy(tmp_path)
+    url = f'http://127.0.0.1:{plain.server_address[1]}/scene.tif'
+    try:
+        proxy.cache.put_size(url, FILE_SIZE)      # the size probe needs a 206
+        assert _get(proxy.proxy_href(url), 1500, 2600) == payload[1500:2601]
+        assert all(proxy.cache.get_block(url, i) is None for i in range(FILE_SIZE // BLOCK + 1))
+    finally:
+        proxy.shutdown()
+        proxy.server_close()
+        plain.shutdown()
+        plain.server_close()
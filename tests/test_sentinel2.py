@@ -0,0 +1,87 @@
+'''
+Tests of the GRI refinement check of utils/sentinel2.py: a local HTTP server stands in for Planetary Computer,
+serving MTD_DS.xml fixtures.
+'''
+
+import datetime
+import logging
+
+import pystac
+import pytest
+
+from utils.benchmarking import ByteCountingHTTPServer
+from utils.sentinel2 import check_gri_refinement
+
+
+MTD_DS = """<?xml version="1.0" encoding="UTF-8"?>
+<n1:Level-2A_DataStrip_ID xmlns:n1="https://psd-14.sentinel2.eo.esa.int/PSD/S2_PDI_Level-2A_Datastrip_Metadata.xsd">
+  <Image_Data_Info>
+    <Geometric_Info metadataLevel="Standard">
+      <RGM>COMPUTED</RGM>
+      <Image_Refining flag="{flag}"/>
+    </Geometric_Info>
+  </Image_Data_Info>
+</n1:Level-2A_DataStrip_ID>
+"""
+
+
+def _item(item_id, href=None):
+    item = pystac.Item(id=item_id, geometry=None, bbox=None, datetime=datetime.datetime(2024, 5, 1), properties={})
+    if href is not None:
+        item.add_asset('datastrip-metadata', pystac.Asset(href=href, media_type='application/xml'))
+    return item
+
+
+@pytest.fixture
+def server(tmp_path):
+    for name, flag in (('refined', 'REFINED'), ('not_refined', 'NOT_REFINED')):
+        (tmp_path / f'{name}_MTD_DS.xml').write_text(MTD_DS.format(flag=flag))
+    (tmp_path / 'truncated_MTD_DS.xml').write_text(MTD_DS.format(flag='REFINED')[:200])
+    server = ByteCountingHTTPServer(str(tmp_path)).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def items(server):
+    return [
+        _item('S2A_REFINED', f'{server.url}/refined_MTD_DS.xml'),
+        _item('S2B_NOT_REFINED', f'{server.url}/not_refined_MTD_DS.xml'),
+        _item('S2A_MISSING', f'{server.url}/missing_MTD_DS.xml'),          # 404
+        _item('S2B_MALFORMED', f'{server.url}/truncated_MTD_DS.xml'),      # not well-formed XML
+        _item('S2B_NO_ASSET'),                                             # no datastrip-metadata asset
+    ]
+
+
+def test_refinement_flags(items):
+    refined, status = check_gri_refinement(items, max_workers=2, retries=0, timeout=5, cache_path=None)
+
+    assert [i.id for i in refined] == ['S2A_REFINED']
+    assert dict(zip(status.item_id, status.refinement_status)) == {
+        'S2A_REFINED': 'REFINED',
+        'S2B_NOT_REFINED': 'NOT_REFINED',
+        'S2A_MISSING': 'Fetch Failed',
+        'S2B_MALFORMED': 'Fetch Failed',
+        'S2B_NO_ASSET': 'Metadata Not Found',
+    }
+
+
+def test_refinement_cache(tmp_path, server, items, caplog):
+    cache_path = str(tmp_path / 'cache' / 'gri.sqlite')
+    check_gri_refinement(items, max_workers=2, retries=0, timeout=5, cache_path=cache_path)
+    first_requests = server.requests
+    assert first_requests == 3                          # the three XML fixtures served
+
+    with caplog.at_level(logging.INFO):
+        _, status = check_gri_refinement(items, max_workers=2, retries=0, timeout=5, cache_path=cache_path)
+
+    # definitive flags come from the cache, failed fetches are retried, items without metadata are not cached
+    assert server.requests == first_requests + 1       # only the malformed XML is fetched again
+    assert dict(zip(status.item_id, status.refinement_status))['S2A_REFINED'] == 'REFINED'
+    sources = {item.id: line for item in items for line in caplog.messages if f' - {item.id} -> ' in line}
+    assert sources['S2A_REFINED'].endswith('(cached)')
+    assert sources['S2B_NOT_REFINED'].endswith('(cached)')
+    assert sources['S2A_MISSING'].endswith('(fetched)')
+    assert sources['S2B_MALFORMED'].endswith('(fetched)')
+    assert not sources['S2B_NO_ASSET'].endswith('(cached)')
@@ -0,0 +1,80 @@
+'''
+Tests of utils/staging.py: a local directory stands in for the NAS.
+'''
+
+import os
+
+import pytest
+
+from utils.staging import StagedDataset
+
+
+FOLDER = 'composites/x01/y02/2024/5/01'
+
+
+def _stage(tmp_path, files):
+    staged = StagedDataset(str(tmp_path / 'nas'), FOLDER, scratch_root=str(tmp_path / 'scratch'))
+    for name, content in files.items():
+        with open(f'{staged.local_path}/{name}', 'w') as f:
+            f.write(content)
+    return staged
+
+
+def _read_dir(path):
+    out = {}
+    for name in sorted(os.listdir(path)):
+        with open(f'{path}/{name}') as f:
+            out[name] = f.read()
+    return out
+
+
+def _leftovers(path):
+    return [n for n in os.listdir(os.path.dirname(path)) if '.partial-' in n or '.old-' in n]
+
+
+def test_publish_new_dataset(tmp_path):
+    staged = _stage(tmp_path, {'a.yaml': 'metadata', 'b.txt': 'scenes'})
+    staged.verify()
+    staged.publish()
+
+    assert _read_dir(staged.final_path) == {'a.yaml': 'metadata', 'b.txt': 'scenes'}
+    assert not os.path.exists(staged.local_path)
+    assert _leftovers(staged.final_path) == []
+
+
+def test_publish_replaces_existing_dataset(tmp_path):
+    previous = _stage(tmp_path, {'a.yaml': 'old metadata', 'stale.txt': 'only in the old dataset'})
+    previous.publish()
+
+    staged = _stage(tmp_path, {'a.yaml': 'new metadata'})
+    staged.verify()
+    staged.publish()
+
+    assert _read_dir(staged.final_path) == {'a.yaml': 'new metadata'}
+    assert not os.path.exists(staged.local_path)
+    assert _leftovers(staged.final_path) == []
+
+
+def test_publish_checksum_mismatch_keeps_previous_dataset(tmp_path):
+    previous = _stage(tmp_path, {'a.yaml': 'old metadata'})
+    previous.publish()
+
+    staged = _stage(tmp_path, {'a.yaml': 'new metadata'})
+    staged.verify()
+    with open(f'{staged.local_path}/a.yaml', 'w') as f:       # changed after its checksum was taken
+        f.write('corrupted')
+
+    with pytest.raises(RuntimeError, match='Checksum mismatch'):
+        staged.publish()
+
+    assert _read_dir(staged.final_path) == {'a.yaml': 'old metadata'}
+    assert os.path.exists(staged.local_path)                   # kept for a retry
+    assert _leftovers(staged.final_path) == []
+
+
+def test_not_staged_is_a_no_op(tmp_path):
+    staged = StagedDataset(str(tmp_path / 'nas'), FOLDER)
+    assert staged.local_path == staged.final_path
+    staged.verify()
+    staged.publish()
+    assert os.path.isdir(staged.final_path)